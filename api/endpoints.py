@@ -1,5 +1,5 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException,Depends
-import shutil
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException,Depends, Response, Request
+import asyncio
 from fastapi.responses import JSONResponse
 import os
 from fastapi import HTTPException
@@ -7,71 +7,64 @@ import logging
 from services.summary import stream_summary
 logger = logging.getLogger(__name__)
 from fastapi.responses import StreamingResponse
-from services.mcqs import MCQGeneratorGemini,MCQGeneratorMistral, MCQGeneratorChatGPT
-from pydantic import BaseModel
-from typing import List
+from services.mcqs import MCQ_GENERATORS, generate_mcqs_parallel, stream_mcqs, build_mcq_request, parse_mcqs, format_mcq
+from services.structured import StructuredOutputError
+from services.json_stream import stream_json_items
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+import time
 router = APIRouter()
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-from core.config import OPENAI_API_KEY
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+from core.config import BULK_ANSWER_MAX_SUBMISSIONS, BULK_ANSWER_ADMIN_USER_IDS, MCQ_MAX_BATCH_SIZE, MCQ_PARALLEL_MAX_WORKERS, REPORT_BATCH_MAX_FILES, REPORT_UPLOAD_MAX_BYTES, LLM_ROUTING, USAGE_ADMIN_USER_IDS
+from services.llm_gateway import ROUTING_MODES
 import json
-from services.report import process_pdf
-from datastorage.db_connect import save_student_report
-import re
-from services.auth import hash_password, verify_password, create_access_token, decode_access_token, get_user_by_username
+from services.report import get_or_process_report, process_report_batch
 from datetime import timedelta
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from bson import ObjectId
 from fastapi import APIRouter, Form, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import timedelta
-from datastorage.db_connect import users_collection, reports_collection
-from services.auth import hash_password, verify_password, create_access_token, decode_access_token,get_user_by_username
-from core.prompts import MCQ_PROMPT_WITH_REPORT,MCQ_PROMPT_WITHOUT_REPORT,FLASHCARD_PROMPT,FLASHCARD_PROMPT_WITH_REPORT
-from services.flashcards import FlashcardGeneratorChatGPT,FlashcardGeneratorMistral,FlashcardGeneratorGemini
+from datastorage import repository, topic_progress
+from datastorage.usage import query_usage, USAGE_GROUP_FIELDS, USAGE_GRANULARITIES
+from datetime import datetime, timezone
+from services.answers import ingest_answer_submissions
+from pymongo.errors import DuplicateKeyError
+from datastorage.artifact_cache import artifact_cache_key, get_or_generate
+from services.uploads import save_uploads, load_uploads, read_upload, uploads_hash, upload_paths, remove_uploads
+from datastorage.documents import create_document, get_document, public_document, get_cached_topics, store_topics
+from services.auth import hash_password_async, verify_password_async, create_access_token, decode_access_token,get_user_by_username, user_id_from_authorization
+from core.prompts import MCQ_PROMPT,MCQ_PROMPT_WITH_REPORT,MCQ_PROMPT_WITHOUT_REPORT,FLASHCARD_PROMPT,FLASHCARD_PROMPT_WITH_REPORT
+from services.flashcards import FLASHCARD_GENERATORS
 from services.chat import DocumentChatServiceGemini,DocumentChatServiceOpenAI
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+REFRESHED_TOKEN_HEADER = "X-Refreshed-Token"
 CHAT_SERVICES = {
     "gemini": DocumentChatServiceGemini(collection_name="document-chat-collection-gemini"),
     "chatgpt": DocumentChatServiceOpenAI(collection_name="document-chat-collection-openai")
 }
-async def get_user_by_username(username: str):
-    """Helper function to get user from MongoDB by username."""
-    user = users_collection.find_one({"username": username})
-    if user:
-        user['id'] = str(user['_id'])
-        del user['_id']
-        return user
-    return None
-
 @router.post("/register/")
 async def register(username: str = Form(...), password: str = Form(...)):
     """Registers a new user and stores it in MongoDB."""
-    if await get_user_by_username(username):
+    if await repository.username_exists(username):
         raise HTTPException(status_code=400, detail="User already exists")
     
-    hashed_password = hash_password(password)
-    user_data = {
-        "username": username,
-        "password": hashed_password,
-        "reports": []
-    }
-    
-    result = users_collection.insert_one(user_data)
+    hashed_password = await hash_password_async(password)
+    try:
+        user_id = await repository.create_user(username, hashed_password)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="User already exists")
     return {
         "message": "User registered successfully",
-        "user_id": str(result.inserted_id)
+        "user_id": user_id
     }
 
 @router.post("/login/")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Authenticates user and returns a JWT token."""
-    user = await get_user_by_username(form_data.username)
+    user = await get_user_by_username(form_data.username, repository.USER_LOGIN_PROJECTION)
     
-    if not user or not verify_password(form_data.password, user["password"]):
+    if not user or not await verify_password_async(form_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
     access_token = create_access_token(
@@ -80,26 +73,35 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-def close_db_connection():
-    client.close()
+@router.post("/documents/")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Stores uploaded files under a document id that later requests can send instead of the files."""
+    return await create_document(await save_uploads(files))
+
+@router.get("/documents/{document_id}")
+async def get_uploaded_document(document_id: str):
+    document = await get_document(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found or expired")
+    return public_document(document)
 
 @router.post("/notes/")
-async def generate_notes(files: list[UploadFile] = File(...), model: str = Form(...)):
+async def generate_notes(
+    files: List[UploadFile] = File(None),
+    model: str = Form(...),
+    document_id: str = Form(None),
+    routing: str = Form(None),
+):
     """Accept multiple PDFs, process them, and return structured notes."""
-    
-    file_paths = []
-    for file in files:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        file_paths.append(file_path)
-    
-    return StreamingResponse(stream_summary(file_paths,model))
+    routing = check_routing(routing)
+    file_paths = upload_paths(await load_uploads(files, document_id))
+    return StreamingResponse(stream_summary(file_paths,model,routing))
 
 class TopicSelection(BaseModel):
     topics: List[str]
-    file_paths: List[str]
+    document_id: Optional[str] = None
     model: str
+    routing: Optional[str] = None
 
 class MCQResponse(BaseModel):
     topic: str
@@ -107,549 +109,587 @@ class MCQResponse(BaseModel):
     options: List[str]
     correct_answer: str
 
-def get_mcq_generator(model: str):
-    """Returns the appropriate MCQ generator class based on the selected model."""
-    model_map = {
-        "gemini": MCQGeneratorGemini,
-        "mistral":MCQGeneratorMistral,
-        "chatgpt":MCQGeneratorChatGPT,
+async def get_current_user_id(response: Response, token: str = Depends(oauth2_scheme)) -> str:
+    """Auth dependency: returns the caller's user id.
+
+    When an expired token was refreshed, the new token is sent back in the X-Refreshed-Token header.
+    """
+    decoded_data = await decode_access_token(token)
+    user_id = decoded_data["payload"].get("sub")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if decoded_data["new_token"]:
+        response.headers[REFRESHED_TOKEN_HEADER] = decoded_data["new_token"]
+    return user_id
+
+def refreshed_token_headers(response: Response):
+    """Headers set by get_current_user_id, for routes that return their own Response object."""
+    token = response.headers.get(REFRESHED_TOKEN_HEADER)
+    return {REFRESHED_TOKEN_HEADER: token} if token else None
+
+async def get_personalization(user_id: str):
+    """Returns the formatted strengths, weaknesses and average areas from the user's latest report, or None."""
+    latest_report = await repository.get_report_summary(user_id)
+    if latest_report is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    weak_areas = latest_report["weaknesses"]
+    strong_areas = latest_report["strengths"]
+    average_areas = latest_report["average"]
+    if not strong_areas and not weak_areas:
+        return None
+
+    weak_subjects = [area["subject"] for area in weak_areas] if weak_areas else []
+    return {
+        "strengths": ", ".join(strong_areas) if strong_areas else "None",
+        "weaknesses": ", ".join(weak_subjects) if weak_subjects else "None",
+        "average": ", ".join(average_areas) if average_areas else "None",
     }
-    if model not in model_map:
+
+def render_personalized_prompt(personalization, prompt_with_report: str, prompt_without_report: str):
+    """Fills the report prompt with the user's personalization, falling back to the generic prompt."""
+    if not personalization:
+        return prompt_without_report
+    return prompt_with_report.format(**personalization)
+
+async def build_personalized_prompt(user_id: str, prompt_with_report: str, prompt_without_report: str):
+    """Builds a generation prompt tailored to the strengths and weaknesses in the user's latest report."""
+    personalization = await get_personalization(user_id)
+    return render_personalized_prompt(personalization, prompt_with_report, prompt_without_report)
+
+async def selection_uploads(topic_selection: TopicSelection):
+    """This request's own checkout of the selection's document, safe to remove afterwards."""
+    if not topic_selection.document_id:
+        raise HTTPException(status_code=400, detail="Send the document_id returned by /mcqs/")
+    return await load_uploads(document_id=topic_selection.document_id)
+
+def stream_ndjson(lines, uploads):
+    """Relays NDJSON lines, reporting failures in-band and removing the request's uploads once the stream ends."""
+    try:
+        yield from lines
+    except Exception as e:
+        logging.error(f"NDJSON streaming error: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        remove_uploads(uploads)
+
+async def generate_with_cache(kind, uploads, model, prompt_template, personalization, generate):
+    """Serves an artifact from the cache when the same files, model, prompt and profile were seen before.
+
+    The cache key uses the hashes computed while the uploads streamed in. The files are
+    removed once generation (including any background revalidation) is done.
+    """
+    key = artifact_cache_key(
+        uploads_hash(uploads),
+        model,
+        prompt_template,
+        json.dumps(personalization, sort_keys=True) if personalization else "",
+    )
+    return await get_or_generate(key, generate, kind, on_complete=lambda: remove_uploads(uploads))
+
+def generate_formatted_mcqs(mcq_generator, prompt, file_paths):
+    """Generates MCQs for a prompt and returns them in the API response shape."""
+    mcqs = mcq_generator.generate_personalized_mcqs(prompt, file_paths)
+
+    if not mcqs:
+        raise HTTPException(status_code=500, detail="Failed to generate MCQs")
+
+    try:
+        mcq_data = parse_mcqs(mcqs)
+    except StructuredOutputError as e:
+        logging.error(f"MCQ validation error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to parse MCQs")
+
+    return [format_mcq(mcq) for mcq in mcq_data]
+
+def check_routing(routing: Optional[str]) -> str:
+    """Validates an optional `routing` field, defaulting to LLM_ROUTING."""
+    routing = routing or LLM_ROUTING
+    if routing not in ROUTING_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid routing. Choose from {list(ROUTING_MODES)}")
+    return routing
+
+def get_mcq_generator(model: str, routing: Optional[str] = None):
+    """Returns the appropriate MCQ generator class based on the selected model."""
+    if model not in MCQ_GENERATORS:
         raise HTTPException(status_code=400, detail="Invalid model specified")
-    return model_map[model]()
+    return MCQ_GENERATORS[model](routing=check_routing(routing))
 
 @router.post("/mcqs/")
-async def extract_topics(files: List[UploadFile] = File(...), model: str = Form(...)):
-    """Extracts structured topics from uploaded PDFs using the selected AI model."""
+async def extract_topics(files: List[UploadFile] = File(None), model: str = Form(...), document_id: str = Form(None)):
+    """Extracts structured topics from uploaded PDFs using the selected AI model.
+
+    Uploaded files are kept as a document; send its document_id to /mcqs/generate/ instead
+    of the files. Topics are stored on the document, so asking again for the same model
+    does not re-extract them.
+    """
     mcq_generator = get_mcq_generator(model)
-    structured_topics = {}
+    if files:
+        document_id = (await create_document(await save_uploads(files)))["document_id"]
+    elif not document_id:
+        raise HTTPException(status_code=400, detail="Send files or a document_id")
+
+    cached_topics = await get_cached_topics(document_id, model)
+    if cached_topics:
+        return {"topics": cached_topics, "document_id": document_id}
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    full_paths = []
+    structured_topics = {}
+    uploads = await load_uploads(document_id=document_id)
     try:
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            full_paths.append(file_path)
-            
-            extracted_topics = mcq_generator.upload_and_parse_file(file_path)
+        for file_path in upload_paths(uploads):
+            extracted_topics = await run_in_threadpool(mcq_generator.upload_and_parse_file, file_path)
             structured_topics.update(extracted_topics)
         if not structured_topics:
             raise HTTPException(status_code=500, detail="❌ Failed to extract topics from files.")
 
-        return {"topics": structured_topics,"file_paths": full_paths}
+        await store_topics(document_id, model, structured_topics)
+        return {"topics": structured_topics, "document_id": document_id}
     finally:
-        for file_path in files:
-            file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_uploads(uploads)
 
 @router.post("/mcqs/generate/", response_model=List[MCQResponse])
 async def generate_selected_mcqs(topic_selection: TopicSelection):
     """Generates MCQs for selected topics using the uploaded file and model."""
     if not topic_selection.topics:
         raise HTTPException(status_code=400, detail="No topics selected")
-    mcq_generator = get_mcq_generator(topic_selection.model.lower())
-    mcqs = mcq_generator.generate_mcqs(topic_selection.topics, topic_selection.file_paths)
-
-    if not mcqs:
-        raise HTTPException(status_code=500, detail="Failed to generate MCQs")
+    mcq_generator = get_mcq_generator(topic_selection.model.lower(), topic_selection.routing)
+    uploads = await selection_uploads(topic_selection)
+    try:
+        mcqs = await run_in_threadpool(mcq_generator.generate_mcqs, topic_selection.topics, upload_paths(uploads))
 
-    mcqs = mcqs.strip()
-    if mcqs.startswith("```json"):
-        mcqs = mcqs[7:-3]
+        if not mcqs:
+            raise HTTPException(status_code=500, detail="Failed to generate MCQs")
 
-    try:
-        mcq_data = json.loads(mcqs)
-    except json.JSONDecodeError as e:
-        print("❌ JSON Parsing Error:", e)
-        print("Raw MCQ Response:", mcqs)
+        mcq_data = parse_mcqs(mcqs)
+    except StructuredOutputError as e:
+        logging.error(f"MCQ validation error: {e}")
         raise HTTPException(status_code=500, detail="Failed to parse MCQs")
     finally:
-        for file_path in topic_selection.file_paths:
-            file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_uploads(uploads)
 
-    formatted_mcqs = [
-        {
-            "topic": mcq["Topic"],
-            "question": mcq["Question"],
-            "options": mcq["Options"],
-            "correct_answer": mcq["Correct Answer"]
-        }
-        for mcq in mcq_data
-    ]
+    return [format_mcq(mcq) for mcq in mcq_data]
+
+class ParallelTopicSelection(TopicSelection):
+    batch_size: int = Field(5, ge=1, le=MCQ_MAX_BATCH_SIZE)
+    max_workers: int = Field(4, ge=1, le=MCQ_PARALLEL_MAX_WORKERS)
 
-    return formatted_mcqs
+class MCQBatchTiming(BaseModel):
+    topics: List[str]
+    count: int
+    seconds: float
+    error: Optional[str] = None
+
+class ParallelMCQResponse(BaseModel):
+    mcqs: List[MCQResponse]
+    batches: List[MCQBatchTiming]
+    total_seconds: float
+
+@router.post("/mcqs/generate/parallel/", response_model=ParallelMCQResponse)
+async def generate_selected_mcqs_parallel(topic_selection: ParallelTopicSelection):
+    """Generates MCQs for selected topics in concurrent batches and merges the results."""
+    if not topic_selection.topics:
+        raise HTTPException(status_code=400, detail="No topics selected")
+    mcq_generator = get_mcq_generator(topic_selection.model.lower(), topic_selection.routing)
+    uploads = await selection_uploads(topic_selection)
 
-def extract_json(response_text):
-    """Extract JSON content from Gemini API response."""
+    start_time = time.time()
     try:
-        json_match = re.search(r"```json\n(.*?)\n```", response_text, re.DOTALL)
-        json_data = json_match.group(1).strip() if json_match else response_text.strip()
-        return json.loads(json_data)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON response from AI model")
+        mcqs, batches = await run_in_threadpool(
+            generate_mcqs_parallel,
+            mcq_generator,
+            topic_selection.topics,
+            upload_paths(uploads),
+            topic_selection.batch_size,
+            topic_selection.max_workers,
+        )
+    except Exception as e:
+        logging.error(f"Error in generate_selected_mcqs_parallel: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate MCQs")
+    finally:
+        remove_uploads(uploads)
+
+    if not mcqs:
+        raise HTTPException(status_code=500, detail="Failed to generate MCQs")
+
+    return {"mcqs": mcqs, "batches": batches, "total_seconds": round(time.time() - start_time, 2)}
+
+@router.post("/mcqs/generate/stream/")
+async def stream_selected_mcqs(topic_selection: TopicSelection):
+    """Streams MCQs for selected topics as NDJSON, one question per line as soon as it is complete."""
+    if not topic_selection.topics:
+        raise HTTPException(status_code=400, detail="No topics selected")
+    mcq_generator = get_mcq_generator(topic_selection.model.lower(), topic_selection.routing)
+    uploads = await selection_uploads(topic_selection)
+    lines = stream_mcqs(mcq_generator, MCQ_PROMPT, upload_paths(uploads), build_mcq_request(topic_selection.topics))
+    return StreamingResponse(stream_ndjson(lines, uploads), media_type="application/x-ndjson")
 
 @router.post("/report/")
-async def upload_and_generate_report(file: UploadFile = File(...)):
+async def upload_and_generate_report(response: Response, file: UploadFile = File(...)):
     """Uploads a PDF, generates a report, and saves it to MongoDB if valid."""
     try:
-        pdf_data = await file.read()
-        student_report = process_pdf(pdf_data)
-        print(student_report)
-        if isinstance(student_report, dict): 
-            saved_report = save_student_report(student_report)
-            return {"message": "Report generated and saved successfully", "data": saved_report}
-        else:
-            return {"message": "Failed to generate a structured report", "data": student_report}
-
+        pdf_data, pdf_hash = await read_upload(file, REPORT_UPLOAD_MAX_BYTES)
+        student_report, cache_status = await get_or_process_report(pdf_data, pdf_hash)
+        response.headers["X-Artifact-Cache"] = cache_status
+        saved_report = await repository.save_student_report(student_report)
+        return {"message": "Report generated and saved successfully", "data": saved_report}
+
+    except HTTPException:
+        raise
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to generate a structured report: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+
+@router.post("/reports/batch/")
+async def upload_and_generate_reports(files: List[UploadFile] = File(...)):
+    """Generates and saves reports for a batch of report cards, e.g. a whole class.
+
+    At most REPORT_BATCH_MAX_FILES files are accepted. They are streamed to disk and processed
+    concurrently up to REPORT_BATCH_CONCURRENCY; identical PDFs reuse cached results. Each file
+    gets its own status, so one bad upload doesn't fail the batch.
+    """
+    if len(files) > REPORT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {REPORT_BATCH_MAX_FILES} files per batch")
+    uploads = await save_uploads(files, REPORT_UPLOAD_MAX_BYTES)
+    results = await process_report_batch(uploads)
+    for result in results:
+        if result["status"] == "ok":
+            result["data"] = await repository.save_student_report(result["data"])
+    return {"results": results}
 
 @router.post("/report-profile/")
-async def upload_and_generate_report(file: UploadFile = File(...), token: str = Depends(oauth2_scheme)):
+async def upload_and_generate_report(response: Response, file: UploadFile = File(...), user_id: str = Depends(get_current_user_id)):
     """Uploads a PDF, generates a report, saves it to MongoDB, and links it to the user."""
     try:
-        pdf_data = await file.read()
-        student_report = process_pdf(pdf_data)
-
-        if not isinstance(student_report, dict):
-            raise HTTPException(status_code=400, detail="Failed to generate a structured report")
-
+        pdf_data, pdf_hash = await read_upload(file, REPORT_UPLOAD_MAX_BYTES)
+        student_report, cache_status = await get_or_process_report(pdf_data, pdf_hash)
+        response.headers["X-Artifact-Cache"] = cache_status
 
-        report_result = reports_collection.insert_one(student_report)
-        doc_id = str(report_result.inserted_id)
-        decoded_data = await decode_access_token(token)
-        user_id = decoded_data["payload"].get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Unauthorized")
+        student_report["user_id"] = user_id
+        doc_id = await repository.insert_report(student_report)
 
-        update_result=users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": {"latest_report_id": doc_id}}
-        )
-        if update_result.modified_count == 0:
+        if not await repository.set_latest_report(user_id, doc_id):
             raise HTTPException(status_code=404, detail="User not found")
-        if isinstance(student_report, dict): 
-            student_report["_id"] = doc_id  
-            return {"message": "Report generated and saved successfully", "data": student_report}
-        else:
-            return {"message": "Failed to generate a structured report", "data": student_report}
+        student_report["_id"] = doc_id
+        return {"message": "Report generated and saved successfully", "data": student_report}
 
+    except HTTPException:
+        raise
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to generate a structured report: {e}")
     except Exception as e:
-        print("❌ Error in upload_and_generate_report:", str(e))
+        logging.error(f"Error in upload_and_generate_report: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 @router.get("/profile/")
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(user_id: str = Depends(get_current_user_id)):
     """Retrieves the logged-in user's data along with their latest report."""
     try:
-        decoded_data = await decode_access_token(token)
-        user_id = decoded_data["payload"].get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Unauthorized")
-
-        user = users_collection.find_one({"_id":ObjectId(user_id)})
-        if not user:
+        user_data = await repository.find_user_with_report(user_id, repository.USER_PROFILE_PROJECTION)
+        if not user_data:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_data = dict(user)
-        latest_report = None
-
-        if "latest_report_id" in user_data:
-            report = reports_collection.find_one({"_id": ObjectId(user_data["latest_report_id"])})
-            if report:
-                latest_report = dict(report)
-                latest_report["_id"] = str(latest_report["_id"])
         return {
             "username": user_data["username"],
-            "latest_report": latest_report
+            "latest_report": user_data["latest_report"]
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-class MCQRequest(BaseModel):
-    model: str
-    file_paths: List[str]
-
 @router.post("/mcqs_normal/", response_model=List[MCQResponse])
 async def generate_personalized_mcqs(
+    response: Response,
     model: str = Form(...),
     files: List[UploadFile] = File(...)
 ):
     try:
         prompt = MCQ_PROMPT_WITHOUT_REPORT
         mcq_generator = get_mcq_generator(model)
+        uploads = await save_uploads(files)
+        full_paths = upload_paths(uploads)
 
-        full_paths = []
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            full_paths.append(file_path)
-        
-        mcqs = mcq_generator.generate_personalized_mcqs(prompt, full_paths)
-        
-        if not mcqs:
-            raise HTTPException(status_code=500, detail="Failed to generate MCQs")
-        
-        mcqs = mcqs.strip()
-        json_match = re.search(r"```json\n(.*?)\n```", mcqs, re.DOTALL)
-        mcq_data = json_match.group(1).strip() if json_match else mcqs.strip()
-
-        try:
-            mcq_data = json.loads(mcq_data)
-        except json.JSONDecodeError as e:
-            print("❌ JSON Parsing Error:", e)
-            print("Raw MCQ Response:", mcqs)
-            raise HTTPException(status_code=500, detail="Failed to parse MCQs")
-
-        formatted_mcqs = [
-            {
-                "topic": mcq.get("Topic", "Unknown Topic"),
-                "question": mcq.get("Question", "Unknown Question"),
-                "options": mcq.get("Options", []),
-                "correct_answer": mcq.get("Answer", "N/A")
-            }
-            for mcq in mcq_data if isinstance(mcq, dict)
-        ]
-
-        print(formatted_mcqs, "this is formatted")
+        formatted_mcqs, cache_status = await generate_with_cache(
+            "mcqs", uploads, model, prompt, None,
+            lambda: generate_formatted_mcqs(mcq_generator, prompt, full_paths),
+        )
+        response.headers["X-Artifact-Cache"] = cache_status
         return formatted_mcqs
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
 
 @router.post("/mcqs/personalized/", response_model=List[MCQResponse])
 async def generate_personalized_mcqs(
+    response: Response,
     model: str = Form(...),
     files: List[UploadFile] = File(...),
-    token: str = Depends(oauth2_scheme)
+    user_id: str = Depends(get_current_user_id)
 ):
     try:
-        decoded_data = await decode_access_token(token)
-        user_id = decoded_data["payload"].get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Unauthorized")
-
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = dict(user)
-
-        latest_report = None
-        if "latest_report_id" in user_data:
-            report = reports_collection.find_one({"_id": ObjectId(user_data["latest_report_id"])})
-            if report:
-                latest_report = dict(report)
-
-        weak_areas = latest_report.get("weaknesses", []) if latest_report else []
-        strong_areas = latest_report.get("strengths", []) if latest_report else []
-        average_areas = latest_report.get("average",[]) if latest_report else []
-        
-        weak_subjects = [area["subject"] for area in weak_areas] if weak_areas else []
-        strengths_formatted = ", ".join(strong_areas) if strong_areas else "None"
-        weaknesses_formatted = ", ".join(weak_subjects) if weak_subjects else "None"
-        average_formatted = ", ".join(average_areas) if average_areas else "None"
-    
-        prompt = MCQ_PROMPT_WITH_REPORT.format(
-            strengths=strengths_formatted,
-            weaknesses=weaknesses_formatted,
-            average = average_formatted
-        ) if strong_areas or weak_areas else MCQ_PROMPT_WITHOUT_REPORT
+        personalization = await get_personalization(user_id)
+        prompt = render_personalized_prompt(personalization, MCQ_PROMPT_WITH_REPORT, MCQ_PROMPT_WITHOUT_REPORT)
+        prompt_template = MCQ_PROMPT_WITH_REPORT if personalization else MCQ_PROMPT_WITHOUT_REPORT
         mcq_generator = get_mcq_generator(model)
+        uploads = await save_uploads(files)
+        full_paths = upload_paths(uploads)
 
-        full_paths = []
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            full_paths.append(file_path)
-        
-        mcqs = mcq_generator.generate_personalized_mcqs(prompt, full_paths)
-
-        if not mcqs:
-            raise HTTPException(status_code=500, detail="Failed to generate MCQs")
-        
-        mcqs = mcqs.strip()
-        json_match = re.search(r"```json\n(.*?)\n```", mcqs, re.DOTALL)
-        mcq_data = json_match.group(1).strip() if json_match else mcqs.strip()
-
-        try:
-            mcq_data = json.loads(mcq_data)
-        except json.JSONDecodeError as e:
-            print("❌ JSON Parsing Error:", e)
-            print("Raw MCQ Response:", mcqs)
-            raise HTTPException(status_code=500, detail="Failed to parse MCQs")
-        
-        formatted_mcqs = [
-            {
-                "topic": mcq["Topic"],
-                "question": mcq["Question"],
-                "options": mcq["Options"],
-                "correct_answer": mcq["Correct Answer"] 
-            }
-            for mcq in mcq_data
-        ]
-
+        formatted_mcqs, cache_status = await generate_with_cache(
+            "mcqs", uploads, model, prompt_template, personalization,
+            lambda: generate_formatted_mcqs(mcq_generator, prompt, full_paths),
+        )
+        response.headers["X-Artifact-Cache"] = cache_status
         return formatted_mcqs
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        for file_path in files:
-            file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
 
 
+@router.post("/mcqs/personalized/stream/")
+async def stream_personalized_mcqs(
+    response: Response,
+    model: str = Form(...),
+    files: List[UploadFile] = File(...),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Streams personalized MCQs as NDJSON, one question per line as soon as it is complete."""
+    prompt = await build_personalized_prompt(user_id, MCQ_PROMPT_WITH_REPORT, MCQ_PROMPT_WITHOUT_REPORT)
+    mcq_generator = get_mcq_generator(model)
+    uploads = await save_uploads(files)
+    lines = stream_mcqs(mcq_generator, prompt, upload_paths(uploads))
+    return StreamingResponse(
+        stream_ndjson(lines, uploads),
+        media_type="application/x-ndjson",
+        headers=refreshed_token_headers(response),
+    )
+
 class UserAnswer(BaseModel):
     topic: str
     correct: int
     total: int
 
+    @model_validator(mode="after")
+    def check_counts(self):
+        if not 0 <= self.correct <= self.total:
+            raise ValueError("correct must be between 0 and total")
+        return self
+
 @router.post("/mcqs/update-report/")
 async def update_user_report_based_on_answers(
-    answers: List[UserAnswer], token: str = Depends(oauth2_scheme)
+    answers: List[UserAnswer], user_id: str = Depends(get_current_user_id)
 ):
     """Updates or creates a user's strengths & weaknesses report based on MCQ answers."""
     try:
-        decoded_data = await decode_access_token(token)
-        user_id = decoded_data["payload"].get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Unauthorized")
-
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = await repository.find_user_by_id(user_id, repository.USER_REPORT_LINK_PROJECTION)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         latest_report_id = user.get("latest_report_id")
-        strengths = set()
-        average = set()
-        weaknesses = {}
-
-        
-        if latest_report_id:
-            report = reports_collection.find_one({"_id": ObjectId(latest_report_id)})
-            if report:
-                strengths = set(report.get("strengths", []))
-                average = set(report.get("average",[]))
-                weaknesses = {w["subject"]: w["reason"] for w in report.get("weaknesses", [])}
-                
-
-        
-        for answer in answers:
-            topic = answer.topic
-            accuracy = answer.correct / answer.total if answer.total > 0 else 0
-
-            if accuracy >= 0.75:
-                weaknesses.pop(topic, None)  
-                strengths.add(topic)
-            elif  0.5 <= accuracy < 0.75:
-                weaknesses.pop(topic, None)  
-                strengths.discard(topic)  
-                average.add(topic) 
-            elif accuracy < 0.5:
-                weaknesses[topic] = f"Low accuracy in MCQs (equals to {accuracy}%)"
-                strengths.discard(topic)  
-
-        
-        weaknesses_list = [{"subject": k, "reason": v} for k, v in weaknesses.items()]
-
-        if latest_report_id:
-            
-            reports_collection.update_one(
-                {"_id": ObjectId(latest_report_id)},
-                {"$set": {"strengths": list(strengths),"average":list(average), "weaknesses": weaknesses_list}}
-            )
-        else:
-            
-            student_report = {
-                "user_id": user_id,
-                "strengths": list(strengths),
-                "average":list(average),
-                "weaknesses": weaknesses_list,
-            }
-            report_result = reports_collection.insert_one(student_report)
-            new_report_id = str(report_result.inserted_id)
-
-            
-            update_result = users_collection.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$set": {"latest_report_id": new_report_id}}
-            )
-
-            if update_result.modified_count == 0:
-                raise HTTPException(status_code=404, detail="Failed to link report to user")
-
-            student_report["_id"] = new_report_id
+        results = repository.aggregate_topic_results(
+            (answer.topic, answer.correct, answer.total) for answer in answers
+        )
+        report, _ = await asyncio.gather(
+            repository.record_user_topic_results(user_id, latest_report_id, results),
+            topic_progress.record_topic_answers(user_id, results),
+        )
+        repository.invalidate_profile(user_id)
+        if report is None:
+            raise HTTPException(status_code=404, detail="Report not found")
 
         return {
             "message": "User report updated successfully",
-            "strengths": list(strengths),
-            "average":list(average),
-            "weaknesses": weaknesses_list
+            "strengths": report.get("strengths", []),
+            "average": report.get("average", []),
+            "weaknesses": report.get("weaknesses", [])
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print("❌ Error in update_user_report_based_on_answers:", str(e))
+        logging.error(f"Error in update_user_report_based_on_answers: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+class AnswerSubmission(BaseModel):
+    user_id: str
+    idempotency_key: str
+    answers: List[UserAnswer]
+
+class BulkAnswerRequest(BaseModel):
+    submissions: List[AnswerSubmission]
+
+@router.post("/mcqs/answers/bulk/")
+async def ingest_answers_bulk(batch: BulkAnswerRequest, user_id: str = Depends(get_current_user_id)):
+    """Applies quiz results for many users at once, e.g. a classroom test, and returns per-user results.
+
+    Submissions whose idempotency key was already applied for that user are skipped. Only
+    callers in BULK_ANSWER_ADMIN_USER_IDS may submit for other users; for everyone else,
+    other users' submissions are dropped and listed in `forbidden_users`.
+    """
+    if not batch.submissions:
+        raise HTTPException(status_code=400, detail="No submissions")
+    if len(batch.submissions) > BULK_ANSWER_MAX_SUBMISSIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_ANSWER_MAX_SUBMISSIONS} submissions per batch")
+    submissions = batch.submissions
+    forbidden_users = []
+    if user_id not in BULK_ANSWER_ADMIN_USER_IDS:
+        forbidden_users = sorted({submission.user_id for submission in submissions if submission.user_id != user_id})
+        submissions = [submission for submission in submissions if submission.user_id == user_id]
+    results = await ingest_answer_submissions([
+        {
+            "user_id": submission.user_id,
+            "idempotency_key": submission.idempotency_key,
+            "answers": [(answer.topic, answer.correct, answer.total) for answer in submission.answers],
+        }
+        for submission in submissions
+    ]) if submissions else {"users": [], "unknown_users": []}
+    results["forbidden_users"] = forbidden_users
+    return results
+
+@router.get("/progress/")
+async def get_topic_progress(user_id: str = Depends(get_current_user_id)):
+    """Returns the user's per-topic answer counts and time-decayed accuracy, weakest first."""
+    return {"topics": await topic_progress.get_topic_progress(user_id)}
+
+@router.get("/progress/history/")
+async def get_topic_history(topic: str, days: int = 30, user_id: str = Depends(get_current_user_id)):
+    """Returns daily answer counts for one topic over the last `days` days."""
+    if not 1 <= days <= 365:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 365")
+    return {"topic": topic, "history": await topic_progress.get_topic_history(user_id, topic, days)}
+
+@router.get("/usage/")
+async def get_llm_usage(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    group_by: str = "endpoint,model",
+    granularity: str = "day",
+    user_id: str = Depends(get_current_user_id),
+):
+    """LLM calls, tokens, latency and cost summed per group and period, for capacity planning.
+
+    Defaults to the last 7 days. Users in USAGE_ADMIN_USER_IDS see everyone's usage, others
+    only their own. Rollups are written every USAGE_FLUSH_INTERVAL_SECONDS, so the latest
+    calls can take that long to appear.
+    """
+    fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    if any(field not in USAGE_GROUP_FIELDS for field in fields):
+        raise HTTPException(status_code=400, detail=f"group_by fields must be among {list(USAGE_GROUP_FIELDS)}")
+    if granularity not in USAGE_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {list(USAGE_GRANULARITIES)}")
+    # Rollups are stored in naive UTC.
+    since, until = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+        for value in (since, until)
+    )
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(days=7)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    scope = None if user_id in USAGE_ADMIN_USER_IDS else user_id
+    rows = await query_usage(since, until, fields, granularity, scope)
+    return {"since": since, "until": until, "usage": rows}
+
+def get_flashcard_generator(model: str, routing: Optional[str] = None):
+    """Returns the appropriate flashcard generator based on the selected model."""
+    if model not in FLASHCARD_GENERATORS:
+        raise HTTPException(status_code=400, detail="Invalid model specified")
+    return FLASHCARD_GENERATORS[model](routing=check_routing(routing))
+
 @router.post("/flashcards/")
-async def generate_flashcards(files: List[UploadFile] = File(...),model: str = Form(...)):
-    """Generates flashcards directly from uploaded files."""
-    
-    full_paths = []
-    try:
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            full_paths.append(file_path)
-
-        for path in full_paths:
-            if not os.path.exists(path):
-                raise HTTPException(status_code=404, detail=f"File not found: {path}")
-
-        if model == "chatgpt":
-            flashcard_generator = FlashcardGeneratorChatGPT()
-        elif model == "gemini":
-            flashcard_generator = FlashcardGeneratorGemini()
-        elif model == "mistral":
-            flashcard_generator = FlashcardGeneratorMistral()
-        else:
-            raise HTTPException(status_code=400, detail="Invalid model specified")
-
-        flashcards = flashcard_generator.generate_flashcards(file_paths=full_paths)
-
-        if isinstance(flashcards, list):
-            return {"flashcards": flashcards}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate flashcards")
-    finally:
-        for file_path in files:
-            file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+async def generate_flashcards(response: Response, files: List[UploadFile] = File(None),model: str = Form(...), document_id: str = Form(None), routing: str = Form(None)):
+    """Generates flashcards directly from uploaded files or a stored document."""
+    flashcard_generator = get_flashcard_generator(model, routing)
+    uploads = await load_uploads(files, document_id)
+    full_paths = upload_paths(uploads)
+
+    flashcards, cache_status = await generate_with_cache(
+        "flashcards", uploads, model, FLASHCARD_PROMPT, None,
+        lambda: flashcard_generator.generate_flashcards(file_paths=full_paths),
+    )
+
+    if isinstance(flashcards, list):
+        response.headers["X-Artifact-Cache"] = cache_status
+        return {"flashcards": flashcards}
+    else:
+        raise HTTPException(status_code=500, detail="Failed to generate flashcards")
+
+@router.post("/flashcards/stream/")
+async def stream_flashcards(files: List[UploadFile] = File(None), model: str = Form(...), document_id: str = Form(None), routing: str = Form(None)):
+    """Streams flashcards as NDJSON, one card per line as soon as it is complete."""
+    flashcard_generator = get_flashcard_generator(model, routing)
+    uploads = await load_uploads(files, document_id)
+    lines = stream_json_items(flashcard_generator.stream_flashcards(upload_paths(uploads)))
+    return StreamingResponse(stream_ndjson(lines, uploads), media_type="application/x-ndjson")
 
 @router.post("/flashcards/personalized/")
 async def generate_personalized_flashcards(
+    response: Response,
     model: str = Form(...),
-    files: List[UploadFile] = File(...),
-    token: str = Depends(oauth2_scheme)
+    files: List[UploadFile] = File(None),
+    document_id: str = Form(None),
+    routing: str = Form(None),
+    user_id: str = Depends(get_current_user_id)
 ):
-    try:
-        decoded_data = await decode_access_token(token)
-        user_id = decoded_data["payload"].get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Unauthorized")
+    personalization = await get_personalization(user_id)
+    prompt = render_personalized_prompt(personalization, FLASHCARD_PROMPT_WITH_REPORT, FLASHCARD_PROMPT)
+    prompt_template = FLASHCARD_PROMPT_WITH_REPORT if personalization else FLASHCARD_PROMPT
+    flashcard_generator = get_flashcard_generator(model, routing)
+    uploads = await load_uploads(files, document_id)
+    full_paths = upload_paths(uploads)
+
+    flashcards, cache_status = await generate_with_cache(
+        "flashcards", uploads, model, prompt_template, personalization,
+        lambda: flashcard_generator.generate_flashcards_with_report(file_paths=full_paths,prompt=prompt),
+    )
 
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_data = dict(user)
-
-        latest_report = None
-        if "latest_report_id" in user_data:
-            report = reports_collection.find_one({"_id": ObjectId(user_data["latest_report_id"])})
-            if report:
-                latest_report = dict(report)
-
-        weak_areas = latest_report.get("weaknesses", []) if latest_report else []
-        strong_areas = latest_report.get("strengths", []) if latest_report else []
-        average_areas = latest_report.get("average",[]) if latest_report else []
-        
-        weak_subjects = [area["subject"] for area in weak_areas] if weak_areas else []
-        strengths_formatted = ", ".join(strong_areas) if strong_areas else "None"
-        weaknesses_formatted = ", ".join(weak_subjects) if weak_subjects else "None"
-        average_formatted = ", ".join(average_areas) if average_areas else "None"
-        print("here is the prompt")
-        prompt = FLASHCARD_PROMPT_WITH_REPORT.format(
-            strengths=strengths_formatted,
-            weaknesses=weaknesses_formatted,
-            average = average_formatted
-        ) if strong_areas or weak_areas else FLASHCARD_PROMPT
-
-        full_paths = []
-        for file in files:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            full_paths.append(file_path)
-
-        for path in full_paths:
-            if not os.path.exists(path):
-                raise HTTPException(status_code=404, detail=f"File not found: {path}")
-
-        if model == "chatgpt":
-            flashcard_generator = FlashcardGeneratorChatGPT()
-        elif model == "gemini":
-            flashcard_generator = FlashcardGeneratorGemini()
-        elif model == "mistral":
-            flashcard_generator = FlashcardGeneratorMistral()
-        else:
-            raise HTTPException(status_code=400, detail="Invalid model specified")
-
-        flashcards = flashcard_generator.generate_flashcards_with_report(file_paths=full_paths,prompt=prompt)
-
-        if isinstance(flashcards, list):
-            return {"flashcards": flashcards}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate flashcards")
-    finally:
-        for file_path in files:
-            file_path = os.path.join(UPLOAD_DIR, file_path.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+    if isinstance(flashcards, list):
+        response.headers["X-Artifact-Cache"] = cache_status
+        return {"flashcards": flashcards}
+    else:
+        raise HTTPException(status_code=500, detail="Failed to generate flashcards")
                 
 @router.post("/upload/")
-async def upload_document(file: UploadFile = File(...), model: str = Form("gemini")):
-    """Uploads a document and stores it for later summarization with the selected model."""
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+async def upload_document(file: UploadFile = File(None), model: str = Form("gemini"), document_id: str = Form(None)):
+    """Uploads a document, or loads a stored one, for later questions with the selected model.
 
+    Returns the document_id the file is stored under; the request's own copy is removed.
+    """
     if model not in CHAT_SERVICES:
         raise HTTPException(status_code=400, detail=f"Invalid model. Choose from {list(CHAT_SERVICES.keys())}")
+    if file:
+        document_id = (await create_document(await save_uploads([file])))["document_id"]
+    elif not document_id:
+        raise HTTPException(status_code=400, detail="Send a file or a document_id")
 
+    uploads = await load_uploads(document_id=document_id)
     try:
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
         chat_service = CHAT_SERVICES[model]
-        chat_service.load_file(file_path)
-        logging.info(f"File '{file.filename}' saved successfully for model '{model}'.")
+        for upload in uploads:
+            await run_in_threadpool(chat_service.load_file, upload["path"])
+            logging.info(f"File '{upload['filename']}' saved successfully for model '{model}'.")
         return JSONResponse(
             status_code=200,
-            content={"message": "File uploaded successfully", "file_path": file_path, "model": model}
+            content={"message": "File uploaded successfully", "document_id": document_id, "model": model}
         )
     except Exception as e:
         logging.error(f"Error uploading file for model '{model}': {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_uploads(uploads)
 
 @router.post("/ask/")
-async def ask_question(query: str = Form(...), model: str = Form("gemini")):
-    """Asks a question about the uploaded document using the selected model."""
+async def ask_question(request: Request, query: str = Form(...), model: str = Form("gemini")):
+    """Asks a question about the uploaded document using the selected model.
+
+    Callers with a bearer token continue their own conversation; anonymous questions are answered without history.
+    """
     if not query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
     
@@ -657,4 +697,6 @@ async def ask_question(query: str = Form(...), model: str = Form("gemini")):
         raise HTTPException(status_code=400, detail=f"Invalid model. Choose from {list(CHAT_SERVICES.keys())}")
 
     chat_service = CHAT_SERVICES[model]
-    return chat_service.ask_question(query)
+    # ask_question blocks while it waits for rate-limit capacity and the model, so it runs off the event loop.
+    user_id = await user_id_from_authorization(request.headers.get("authorization"))
+    return await run_in_threadpool(chat_service.ask_question, query, user_id)
@@ -0,0 +1,136 @@
+import asyncio
+import json
+from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Response
+from fastapi.responses import StreamingResponse
+from api.endpoints import get_current_user_id, refreshed_token_headers, check_routing, ParallelTopicSelection
+from core.config import REPORT_UPLOAD_MAX_BYTES
+from services.uploads import save_upload, save_uploads
+from datastorage.documents import create_document, get_document
+from services.mcqs import MCQ_GENERATORS
+from services.flashcards import FLASHCARD_GENERATORS
+from services.jobs import get_job_backend, public_job, is_job_owner, FINISHED_STATUSES
+import services.job_tasks  # noqa: F401 - registers the job handlers
+
+router = APIRouter(prefix="/jobs")
+
+
+def check_model(model, generators):
+    if model not in generators:
+        raise HTTPException(status_code=400, detail="Invalid model specified")
+
+
+async def job_document_id(files, document_id):
+    """The document a job reads from: the one named, or the uploads stored as a new one.
+
+    Jobs carry a document id rather than paths, and the worker checks out its own
+    copy, so it only ever deletes files it created.
+    """
+    if document_id:
+        if await get_document(document_id) is None:
+            raise HTTPException(status_code=404, detail="Document not found or expired")
+        return document_id
+    if not files:
+        raise HTTPException(status_code=400, detail="Send files or a document_id")
+    return (await create_document(await save_uploads(files)))["document_id"]
+
+
+async def submit_job(kind, payload, user_id):
+    # The job belongs to the user who submitted it, and its LLM usage is accounted to them.
+    payload["user_id"] = user_id
+    job_id = await get_job_backend().submit(kind, payload)
+    return {"job_id": job_id, "status": "queued"}
+
+
+async def get_owned_job(job_id, user_id):
+    """The job, if it exists and the user submitted it; anyone else gets the same 404."""
+    job = await get_job_backend().get(job_id)
+    if not job or not is_job_owner(job, user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/notes/")
+async def submit_notes_job(files: List[UploadFile] = File(None), model: str = Form(...), document_id: str = Form(None), routing: str = Form(None), user_id: str = Depends(get_current_user_id)):
+    """Queues note generation and returns a job id to poll."""
+    check_model(model, ("chatgpt", "mistral", "gemini"))
+    routing = check_routing(routing)
+    document_id = await job_document_id(files, document_id)
+    return await submit_job("notes", {"document_id": document_id, "model": model, "routing": routing}, user_id)
+
+
+@router.post("/flashcards/")
+async def submit_flashcards_job(files: List[UploadFile] = File(None), model: str = Form(...), document_id: str = Form(None), routing: str = Form(None), user_id: str = Depends(get_current_user_id)):
+    """Queues flashcard generation and returns a job id to poll."""
+    check_model(model, FLASHCARD_GENERATORS)
+    routing = check_routing(routing)
+    document_id = await job_document_id(files, document_id)
+    return await submit_job("flashcards", {"document_id": document_id, "model": model, "routing": routing}, user_id)
+
+
+@router.post("/mcqs/")
+async def submit_topic_extraction_job(files: List[UploadFile] = File(None), model: str = Form(...), document_id: str = Form(None), user_id: str = Depends(get_current_user_id)):
+    """Queues topic extraction and returns a job id to poll; the result carries the document_id to generate from."""
+    check_model(model, MCQ_GENERATORS)
+    document_id = await job_document_id(files, document_id)
+    return await submit_job("mcq_topics", {"document_id": document_id, "model": model}, user_id)
+
+
+@router.post("/mcqs/generate/")
+async def submit_mcq_job(topic_selection: ParallelTopicSelection, user_id: str = Depends(get_current_user_id)):
+    """Queues MCQ generation for the selected topics and returns a job id to poll."""
+    if not topic_selection.topics:
+        raise HTTPException(status_code=400, detail="No topics selected")
+    model = topic_selection.model.lower()
+    check_model(model, MCQ_GENERATORS)
+    if not topic_selection.document_id:
+        raise HTTPException(status_code=400, detail="Send the document_id returned by /mcqs/")
+    payload = topic_selection.model_dump()
+    payload["model"] = model
+    payload["routing"] = check_routing(topic_selection.routing)
+    payload["document_id"] = await job_document_id(None, topic_selection.document_id)
+    return await submit_job("mcqs", payload, user_id)
+
+
+@router.post("/report-profile/")
+async def submit_report_profile_job(file: UploadFile = File(...), user_id: str = Depends(get_current_user_id)):
+    """Queues report-card processing for the logged-in user and returns a job id to poll."""
+    upload = await save_upload(file, REPORT_UPLOAD_MAX_BYTES)
+    return await submit_job("report_profile", {"file_path": upload["path"], "sha256": upload["sha256"]}, user_id)
+
+
+@router.get("/stats/")
+async def job_stats():
+    """Reports the configured backend and how many jobs are waiting for a worker."""
+    backend = get_job_backend()
+    return {"backend": backend.name, "queue_depth": await backend.queue_depth()}
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_current_user_id)):
+    """Returns the caller's job status, progress and, once finished, its result or error."""
+    return public_job(await get_owned_job(job_id, user_id))
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str, response: Response, user_id: str = Depends(get_current_user_id)):
+    """Streams the caller's job state as server-sent events whenever it changes, until it finishes."""
+    await get_owned_job(job_id, user_id)
+    backend = get_job_backend()
+
+    async def events():
+        last_state = None
+        while True:
+            job = await backend.get(job_id)
+            if not job:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Job expired'})}\n\n"
+                return
+            state = (job["status"], job["progress"], job["message"])
+            if state != last_state:
+                last_state = state
+                yield f"data: {json.dumps(public_job(job))}\n\n"
+            if job["status"] in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(1)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=refreshed_token_headers(response))
@@ -0,0 +1,55 @@
+import time
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from core.metrics import HTTP_REQUEST_SECONDS, HTTP_FIRST_BYTE_SECONDS, HTTP_REQUESTS_IN_FLIGHT
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus exposition of every notesight_* metric in this process."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def route_template(scope) -> str:
+    """The path template of the route that served a request, so each route is one series."""
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class HTTPMetricsMiddleware:
+    """Per-route latency, time to first body chunk and in-flight requests.
+
+    A plain ASGI middleware rather than an `http` middleware, so that for streaming
+    responses the latency covers the whole body and the first chunk marks the first token.
+    The route is read from the scope, where the router records it once it has matched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = "500"
+        first_chunk = True
+        started = time.perf_counter()
+
+        async def observed_send(message):
+            nonlocal status, first_chunk
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body" and first_chunk and message.get("body"):
+                first_chunk = False
+                HTTP_FIRST_BYTE_SECONDS.labels(method, route_template(scope)).observe(time.perf_counter() - started)
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.labels(method).inc()
+        try:
+            await self.app(scope, receive, observed_send)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.labels(method).dec()
+            HTTP_REQUEST_SECONDS.labels(method, route_template(scope), status).observe(time.perf_counter() - started)
@@ -5,6 +5,7 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 import io
 import re
+import json
 BASE_URL = "http://localhost:8000"
 st.set_page_config(layout="wide", page_title="POC for Notesight")
 
@@ -96,13 +97,26 @@ elif page == "Flashcards":
         data = {"model": model_options[selected_model]}
 
         with st.spinner(f"Generating flashcards using {selected_model}... ⏳"):
-            response = requests.post(f"{BASE_URL}/flashcards/", files=files, data=data)
+            response = requests.post(f"{BASE_URL}/flashcards/stream/", files=files, data=data, stream=True)
 
             if response.status_code == 200:
-                st.session_state.flashcards = response.json().get("flashcards", [])
+                st.session_state.flashcards = []
+                cards_placeholder = st.container()
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    flashcard = json.loads(line)
+                    if "error" in flashcard:
+                        st.error(f"❌ {flashcard['error']}")
+                        break
+                    st.session_state.flashcards.append(flashcard)
+                    with cards_placeholder.expander(f"**{flashcard.get('concept')}**"):
+                        st.write(flashcard.get("definition"))
 
                 if st.session_state.flashcards:
                     st.success(f"✅ Flashcards Generated Using {selected_model}")
+                    st.rerun()
                 else:
                     st.warning("⚠ No flashcards were generated.")
             else:
@@ -179,7 +193,7 @@ elif page == "MCQ":
             if response.status_code == 200:
                 st.session_state["topics_hierarchy"] = response.json().get("topics", {})
                 st.success("✅ Topics Extracted! Select subtopics below.")
-                st.session_state["file_paths"] = response.json().get("file_paths", [])
+                st.session_state["document_id"] = response.json().get("document_id")
             else:
                 st.error("❌ Failed to extract topics.")
 
@@ -200,23 +214,30 @@ elif page == "MCQ":
     if "selected_subtopics" in st.session_state and st.session_state["selected_subtopics"] and st.button("🎯 Generate MCQs"):
         with st.spinner(f"Generating MCQs using {selected_model.capitalize()}... ⏳"):
             response = requests.post(
-                f"{BASE_URL}/mcqs/generate/",
-                json={"topics": st.session_state["selected_subtopics"], "file_paths": st.session_state["file_paths"], "model": selected_model}
+                f"{BASE_URL}/mcqs/generate/stream/",
+                json={"topics": st.session_state["selected_subtopics"], "document_id": st.session_state["document_id"], "model": selected_model_key},
+                stream=True
             )
 
-        if response.status_code == 200:
-            mcqs = response.json()
-            if mcqs:
+            if response.status_code == 200:
                 st.subheader("📚 Generated MCQs")
-                for mcq in mcqs:
+                mcq_count = 0
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    mcq = json.loads(line)
+                    if "error" in mcq:
+                        st.error(f"❌ {mcq['error']}")
+                        break
+                    mcq_count += 1
                     with st.expander(f"📝 {mcq['question']}"):
                         for option in mcq["options"]:
                             st.write(f"{option}")
                         st.success(f"✅ Correct Answer: {mcq['correct_answer']}")
+                if not mcq_count:
+                    st.warning("⚠ No MCQs were generated.")
             else:
-                st.warning("⚠ No MCQs were generated.")
-        else:
-            st.error("❌ Failed to generate MCQs. Please try again.")
+                st.error("❌ Failed to generate MCQs. Please try again.")
 
 elif page == "report card":
     def upload_pdf(file):
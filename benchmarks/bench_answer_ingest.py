@@ -0,0 +1,91 @@
+"""Sustained throughput of bulk answer ingestion.
+
+Runs the same code path as POST /mcqs/answers/bulk/ against the database named by
+MONGODB_DATABASE, which must be a scratch database:
+
+    MONGODB_DATABASE=notesight_bench python -m benchmarks.bench_answer_ingest --users 10000 --seconds 60
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from core.config import MONGODB_DATABASE
+from datastorage.db_connect import client, db
+from datastorage.repository import ensure_indexes
+from datastorage.topic_progress import ensure_topic_progress_indexes
+from services.answers import ingest_answer_submissions
+
+TOPICS = [f"Topic {i}" for i in range(40)]
+
+
+async def seed(users):
+    await db.users.drop()
+    for name in ("reports", "answer_submissions", "topic_progress", "topic_progress_buckets"):
+        await db[name].drop()
+    await ensure_indexes()
+    await ensure_topic_progress_indexes()
+    result = await db.users.insert_many(
+        [{"username": f"bench{i}", "password": "", "reports": []} for i in range(users)]
+    )
+    return [str(user_id) for user_id in result.inserted_ids]
+
+
+def make_batch(user_ids, size, topics_per_submission):
+    return [
+        {
+            "user_id": random.choice(user_ids),
+            "idempotency_key": uuid.uuid4().hex,
+            "answers": [
+                (topic, random.randint(0, 5), 5)
+                for topic in random.sample(TOPICS, topics_per_submission)
+            ],
+        }
+        for _ in range(size)
+    ]
+
+
+async def main(users, seconds, batch_size, topics_per_submission, concurrency):
+    if MONGODB_DATABASE == "notesight":
+        raise SystemExit("Set MONGODB_DATABASE to a scratch database; this benchmark drops collections.")
+    user_ids = await seed(users)
+    latencies = []
+    submissions = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal submissions
+        while time.perf_counter() < deadline:
+            batch = make_batch(user_ids, batch_size, topics_per_submission)
+            started = time.perf_counter()
+            await ingest_answer_submissions(batch)
+            latencies.append(time.perf_counter() - started)
+            submissions += len(batch)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    replay = make_batch(user_ids, batch_size, topics_per_submission)
+    await ingest_answer_submissions(replay)
+    replayed = await ingest_answer_submissions(replay)
+    duplicates = sum(user["duplicates"] for user in replayed["users"])
+
+    latencies.sort()
+    print(f"batches={len(latencies)} submissions={submissions} questions answered={submissions * topics_per_submission * 5}")
+    print(f"throughput: {submissions / elapsed:.0f} submissions/s, {len(latencies) / elapsed:.1f} batches/s")
+    print(f"batch latency: p50={statistics.median(latencies) * 1000:.1f}ms p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"replayed batch: {duplicates}/{len(replay)} submissions skipped as duplicates")
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--topics", type=int, default=5, help="topics per submission")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.seconds, args.batch_size, args.topics, args.concurrency))
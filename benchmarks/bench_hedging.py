@@ -0,0 +1,69 @@
+"""Tail latency of pinned, failover and hedged LLM routing against fake providers.
+
+No API calls are made: the providers are services.fake_llm.FakeProviders whose
+requested one has occasional latency spikes, so the run shows what hedging buys at
+p95/p99 and which provider ends up serving the requests:
+
+    python -m benchmarks.bench_hedging --requests 300 --spike-rate 0.1 --spike-seconds 5
+"""
+import argparse
+import asyncio
+import collections
+import statistics
+import time
+from services.fake_llm import FakeProvider
+from services.llm_gateway import LLMGateway
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+async def run(gateway, routing, requests, concurrency):
+    latencies = []
+    winners = collections.Counter()
+    failures = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failures
+        async with slots:
+            started = time.perf_counter()
+            try:
+                result = await gateway.complete("gemini", "Summarise the chapter.", routing=routing)
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            winners[result["provider"]] += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    latencies.sort()
+    print(
+        f"{routing:>8}: p50={statistics.median(latencies):.2f}s p95={percentile(latencies, 0.95):.2f}s "
+        f"p99={percentile(latencies, 0.99):.2f}s failures={failures} served by {dict(winners)}"
+    )
+
+
+async def main(requests, concurrency, latency, spike_rate, spike_seconds, failure_rate):
+    for routing in ("pinned", "failover", "hedge"):
+        gateway = LLMGateway([
+            FakeProvider("gemini", latency, spike_rate, spike_seconds, failure_rate),
+            FakeProvider("openai", latency * 1.5, spike_rate / 4, spike_seconds),
+            FakeProvider("mistral", latency * 2),
+        ])
+        # Warm the latency window so hedging uses a measured p95 rather than the default delay.
+        await asyncio.gather(*(gateway.complete("gemini", "warm-up") for _ in range(50)), return_exceptions=True)
+        await run(gateway, routing, requests, concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="base latency of the requested provider")
+    parser.add_argument("--spike-rate", type=float, default=0.1)
+    parser.add_argument("--spike-seconds", type=float, default=5)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.latency, args.spike_rate, args.spike_seconds, args.failure_rate))
@@ -0,0 +1,64 @@
+"""Password verification throughput and event-loop stalls, inline versus on the bcrypt pool.
+
+Simulates concurrent logins without MongoDB: each request verifies a password against a
+stored hash, while a heartbeat task measures how late the event loop wakes it up.
+
+    BCRYPT_ROUNDS=12 PASSWORD_HASH_WORKERS=4 python -m benchmarks.bench_login --requests 64
+"""
+import argparse
+import asyncio
+import time
+from core.config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS
+from services.auth import hash_password, verify_password, verify_password_async
+
+HEARTBEAT_SECONDS = 0.01
+
+
+async def inline_login(password, hashed):
+    return verify_password(password, hashed)
+
+
+async def pooled_login(password, hashed):
+    return await verify_password_async(password, hashed)
+
+
+async def heartbeat(stop, lags):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        lags.append(time.perf_counter() - started - HEARTBEAT_SECONDS)
+
+
+async def run(login, requests, concurrency, hashed):
+    slots = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    lags = []
+
+    async def one():
+        async with slots:
+            assert await login("correct horse battery staple", hashed)
+
+    monitor = asyncio.create_task(heartbeat(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    return requests / elapsed, max(lags, default=0.0) * 1000
+
+
+async def main(requests, concurrency_levels):
+    hashed = hash_password("correct horse battery staple")
+    print(f"bcrypt rounds={BCRYPT_ROUNDS} pool workers={PASSWORD_HASH_WORKERS} requests={requests}")
+    for concurrency in concurrency_levels:
+        for label, login in (("inline", inline_login), ("pooled", pooled_login)):
+            throughput, max_lag = await run(login, requests, concurrency, hashed)
+            print(f"concurrency={concurrency:<4} {label:<7} {throughput:8.1f} logins/s  max loop stall={max_lag:8.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
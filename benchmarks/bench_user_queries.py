@@ -0,0 +1,136 @@
+"""Login and profile lookup latency with and without indexes and projections.
+
+Seeds a throwaway database (default `notesight_bench`) on MONGODB_URI with N users, each
+linked to a report, then times the login lookup (by username) and the profile lookup
+(user by id, then their latest report, as two queries or one $lookup aggregation).
+
+    python -m benchmarks.bench_user_queries --users 1000000 --samples 2000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from bson import ObjectId
+from pymongo import AsyncMongoClient, ASCENDING
+from core.config import MONGODB_URI
+from datastorage.repository import (
+    USER_LOGIN_PROJECTION,
+    USER_PROFILE_PROJECTION,
+    REPORT_SUMMARY_PROJECTION,
+)
+
+BATCH_SIZE = 10_000
+
+
+def make_report(index):
+    return {
+        "user_id": None,
+        "student_info": {"name": f"Student {index}", "grade": index % 12 + 1},
+        "subject_performance": [{"subject": f"Subject {s}", "score": (index * s) % 100} for s in range(8)],
+        "strengths": ["Algebra", "Biology"],
+        "average": ["History"],
+        "weaknesses": [{"subject": "Chemistry", "reason": "Low accuracy"}],
+        "overall_performance_summary": "Lorem ipsum " * 40,
+    }
+
+
+async def seed(db, users):
+    await db.users.drop()
+    await db.reports.drop()
+    for start in range(0, users, BATCH_SIZE):
+        count = min(BATCH_SIZE, users - start)
+        reports = [make_report(start + i) for i in range(count)]
+        report_ids = (await db.reports.insert_many(reports)).inserted_ids
+        await db.users.insert_many([
+            {
+                "username": f"user{start + i}",
+                "password": "$2b$12$" + "x" * 53,
+                "reports": [],
+                "latest_report_id": str(report_ids[i]),
+            }
+            for i in range(count)
+        ])
+        print(f"seeded {start + count}/{users}", end="\r")
+    print()
+
+
+async def login_lookup(db, username, projection):
+    return await db.users.find_one({"username": username}, projection)
+
+
+async def profile_lookup(db, user_id, user_projection, report_projection):
+    user = await db.users.find_one({"_id": user_id}, user_projection)
+    return await db.reports.find_one({"_id": ObjectId(user["latest_report_id"])}, report_projection)
+
+
+async def profile_aggregate(db, user_id):
+    cursor = await db.users.aggregate([
+        {"$match": {"_id": user_id}},
+        {"$project": {**USER_PROFILE_PROJECTION}},
+        {"$lookup": {
+            "from": "reports",
+            "let": {"report_id": "$latest_report_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", {"$toObjectId": "$$report_id"}]}}},
+                {"$project": REPORT_SUMMARY_PROJECTION},
+            ],
+            "as": "latest_report",
+        }},
+    ])
+    return await cursor.to_list(length=1)
+
+
+async def measure(label, samples, make_call):
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        await make_call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{label:<42} p50={statistics.median(timings):8.2f}ms p95={p95:8.2f}ms p99={p99:8.2f}ms")
+
+
+async def main(users, samples, database, skip_seed):
+    client = AsyncMongoClient(MONGODB_URI)
+    db = client[database]
+    try:
+        if not skip_seed:
+            await seed(db, users)
+        await db.users.drop_indexes()
+        await db.reports.drop_indexes()
+
+        user_ids = [doc["_id"] async for doc in await db.users.aggregate([{"$sample": {"size": 1000}}, {"$project": {"_id": 1}}])]
+        usernames = [f"user{random.randrange(users)}" for _ in range(1000)]
+
+        # Collection scans get slow at 1M documents, so sample fewer lookups without the index.
+        scan_samples = max(1, samples // 20)
+        await measure("login, no index, full document", scan_samples,
+                      lambda: login_lookup(db, random.choice(usernames), None))
+
+        await db.users.create_index([("username", ASCENDING)], unique=True)
+        await db.reports.create_index([("user_id", ASCENDING)])
+        await measure("login, indexed, full document", samples,
+                      lambda: login_lookup(db, random.choice(usernames), None))
+        await measure("login, indexed, projected", samples,
+                      lambda: login_lookup(db, random.choice(usernames), USER_LOGIN_PROJECTION))
+        await measure("profile, full documents", samples,
+                      lambda: profile_lookup(db, random.choice(user_ids), None, None))
+        await measure("profile, projected", samples,
+                      lambda: profile_lookup(db, random.choice(user_ids), USER_PROFILE_PROJECTION, REPORT_SUMMARY_PROJECTION))
+        await measure("profile, projected, single $lookup", samples,
+                      lambda: profile_aggregate(db, random.choice(user_ids)))
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--database", default="notesight_bench")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data from a previous run")
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.samples, args.database, args.skip_seed))
@@ -9,4 +9,93 @@ TURBO_ASSISTANT_ID = os.getenv("TURBO_ASSISTANT_ID")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 GEMINI_API_KEY=os.getenv("GEMINI_API_KEY")
 PINECONE=os.getenv("PINECONE")
-MONGODB_URI=os.getenv("MONGODB_URI")
\ No newline at end of file
+MONGODB_URI=os.getenv("MONGODB_URI")
+MONGODB_DATABASE=os.getenv("MONGODB_DATABASE", "notesight")
+ARTIFACT_CACHE_TTL_SECONDS=int(os.getenv("ARTIFACT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+ARTIFACT_CACHE_FRESH_SECONDS=int(os.getenv("ARTIFACT_CACHE_FRESH_SECONDS", 24 * 3600))
+
+JOB_BACKEND=os.getenv("JOB_BACKEND", "local")
+JOB_WORKERS=int(os.getenv("JOB_WORKERS", 4))
+JOB_RESULT_TTL_SECONDS=int(os.getenv("JOB_RESULT_TTL_SECONDS", 24 * 3600))
+JOB_HEARTBEAT_SECONDS=int(os.getenv("JOB_HEARTBEAT_SECONDS", 10))
+JOB_MAX_ATTEMPTS=int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+WORKER_METRICS_PORT=int(os.getenv("WORKER_METRICS_PORT", 9100))
+REDIS_URL=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+MONGO_MAX_POOL_SIZE=int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE=int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS=int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS=int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+
+PROFILE_CACHE_SIZE=int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+PROFILE_CACHE_TTL_SECONDS=int(os.getenv("PROFILE_CACHE_TTL_SECONDS", 60))
+CHAT_HISTORY_USERS=int(os.getenv("CHAT_HISTORY_USERS", 10000))
+CHAT_HISTORY_TTL_SECONDS=int(os.getenv("CHAT_HISTORY_TTL_SECONDS", 3600))
+
+BCRYPT_ROUNDS=int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS=int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+AUTH_CACHE_SIZE=int(os.getenv("AUTH_CACHE_SIZE", 10000))
+TOKEN_CLAIMS_CACHE_TTL_SECONDS=int(os.getenv("TOKEN_CLAIMS_CACHE_TTL_SECONDS", 60))
+USER_EXISTS_CACHE_TTL_SECONDS=int(os.getenv("USER_EXISTS_CACHE_TTL_SECONDS", 300))
+
+TOPIC_ACCURACY_HALF_LIFE_DAYS=float(os.getenv("TOPIC_ACCURACY_HALF_LIFE_DAYS", 14))
+TOPIC_MIN_DECAYED_ANSWERS=float(os.getenv("TOPIC_MIN_DECAYED_ANSWERS", 3))
+TOPIC_BUCKET_RETENTION_DAYS=int(os.getenv("TOPIC_BUCKET_RETENTION_DAYS", 365))
+TOPIC_PROGRESS_QUERY_LIMIT=int(os.getenv("TOPIC_PROGRESS_QUERY_LIMIT", 200))
+
+ANSWER_IDEMPOTENCY_TTL_SECONDS=int(os.getenv("ANSWER_IDEMPOTENCY_TTL_SECONDS", 7 * 24 * 3600))
+BULK_ANSWER_MAX_SUBMISSIONS=int(os.getenv("BULK_ANSWER_MAX_SUBMISSIONS", 5000))
+BULK_ANSWER_ADMIN_USER_IDS=[user_id for user_id in os.getenv("BULK_ANSWER_ADMIN_USER_IDS", "").split(",") if user_id]
+
+MCQ_PARALLEL_MAX_WORKERS=int(os.getenv("MCQ_PARALLEL_MAX_WORKERS", 8))
+MCQ_MAX_BATCH_SIZE=int(os.getenv("MCQ_MAX_BATCH_SIZE", 20))
+
+REPORT_BATCH_CONCURRENCY=int(os.getenv("REPORT_BATCH_CONCURRENCY", 4))
+REPORT_BATCH_MAX_FILES=int(os.getenv("REPORT_BATCH_MAX_FILES", 100))
+
+UPLOAD_MAX_BYTES=int(os.getenv("UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES=int(os.getenv("UPLOAD_CHUNK_BYTES", 1024 * 1024))
+REPORT_UPLOAD_MAX_BYTES=int(os.getenv("REPORT_UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+
+DOCUMENT_TTL_SECONDS=int(os.getenv("DOCUMENT_TTL_SECONDS", 24 * 3600))
+BLOB_STORE_DIR=os.getenv("BLOB_STORE_DIR", "blobs")
+BLOB_SWEEP_INTERVAL_SECONDS=int(os.getenv("BLOB_SWEEP_INTERVAL_SECONDS", 3600))
+
+INLINE_DOCUMENT_MAX_BYTES=int(os.getenv("INLINE_DOCUMENT_MAX_BYTES", 10 * 1024 * 1024))
+
+LLM_TIMEOUT_SECONDS=float(os.getenv("LLM_TIMEOUT_SECONDS", 120))
+LLM_CONNECT_TIMEOUT_SECONDS=float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 10))
+LLM_MAX_RETRIES=int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_SECONDS=float(os.getenv("LLM_RETRY_BASE_SECONDS", 0.5))
+LLM_RETRY_MAX_SECONDS=float(os.getenv("LLM_RETRY_MAX_SECONDS", 8))
+LLM_POOL_SIZE=int(os.getenv("LLM_POOL_SIZE", 50))
+LLM_BREAKER_FAILURES=int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET_SECONDS=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+
+LLM_ROUTING=os.getenv("LLM_ROUTING", "pinned")
+LLM_FALLBACK_ORDER=os.getenv("LLM_FALLBACK_ORDER", "gemini,openai,mistral").split(",")
+LLM_HEDGE_DEFAULT_DELAY_SECONDS=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", 5))
+LLM_HEDGE_MIN_DELAY_SECONDS=float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", 0.5))
+LLM_HEDGE_WINDOW=int(os.getenv("LLM_HEDGE_WINDOW", 200))
+LLM_HEDGE_MIN_SAMPLES=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_FAKE_PROVIDERS=os.getenv("LLM_FAKE_PROVIDERS", "")
+
+LLM_REQUESTS_PER_MINUTE=os.getenv("LLM_REQUESTS_PER_MINUTE", "openai=500,gemini=1000,mistral=300")
+LLM_TOKENS_PER_MINUTE=os.getenv("LLM_TOKENS_PER_MINUTE", "openai=200000,gemini=1000000,mistral=500000")
+LLM_MAX_CONCURRENCY=int(os.getenv("LLM_MAX_CONCURRENCY", 20))
+LLM_ESTIMATED_COMPLETION_TOKENS=int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", 1024))
+LLM_QUEUE_TIMEOUT_SECONDS=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 120))
+LLM_LIMITER_BACKEND=os.getenv("LLM_LIMITER_BACKEND", "local")
+LLM_PROMPT_CACHE_TTL_SECONDS=int(os.getenv("LLM_PROMPT_CACHE_TTL_SECONDS", 600))
+
+USAGE_FLUSH_INTERVAL_SECONDS=float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", 15))
+USAGE_RETENTION_DAYS=int(os.getenv("USAGE_RETENTION_DAYS", 400))
+USAGE_ADMIN_USER_IDS=[user_id for user_id in os.getenv("USAGE_ADMIN_USER_IDS", "").split(",") if user_id]
+
+TRACE_EXPORTER=os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE=os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATIO=float(os.getenv("TRACE_SAMPLE_RATIO", 1.0))
+
+HEALTH_CACHE_SECONDS=float(os.getenv("HEALTH_CACHE_SECONDS", 5))
+HEALTH_CHECK_TIMEOUT_SECONDS=float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", 2))
@@ -0,0 +1,78 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+JOB_QUEUE_DEPTH = Gauge("notesight_job_queue_depth", "Jobs waiting for a worker", ["backend"])
+JOB_WAIT_SECONDS = Histogram("notesight_job_wait_seconds", "Time a job spends queued before a worker starts it", ["kind"])
+JOB_RUN_SECONDS = Histogram("notesight_job_run_seconds", "Time a worker spends running a job", ["kind"])
+JOBS_COMPLETED = Counter("notesight_jobs_completed_total", "Finished jobs by outcome", ["kind", "status"])
+
+MONGO_POOL_CONNECTIONS = Gauge("notesight_mongo_pool_connections", "Open connections in the MongoDB pool")
+MONGO_POOL_CHECKED_OUT = Gauge("notesight_mongo_pool_checked_out", "MongoDB connections currently in use")
+MONGO_POOL_CHECKOUT_SECONDS = Histogram("notesight_mongo_pool_checkout_seconds", "Time spent waiting for a MongoDB connection")
+MONGO_POOL_CHECKOUT_FAILURES = Counter("notesight_mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ["reason"])
+
+LLM_REQUEST_SECONDS = Histogram(
+    "notesight_llm_request_seconds",
+    "Latency of one provider call attempt",
+    ["provider", "model", "operation", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+LLM_TOKENS = Counter("notesight_llm_tokens_total", "Tokens reported by providers", ["provider", "model", "kind"])
+LLM_RETRIES = Counter("notesight_llm_retries_total", "Provider calls retried after a transient error", ["provider", "operation"])
+LLM_CIRCUIT_OPEN = Gauge("notesight_llm_circuit_open", "1 while a provider's circuit breaker is open", ["provider"])
+LLM_ROUTED_REQUESTS = Counter(
+    "notesight_llm_routed_requests_total",
+    "Failover and hedged calls by the provider that served them",
+    ["routing", "requested", "winner", "operation"],
+)
+LLM_ROUTED_SECONDS = Histogram(
+    "notesight_llm_routed_seconds",
+    "Latency of failover and hedged calls (to the first chunk for streams)",
+    ["routing", "winner", "operation"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "notesight_llm_queue_wait_seconds",
+    "Time a provider call waits for rate-limit capacity",
+    ["provider", "priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+LLM_QUEUE_DEPTH = Gauge("notesight_llm_queue_depth", "Provider calls waiting for rate-limit capacity", ["provider", "priority"])
+LLM_IN_FLIGHT = Gauge("notesight_llm_in_flight", "Provider calls currently running", ["provider"])
+LLM_PROMPT_TOKENS = Counter(
+    "notesight_llm_prompt_tokens_total",
+    "Prompt tokens by endpoint, split by whether the provider served them from its prompt cache",
+    ["endpoint", "provider", "cached"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "notesight_http_request_seconds",
+    "Time to serve a request, until its body is fully sent",
+    ["method", "route", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+HTTP_FIRST_BYTE_SECONDS = Histogram(
+    "notesight_http_first_byte_seconds",
+    "Time until the first body chunk is sent; for streaming routes, the time to the first token",
+    ["method", "route"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("notesight_http_requests_in_flight", "Requests being served", ["method"])
+LLM_FIRST_CHUNK_SECONDS = Histogram(
+    "notesight_llm_first_chunk_seconds",
+    "Time from sending a streaming provider call to its first text chunk",
+    ["provider", "model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+EMBEDDING_SECONDS = Histogram(
+    "notesight_embedding_seconds",
+    "Time to embed one batch of chunks or one query",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "notesight_embedding_batch_size",
+    "Chunks embedded per batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+CACHE_LOOKUPS = Counter("notesight_cache_lookups_total", "Cache lookups by cache and result (hit, stale or miss)", ["cache", "result"])
+HEALTH_CHECK_OK = Gauge("notesight_health_check_ok", "1 when the last readiness check of a dependency passed", ["check"])
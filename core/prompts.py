@@ -162,8 +162,7 @@ output format:
 
 ##  Input Structure  
 
-📖 **Question:** `{question}`  
-📖 **Context:** `{context}`  
+Each message gives the **Question** and the **Context** retrieved from the document.
 
 """
 
@@ -258,29 +257,22 @@ You are an expert test creator, designing a **high-quality exam-style test** for
    - Do **not** introduce any external knowledge or additional sources.  
    - The test should feel like it was made directly from a textbook or class notes.  
 
-2. **Relevance Check:**  
-   - The student has **strong areas** in: **{strengths}**  
-   - The student has **average areas** in: **{average}**
-   - The student has **weak areas** in: **{weaknesses}**  
-   - If the document contains **relevant content** on these topics, use strengths(30%), average areas(30%) & weaknesses(40%) for question selection.  
-   - **If the document does NOT cover these topics, ignore strengths and weaknesses and only use document content.**  
-
-3. **Topic-Wise Coverage:**  
+2. **Topic-Wise Coverage:**  
    - Ensure questions **cover all important topics**, balancing distribution across them.  
    - Avoid focusing too much on a single topic unless the document is heavily focused on it.  
    - Cover all the topics in the document.
 
-4. **Exam-Like Question Selection:**  
+3. **Exam-Like Question Selection:**  
    - The questions should feel like a **real test** a student would take before an exam.  
    - Include a mix of **conceptual, application-based, and critical-thinking questions**.  
    - Avoid overly simple questions; ensure a moderate-to-high level of difficulty.  
 
-5. **Answer Choices:**  
+4. **Answer Choices:**  
    - Each question must have exactly **four options**.  
    - Only **one correct answer**, and the other three should be **plausible but incorrect**.  
    - Avoid misleading or overly obvious choices.  
 
-6. **Explanation Field:**  
+5. **Explanation Field:**  
    - Provide a **clear and precise** explanation for the correct answer.  
    - Explanations should be **concise, relevant, and helpful for learning**.  
    - **Do not mention** phrases like "according to the document" or "as per the text."  
@@ -291,6 +283,13 @@ Return the questions in **valid JSON format only**, without any additional text.
 "Options": ["A. <Option 1>", "B. <Option 2>", "C. <Option 3>", "D. <Option 4>"],
 "Correct Answer": "<Correct Answer Letter>",
 "Explanation": "<Explanation>"
+
+### **Student Focus:**  
+   - The student has **strong areas** in: **{strengths}**  
+   - The student has **average areas** in: **{average}**
+   - The student has **weak areas** in: **{weaknesses}**  
+   - If the document contains **relevant content** on these topics, use strengths(30%), average areas(30%) & weaknesses(40%) for question selection.  
+   - **If the document does NOT cover these topics, ignore strengths and weaknesses and only use document content.**
    """
 
 MCQ_PROMPT_WITHOUT_REPORT="""You are a STEM expert tasked with generating a test based on a provided document. Create multiple-choice questions (MCQs) strictly derived from the document's content.
@@ -396,58 +395,22 @@ FOLLOW these strict guidelines:
 ```
 """
 
-FLASHCARD_PROMPT_WITH_REPORT = """You are an AI that extracts key concepts from study materials and generates **high-quality, exam-focused flashcards** in a structured JSON format. Your task is to ensure each flashcard is **strictly derived from the given document**, maintaining **full accuracy and relevance**.  
-
-FOLLOW these strict guidelines:  
-
-1. **Flashcard Focus:**  
-   - Identify and extract **key topics, subtopics, definitions, formulas, and essential concepts** that are **critical for exams**.  
-   - **Prioritize definitions, formulas, theorems, and key takeaways** over general concepts.  
-   - Each flashcard must represent a **distinct, meaningful concept** without redundancy.  
-
-2. **Dynamic Quantity:**  
-   - Determine the **number of flashcards based on the document’s structure and content**.  
-   - Ensure the total count is **below 30** while **covering all essential concepts**.  
-   - Avoid excessive repetition; focus on the **most valuable** exam-related topics.  
-
-3. **Relevance Check:**  
-   - The student has **strong areas** in: **{strengths}**  
-   - The student has **average areas** in: **{average}**
-   - The student has **weak areas** in: **{weaknesses}**  
-   - If the document contains **relevant content** on these topics, use strengths(30%), average areas(30%) & weaknesses(40%) for question selection.  
-   - **If the document does NOT cover these topics, ignore strengths and weaknesses and only use document content.**  
-
-4. **Difficulty Levels:**  
-   - Include a mix of **basic definitions, intermediate concepts, and advanced formulas** to ensure comprehensive learning.  
-
-5. **Concept Format:**  
-   - Use a **‘concept’ and ‘definition’** structure rather than a question-and-answer format.  
-   - Ensure a variety of concept types, including:  
-     - **Definitions (verbatim if present in the document)**  
-     - **Formulas & equations (clearly formatted and explained)**  
-     - **Key theorems or laws (e.g., Newton’s Laws, Ohm’s Law, etc.)**  
-     - **Short explanations for essential concepts**  
-
-6. **Definition & Formula Format:**  
-   - **If a definition or formula is explicitly provided in the document, extract it exactly as it appears.**  
-   - If multiple definitions are listed, **retain them as-is instead of summarizing**.  
-   - **Formulas should be formatted properly, using standard notation.**  
-   - Avoid unnecessary simplification—ensure students **fully grasp the meaning**.  
-   - **If a formula has variables, briefly define them.**  
-
-7. **Concept Selection:**  
-   - **Exclude trivial, repetitive, or irrelevant concepts.**  
-   - **Prioritize meaningful, exam-relevant topics** over general knowledge.  
-   - Ensure every flashcard contributes to a **student’s exam preparation and recall**.  
-
-8. **Strict Content Boundaries:**  
-   - **All concepts and definitions must come strictly from the provided document.**  
-   - Do **not** add **external explanations, assumptions, or inferred details** beyond what is explicitly stated.  
-   - Ensure flashcards **align perfectly with the study material.**  
-
+# Both personalized prompts (this and MCQ_PROMPT_WITH_REPORT) end with the student-specific
+# section, so everything before it is a prefix that provider prompt caches share across students.
+FLASHCARD_PROMPT_WITH_REPORT = FLASHCARD_PROMPT.replace("{", "{{").replace("}", "}}") + """
 ---
-## **Flashcard Output Example (JSON Format):**  
-```json
-    "concept": "Newton's First Law of Motion",
-    "definition": "An object at rest stays at rest, and an object in motion stays in motion unless acted upon by an external force."
-```"""
\ No newline at end of file
+## **Student Focus:**  
+- The student has **strong areas** in: **{strengths}**  
+- The student has **average areas** in: **{average}**
+- The student has **weak areas** in: **{weaknesses}**  
+- If the document contains **relevant content** on these topics, use strengths(30%), average areas(30%) & weaknesses(40%) for flashcard selection.  
+- **If the document does NOT cover these topics, ignore strengths and weaknesses and only use document content.**  
+"""
+
+# Short per-request messages sent after the static instructions and the documents.
+TOPIC_REQUEST = "Extract the chapters and subtopics of the attached document."
+MCQ_REQUEST = "Create the test from the attached document."
+MCQ_TOPICS_REQUEST = "Generate multiple-choice questions for the following topics:\n{topics}\n"
+CHAT_REQUEST = "📖 **Question:** `{question}`\n📖 **Context:** `{context}`\n"
+FLASHCARD_REQUEST = "Generate the flashcards from the attached document."
+REPORT_REQUEST = "Analyze the attached marksheet."
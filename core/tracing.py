@@ -0,0 +1,72 @@
+"""OpenTelemetry tracing for the API, the job workers and the generation pipelines.
+
+TRACE_EXPORTER selects where spans go:
+- "otlp" sends them to a collector at OTEL_EXPORTER_OTLP_ENDPOINT.
+- "file" appends one JSON span per line to TRACE_FILE.
+- "console" prints them.
+- "none" (the default) leaves tracing off, and every span is a no-op.
+
+Services open spans with `tracer`:
+
+    with tracer.start_as_current_span("vector.search", attributes={"vector.results": 5}):
+        ...
+"""
+import json
+import logging
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from core.config import TRACE_EXPORTER, TRACE_FILE, TRACE_SAMPLE_RATIO
+
+tracer = trace.get_tracer("notesight")
+
+_provider = None
+
+
+def _exporter():
+    if TRACE_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if TRACE_EXPORTER == "file":
+        return ConsoleSpanExporter(
+            out=open(TRACE_FILE, "a", buffering=1, encoding="utf-8"),
+            formatter=lambda span: json.dumps(json.loads(span.to_json())) + "\n",
+        )
+    if TRACE_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    raise ValueError(f"Unknown TRACE_EXPORTER: {TRACE_EXPORTER}")
+
+
+def setup_tracing(service_name: str):
+    """Installs the tracer provider for this process; a no-op when TRACE_EXPORTER is "none"."""
+    global _provider
+    if TRACE_EXPORTER == "none" or _provider is not None:
+        return
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(_provider)
+    logging.info(f"Tracing {service_name} to {TRACE_EXPORTER}")
+
+
+def shutdown_tracing():
+    """Exports the spans still buffered; call before the process exits."""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def trace_context() -> dict:
+    """The current span context as W3C trace headers, to carry across a queue."""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def span_links(carrier) -> list:
+    """A link to the span a trace_context() carrier was taken from, if it was sampled."""
+    span_context = trace.get_current_span(propagate.extract(carrier or {})).get_span_context()
+    return [trace.Link(span_context)] if span_context.is_valid else []
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from core.config import ARTIFACT_CACHE_TTL_SECONDS, ARTIFACT_CACHE_FRESH_SECONDS
+from core.metrics import CACHE_LOOKUPS
+from datastorage.db_connect import db
+
+artifacts_collection = db['artifacts']
+
+REFRESH_LOCK_SECONDS = 300
+
+_background_refreshes = set()
+
+
+async def ensure_artifact_cache_indexes():
+    """Lets MongoDB drop artifacts once they pass their hard expiry."""
+    await artifacts_collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_files(file_paths) -> str:
+    """Content hash of a set of files, independent of their names and order."""
+    file_hashes = []
+    for file_path in file_paths:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        file_hashes.append(digest.hexdigest())
+    return hash_bytes("".join(sorted(file_hashes)).encode("utf-8"))
+
+
+def artifact_cache_key(document_hash: str, model: str, prompt_template: str, personalization: str = "") -> str:
+    """Cache key for a generated artifact: document, model, prompt template and personalization."""
+    template_hash = hash_bytes(prompt_template.encode("utf-8"))
+    return hash_bytes(json.dumps([document_hash, model, template_hash, personalization]).encode("utf-8"))
+
+
+async def store_artifact(key, value, kind, ttl=ARTIFACT_CACHE_TTL_SECONDS, fresh_for=ARTIFACT_CACHE_FRESH_SECONDS):
+    now = datetime.utcnow()
+    await artifacts_collection.update_one(
+        {"_id": key},
+        {
+            "$set": {
+                "kind": kind,
+                "value": value,
+                "created_at": now,
+                "fresh_until": now + timedelta(seconds=fresh_for),
+                "expires_at": now + timedelta(seconds=ttl),
+            },
+            "$unset": {"refreshing_until": ""},
+        },
+        upsert=True,
+    )
+
+
+async def _claim_refresh(key, now):
+    """Marks a stale entry as being refreshed so only one request regenerates it."""
+    result = await artifacts_collection.update_one(
+        {"_id": key, "refreshing_until": {"$not": {"$gt": now}}},
+        {"$set": {"refreshing_until": now + timedelta(seconds=REFRESH_LOCK_SECONDS)}},
+    )
+    return result.modified_count == 1
+
+
+async def _generate(generate):
+    """Awaits coroutine functions directly and runs blocking callables in a worker thread."""
+    if asyncio.iscoroutinefunction(generate):
+        return await generate()
+    return await asyncio.to_thread(generate)
+
+
+async def _refresh(key, generate, kind, ttl, fresh_for, on_complete):
+    try:
+        value = await _generate(generate)
+        if value:
+            await store_artifact(key, value, kind, ttl, fresh_for)
+    except Exception as e:
+        logging.error(f"Failed to revalidate cached {kind} {key}: {e}")
+    finally:
+        if on_complete:
+            on_complete()
+
+
+async def get_or_generate(key, generate, kind, ttl=ARTIFACT_CACHE_TTL_SECONDS, fresh_for=ARTIFACT_CACHE_FRESH_SECONDS, on_complete=None):
+    """Returns a cached artifact or generates and stores it.
+
+    `generate` is a coroutine function or a blocking callable, which runs in a worker thread. Returns (value, status)
+    where status is "hit", "stale" or "miss". Stale entries are served immediately while
+    one background task regenerates them. `on_complete` is called exactly once after all
+    work that may still need the source files is done.
+    """
+    refreshing = False
+    try:
+        now = datetime.utcnow()
+        try:
+            entry = await artifacts_collection.find_one({"_id": key})
+        except Exception as e:
+            logging.error(f"Artifact cache lookup failed: {e}")
+            entry = None
+
+        if entry and entry["expires_at"] > now:
+            if entry["fresh_until"] > now:
+                CACHE_LOOKUPS.labels(f"artifact:{kind}", "hit").inc()
+                return entry["value"], "hit"
+            if await _claim_refresh(key, now):
+                refreshing = True
+                task = asyncio.create_task(_refresh(key, generate, kind, ttl, fresh_for, on_complete))
+                _background_refreshes.add(task)
+                task.add_done_callback(_background_refreshes.discard)
+            CACHE_LOOKUPS.labels(f"artifact:{kind}", "stale").inc()
+            return entry["value"], "stale"
+
+        CACHE_LOOKUPS.labels(f"artifact:{kind}", "miss").inc()
+        value = await _generate(generate)
+        if value:
+            try:
+                await store_artifact(key, value, kind, ttl, fresh_for)
+            except Exception as e:
+                logging.error(f"Failed to cache {kind}: {e}")
+        return value, "miss"
+    finally:
+        if on_complete and not refreshing:
+            on_complete()
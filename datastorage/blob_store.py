@@ -0,0 +1,67 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from core.config import BLOB_STORE_DIR, DOCUMENT_TTL_SECONDS
+
+
+def blob_path(sha256: str, suffix: str = "") -> str:
+    """Content-addressed location of a blob; the suffix keeps file-type detection working."""
+    return os.path.join(BLOB_STORE_DIR, sha256[:2], sha256 + suffix)
+
+
+def put_blob(file_path: str, sha256: str, suffix: str = "") -> str:
+    """Moves a file into the store under its content hash and returns the blob path.
+
+    If the same content is already stored, the file is discarded and the existing blob
+    is reused. Either way the blob's mtime is refreshed, which keeps it out of the sweep.
+    """
+    path = blob_path(sha256, suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(file_path)
+    else:
+        os.replace(file_path, path)
+    touch_blob(path)
+    return path
+
+
+def touch_blob(path: str):
+    os.utime(path)
+
+
+def checkout_blob(path: str, directory: str) -> str:
+    """Gives a request its own name for a blob, so it can delete it without affecting the store.
+
+    Hard links cost no copy; filesystems without them fall back to a copy.
+    """
+    suffix = os.path.splitext(path)[1]
+    descriptor, link_path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(descriptor)
+    os.remove(link_path)
+    try:
+        os.link(path, link_path)
+    except OSError:
+        shutil.copyfile(path, link_path)
+    return link_path
+
+
+def sweep_blobs(max_age_seconds: int = DOCUMENT_TTL_SECONDS) -> int:
+    """Deletes blobs no document has referenced within max_age_seconds. Returns how many were removed."""
+    if not os.path.isdir(BLOB_STORE_DIR):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for directory, _, filenames in os.walk(BLOB_STORE_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    if removed:
+        logging.info(f"Removed {removed} expired blobs")
+    return removed
@@ -1,24 +1,132 @@
-from pymongo import MongoClient
-from core.config import MONGODB_URI
-from bson import ObjectId
+from opentelemetry import trace
+from pymongo import AsyncMongoClient, monitoring
+from core.config import (
+    MONGODB_URI,
+    MONGODB_DATABASE,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
+from core.metrics import (
+    MONGO_POOL_CONNECTIONS,
+    MONGO_POOL_CHECKED_OUT,
+    MONGO_POOL_CHECKOUT_SECONDS,
+    MONGO_POOL_CHECKOUT_FAILURES,
+)
+from core.tracing import tracer
 
-client = MongoClient(MONGODB_URI)
-db = client['notesight']
 
-users_collection = db['users']
-reports_collection = db['reports']
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks pool utilisation for the shared client."""
+
+    def __init__(self):
+        self.connections = 0
+        self.checked_out = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.connections += 1
+        MONGO_POOL_CONNECTIONS.set(self.connections)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.connections = max(0, self.connections - 1)
+        MONGO_POOL_CONNECTIONS.set(self.connections)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.labels(reason=str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        MONGO_POOL_CHECKED_OUT.set(self.checked_out)
+        if event.duration is not None:
+            MONGO_POOL_CHECKOUT_SECONDS.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        self.checked_out = max(0, self.checked_out - 1)
+        MONGO_POOL_CHECKED_OUT.set(self.checked_out)
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "checked_out": self.checked_out,
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+        }
 
-def save_student_report(report, report_id=None):
-    if report_id:
-        reports_collection.update_one(
-            {"_id": ObjectId(report_id)},
-            {"$set": report}
+
+pool_metrics = PoolMetricsListener()
+
+
+class CommandTracingListener(monitoring.CommandListener):
+    """Opens a span for every MongoDB command, parented to the operation that sent it."""
+
+    # Handshake and server-monitoring chatter that would only add noise to traces.
+    IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions"}
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        span = tracer.start_span(
+            f"mongo.{event.command_name}",
+            kind=trace.SpanKind.CLIENT,
+            attributes={
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": collection if isinstance(collection, str) else "",
+            },
         )
-    else:
-        result = reports_collection.insert_one(report)
-        report['_id'] = str(result.inserted_id)
-    return report
+        self._spans[(event.connection_id, event.request_id)] = span
+
+    def succeeded(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.set_status(trace.StatusCode.ERROR, str(event.failure.get("errmsg", event.failure)))
+            span.end()
+
+
+command_tracing = CommandTracingListener()
+
+client = AsyncMongoClient(
+    MONGODB_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[pool_metrics, command_tracing],
+)
+db = client[MONGODB_DATABASE]
+
+users_collection = db['users']
+reports_collection = db['reports']
+answer_submissions_collection = db['answer_submissions']
 
 
-def close_connection():
-    client.close()
\ No newline at end of file
+async def close_connection():
+    await client.close()
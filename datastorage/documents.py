@@ -0,0 +1,99 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from core.config import DOCUMENT_TTL_SECONDS
+from core.metrics import CACHE_LOOKUPS
+from datastorage.db_connect import db
+from datastorage.blob_store import put_blob, touch_blob, checkout_blob
+
+# Upload sessions: a document id names a set of uploaded files kept in the blob store,
+# so multi-step flows (topic extraction, then generation) don't need a second upload.
+documents_collection = db['documents']
+
+
+async def ensure_document_indexes():
+    await documents_collection.create_index("expires_at", expireAfterSeconds=0, name="document_ttl")
+
+
+def public_document(document):
+    """The document as returned to clients, without server-side paths."""
+    document = dict(document)
+    document["document_id"] = document.pop("_id")
+    document["files"] = [
+        {key: value for key, value in file.items() if key != "path"} for file in document["files"]
+    ]
+    return document
+
+
+async def create_document(uploads):
+    """Moves saved uploads into the blob store and records them under a new document id."""
+    files = []
+    for upload in uploads:
+        suffix = os.path.splitext(upload["filename"])[1]
+        path = await asyncio.to_thread(put_blob, upload["path"], upload["sha256"], suffix)
+        files.append({
+            "filename": upload["filename"],
+            "size": upload["size"],
+            "sha256": upload["sha256"],
+            "path": path,
+        })
+    now = datetime.utcnow()
+    document = {
+        "_id": uuid.uuid4().hex,
+        "files": files,
+        "topics": {},
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=DOCUMENT_TTL_SECONDS),
+    }
+    await documents_collection.insert_one(document)
+    return public_document(document)
+
+
+async def get_document(document_id: str):
+    """Returns the document with its files' blob paths, extending its lifetime, or None."""
+    now = datetime.utcnow()
+    document = await documents_collection.find_one_and_update(
+        {"_id": document_id, "expires_at": {"$gt": now}},
+        {"$set": {"expires_at": now + timedelta(seconds=DOCUMENT_TTL_SECONDS)}},
+    )
+    if document is None:
+        return None
+    for file in document["files"]:
+        if not os.path.exists(file["path"]):
+            return None
+        touch_blob(file["path"])
+    return document
+
+
+async def checkout_document(document_id: str, directory: str):
+    """Links a document's files into `directory` for one request.
+
+    Returns upload records in the same shape as services.uploads.save_uploads, so callers
+    can remove them when done exactly as they would a fresh upload. Returns None when the
+    document is unknown or expired.
+    """
+    document = await get_document(document_id)
+    if document is None:
+        return None
+    uploads = []
+    for file in document["files"]:
+        link_path = await asyncio.to_thread(checkout_blob, file["path"], directory)
+        uploads.append({
+            "path": link_path,
+            "filename": file["filename"],
+            "size": file["size"],
+            "sha256": file["sha256"],
+        })
+    return uploads
+
+
+async def get_cached_topics(document_id: str, model: str):
+    document = await documents_collection.find_one({"_id": document_id}, {f"topics.{model}": 1})
+    topics = (document or {}).get("topics", {}).get(model)
+    CACHE_LOOKUPS.labels("topics", "hit" if topics else "miss").inc()
+    return topics
+
+
+async def store_topics(document_id: str, model: str, topics: dict):
+    await documents_collection.update_one({"_id": document_id}, {"$set": {f"topics.{model}": topics}})
@@ -0,0 +1,428 @@
+import asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from datetime import datetime
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from core.config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS, ANSWER_IDEMPOTENCY_TTL_SECONDS
+from core.metrics import CACHE_LOOKUPS
+from datastorage.db_connect import users_collection, reports_collection, answer_submissions_collection
+from datastorage.topic_progress import STRENGTH_ACCURACY, AVERAGE_ACCURACY, get_topic_progress, classify_topics
+
+# Projections for the hot paths, so they don't pull whole documents over the wire.
+USER_LOGIN_PROJECTION = {"password": 1}
+USER_EXISTS_PROJECTION = {"_id": 1}
+USER_PROFILE_PROJECTION = {"username": 1, "latest_report_id": 1}
+USER_REPORT_LINK_PROJECTION = {"latest_report_id": 1}
+REPORT_SUMMARY_PROJECTION = {"strengths": 1, "weaknesses": 1, "average": 1}
+REPORT_SUMMARY_FIELDS = ("strengths", "weaknesses", "average")
+
+# Per-process cache of report summaries used for personalization, keyed by user id.
+_profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL_SECONDS)
+
+
+class TopicResultsNotWritten(Exception):
+    """record_topic_results_bulk failed before changing any report, so the batch can be retried."""
+
+
+async def ensure_indexes():
+    """Creates the indexes the user and report queries rely on. Safe to run on every startup."""
+    await users_collection.create_index([("username", ASCENDING)], unique=True, name="username_unique")
+    await reports_collection.create_index([("user_id", ASCENDING)], name="user_id")
+    await answer_submissions_collection.create_index(
+        "created_at", expireAfterSeconds=ANSWER_IDEMPOTENCY_TTL_SECONDS, name="idempotency_ttl"
+    )
+
+
+def to_object_id(value):
+    """Converts a string id to an ObjectId, returning None for malformed ids."""
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def with_string_id(document, id_field="id"):
+    """Returns a copy of a Mongo document with `_id` replaced by a string id field."""
+    if document is None:
+        return None
+    document = dict(document)
+    document[id_field] = str(document.pop("_id"))
+    return document
+
+
+async def find_user_by_username(username: str, projection=None):
+    return with_string_id(await users_collection.find_one({"username": username}, projection))
+
+
+async def username_exists(username: str):
+    return await users_collection.find_one({"username": username}, USER_EXISTS_PROJECTION) is not None
+
+
+async def find_user_by_id(user_id: str, projection=None):
+    object_id = to_object_id(user_id)
+    if object_id is None:
+        return None
+    return with_string_id(await users_collection.find_one({"_id": object_id}, projection))
+
+
+async def create_user(username: str, hashed_password: str):
+    """Inserts a user; raises pymongo's DuplicateKeyError if the username is taken."""
+    result = await users_collection.insert_one({
+        "username": username,
+        "password": hashed_password,
+        "reports": []
+    })
+    return str(result.inserted_id)
+
+
+async def set_latest_report(user_id: str, report_id: str):
+    """Links a report to the user; returns False when the user does not exist."""
+    object_id = to_object_id(user_id)
+    if object_id is None:
+        return False
+    result = await users_collection.update_one(
+        {"_id": object_id},
+        {"$set": {"latest_report_id": report_id}}
+    )
+    invalidate_profile(user_id)
+    return result.matched_count > 0
+
+
+async def find_user_with_report(user_id: str, user_projection=None, report_projection=None):
+    """Fetches a user and their latest report in a single aggregation.
+
+    The report is returned under `latest_report` (None if the user has none); returns
+    None when the user does not exist.
+    """
+    object_id = to_object_id(user_id)
+    if object_id is None:
+        return None
+
+    report_pipeline = [{"$match": {"$expr": {"$eq": [
+        "$_id",
+        {"$convert": {"input": "$$report_id", "to": "objectId", "onError": None, "onNull": None}},
+    ]}}}]
+    if report_projection:
+        report_pipeline.append({"$project": report_projection})
+
+    pipeline = [{"$match": {"_id": object_id}}]
+    if user_projection:
+        pipeline.append({"$project": {**user_projection, "latest_report_id": 1}})
+    pipeline.append({"$lookup": {
+        "from": reports_collection.name,
+        "let": {"report_id": "$latest_report_id"},
+        "pipeline": report_pipeline,
+        "as": "latest_report",
+    }})
+
+    cursor = await users_collection.aggregate(pipeline)
+    user = await cursor.to_list(length=1)
+    if not user:
+        return None
+    user = with_string_id(user[0])
+    reports = user["latest_report"]
+    user["latest_report"] = with_string_id(reports[0], id_field="_id") if reports else None
+    return user
+
+
+def merge_classifications(report, progress):
+    """Overlays the time-decayed topic classification on the report's, topic by topic."""
+    progress_topics = set(progress["strengths"]) | set(progress["average"])
+    progress_topics |= {weakness["subject"] for weakness in progress["weaknesses"]}
+    return {
+        "strengths": [t for t in report["strengths"] if t not in progress_topics] + progress["strengths"],
+        "average": [t for t in report["average"] if t not in progress_topics] + progress["average"],
+        "weaknesses": [w for w in report["weaknesses"] if w["subject"] not in progress_topics] + progress["weaknesses"],
+    }
+
+
+async def get_report_summary(user_id: str):
+    """Strengths, weaknesses and average areas for personalization, cached briefly.
+
+    Combines the user's latest report with their recent per-topic accuracy. Fields are
+    empty lists when there is no data; returns None when the user does not exist.
+    """
+    summary = _profile_cache.get(user_id)
+    CACHE_LOOKUPS.labels("profile", "hit" if summary is not None else "miss").inc()
+    if summary is not None:
+        return summary
+
+    user, progress = await asyncio.gather(
+        find_user_with_report(user_id, USER_REPORT_LINK_PROJECTION, REPORT_SUMMARY_PROJECTION),
+        get_topic_progress(user_id),
+    )
+    if user is None:
+        return None
+    report = user["latest_report"] or {}
+    summary = merge_classifications(
+        {field: report.get(field, []) for field in REPORT_SUMMARY_FIELDS},
+        classify_topics(progress),
+    )
+    _profile_cache[user_id] = summary
+    return summary
+
+
+def invalidate_profile(user_id: str):
+    """Drops the cached report summary after the user's report changes."""
+    _profile_cache.pop(user_id, None)
+
+
+async def find_report(report_id: str, projection=None):
+    object_id = to_object_id(report_id)
+    if object_id is None:
+        return None
+    return with_string_id(await reports_collection.find_one({"_id": object_id}, projection), id_field="_id")
+
+
+async def insert_report(report: dict):
+    result = await reports_collection.insert_one(report)
+    return str(result.inserted_id)
+
+
+async def update_report(report_id: str, fields: dict):
+    await reports_collection.update_one(
+        {"_id": to_object_id(report_id)},
+        {"$set": fields}
+    )
+
+
+async def save_student_report(report, report_id=None):
+    if report_id:
+        await update_report(report_id, report)
+    else:
+        report['_id'] = await insert_report(report)
+    return report
+
+
+def aggregate_topic_results(answers):
+    """Sums (correct, total) per topic so each topic appears once in the update."""
+    results = {}
+    for topic, correct, total in answers:
+        topic_correct, topic_total = results.get(topic, (0, 0))
+        results[topic] = (topic_correct + correct, topic_total + total)
+    return results
+
+
+def _topic_counter(topic, field):
+    # $getField with a literal name copes with topics containing "." or starting with "$".
+    return {"$ifNull": [
+        {"$getField": {"field": {"$literal": field}, "input": {"$getField": {"field": {"$literal": topic}, "input": "$topic_stats"}}}},
+        0,
+    ]}
+
+
+def _topic_stats_pipeline(results):
+    """Update pipeline that adds answer counts to `topic_stats` and re-derives the classification.
+
+    Topics without counters (e.g. from an uploaded report card) keep their existing classification.
+    """
+    increments = [
+        {
+            "k": {"$literal": topic},
+            "v": {
+                "correct": {"$add": [_topic_counter(topic, "correct"), correct]},
+                "total": {"$add": [_topic_counter(topic, "total"), total]},
+            },
+        }
+        for topic, (correct, total) in results.items()
+    ]
+    stats = {"$objectToArray": "$topic_stats"}
+    accuracy = {"$cond": [
+        {"$gt": ["$$stat.v.total", 0]},
+        {"$divide": ["$$stat.v.correct", "$$stat.v.total"]},
+        0,
+    ]}
+
+    def topics_where(condition):
+        return {"$map": {
+            "input": {"$filter": {"input": stats, "as": "stat", "cond": condition}},
+            "as": "stat",
+            "in": "$$stat.k",
+        }}
+
+    counted_topics = {"$map": {"input": stats, "as": "stat", "in": "$$stat.k"}}
+    return [
+        {"$set": {"topic_stats": {"$arrayToObject": {"$concatArrays": [
+            {"$objectToArray": {"$ifNull": ["$topic_stats", {}]}},
+            increments,
+        ]}}}},
+        {"$set": {
+            "strengths": {"$setUnion": [
+                {"$setDifference": [{"$ifNull": ["$strengths", []]}, counted_topics]},
+                topics_where({"$gte": [accuracy, STRENGTH_ACCURACY]}),
+            ]},
+            "average": {"$setUnion": [
+                {"$setDifference": [{"$ifNull": ["$average", []]}, counted_topics]},
+                topics_where({"$and": [{"$gte": [accuracy, AVERAGE_ACCURACY]}, {"$lt": [accuracy, STRENGTH_ACCURACY]}]}),
+            ]},
+            "weaknesses": {"$concatArrays": [
+                {"$filter": {
+                    "input": {"$ifNull": ["$weaknesses", []]},
+                    "as": "weakness",
+                    "cond": {"$not": [{"$in": ["$$weakness.subject", counted_topics]}]},
+                }},
+                {"$map": {
+                    "input": {"$filter": {"input": stats, "as": "stat", "cond": {"$lt": [accuracy, AVERAGE_ACCURACY]}}},
+                    "as": "stat",
+                    "in": {
+                        "subject": "$$stat.k",
+                        "reason": {"$concat": [
+                            "Low accuracy in MCQs (equals to ",
+                            {"$toString": {"$round": [{"$multiply": [accuracy, 100]}, 0]}},
+                            "%)",
+                        ]},
+                    },
+                }},
+            ]},
+        }},
+    ]
+
+
+async def record_topic_results(user_id: str, report_id, results: dict):
+    """Atomically adds per-topic answer counts to a report and returns its new classification.
+
+    `results` maps topic -> (correct, total). Without a report_id a new report is created
+    for the user. Runs as one find_one_and_update, so concurrent submissions never lose counts.
+    """
+    object_id = to_object_id(report_id) if report_id else ObjectId()
+    pipeline = _topic_stats_pipeline(results)
+    if not report_id:
+        pipeline.insert(0, {"$set": {"user_id": user_id}})
+    report = await reports_collection.find_one_and_update(
+        {"_id": object_id},
+        pipeline,
+        projection=REPORT_SUMMARY_PROJECTION,
+        upsert=not report_id,
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_profile(user_id)
+    return with_string_id(report, id_field="_id")
+
+
+async def record_user_topic_results(user_id: str, report_id, results: dict):
+    """record_topic_results for the user's latest report, creating and linking one if they have none.
+
+    The new report is linked only if the user still has none, as in record_topic_results_bulk.
+    When concurrent first submissions race, the losers delete their new report and add their
+    counts to the winner's. Returns None when the user or report does not exist.
+    """
+    report = await record_topic_results(user_id, report_id, results)
+    if report is None or report_id:
+        return report
+    linked = await users_collection.update_one(
+        {"_id": to_object_id(user_id), "latest_report_id": {"$exists": False}},
+        {"$set": {"latest_report_id": report["_id"]}},
+    )
+    if linked.modified_count:
+        return report
+    return await _record_on_linked_report(user_id, report["_id"], results)
+
+
+async def _record_on_linked_report(user_id: str, orphan_report_id, results: dict):
+    """Deletes a new report that lost the race to be linked as the user's first, and adds
+    its counts to the report that won instead. Returns None when the user is gone."""
+    await reports_collection.delete_one({"_id": to_object_id(orphan_report_id)})
+    user = await find_user_by_id(user_id, USER_REPORT_LINK_PROJECTION)
+    winning_report_id = (user or {}).get("latest_report_id")
+    if not winning_report_id:
+        return None
+    return await record_topic_results(user_id, winning_report_id, results)
+
+
+async def record_topic_results_bulk(results_by_user: dict):
+    """Applies per-topic answer counts to many users' reports with bulk writes.
+
+    `results_by_user` maps user id -> {topic: (correct, total)}. Users without a report get
+    a new one linked to them; when a concurrent submission links theirs first, the counts
+    move to that report, as in record_user_topic_results. Returns {user_id: report summary};
+    unknown users are left out. Raises TopicResultsNotWritten when it fails before any
+    report was changed.
+    """
+    object_ids = {user_id: to_object_id(user_id) for user_id in results_by_user}
+    try:
+        cursor = users_collection.find(
+            {"_id": {"$in": [oid for oid in object_ids.values() if oid is not None]}},
+            USER_REPORT_LINK_PROJECTION,
+        )
+        report_ids = {str(user["_id"]): user.get("latest_report_id") async for user in cursor}
+    except Exception as e:
+        raise TopicResultsNotWritten(str(e)) from e
+
+    report_updates = []
+    user_links = []
+    new_reports = {}
+    report_owner = {}
+    for user_id, report_id in report_ids.items():
+        pipeline = _topic_stats_pipeline(results_by_user[user_id])
+        report_object_id = to_object_id(report_id) if report_id else ObjectId()
+        if not report_id:
+            pipeline.insert(0, {"$set": {"user_id": user_id}})
+            user_links.append(UpdateOne(
+                {"_id": object_ids[user_id], "latest_report_id": {"$exists": False}},
+                {"$set": {"latest_report_id": str(report_object_id)}},
+            ))
+            new_reports[user_id] = report_object_id
+        report_updates.append(UpdateOne({"_id": report_object_id}, pipeline, upsert=not report_id))
+        report_owner[report_object_id] = user_id
+
+    if report_updates:
+        try:
+            await reports_collection.bulk_write(report_updates, ordered=False)
+        except BulkWriteError as e:
+            if not e.details.get("nModified") and not e.details.get("nUpserted"):
+                raise TopicResultsNotWritten(str(e)) from e
+            raise
+
+    summaries = {}
+    if user_links:
+        await users_collection.bulk_write(user_links, ordered=False)
+        cursor = users_collection.find(
+            {"_id": {"$in": [object_ids[user_id] for user_id in new_reports]}}, USER_REPORT_LINK_PROJECTION
+        )
+        linked = {str(user["_id"]): user.get("latest_report_id") async for user in cursor}
+        for user_id, report_object_id in new_reports.items():
+            if linked.get(user_id) == str(report_object_id):
+                continue
+            del report_owner[report_object_id]
+            report = await _record_on_linked_report(user_id, report_object_id, results_by_user[user_id])
+            if report is not None:
+                summaries[user_id] = {field: report.get(field, []) for field in REPORT_SUMMARY_FIELDS}
+
+    cursor = reports_collection.find({"_id": {"$in": list(report_owner)}}, REPORT_SUMMARY_PROJECTION)
+    async for report in cursor:
+        user_id = report_owner[report.pop("_id")]
+        summaries[user_id] = {field: report.get(field, []) for field in REPORT_SUMMARY_FIELDS}
+        invalidate_profile(user_id)
+    return summaries
+
+
+async def claim_submission_keys(keys):
+    """Records idempotency keys and returns the ones seen for the first time.
+
+    Keys are stored as `_id`s, so the unique index rejects replays even when two
+    batches race. Entries expire after ANSWER_IDEMPOTENCY_TTL_SECONDS.
+    """
+    if not keys:
+        return set()
+    now = datetime.utcnow()
+    try:
+        await answer_submissions_collection.insert_many(
+            [{"_id": key, "created_at": now} for key in keys], ordered=False
+        )
+        return set(keys)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        duplicates = {keys[error["index"]] for error in errors}
+        return set(keys) - duplicates
+
+
+async def release_submission_keys(keys):
+    """Forgets idempotency keys whose batch failed, so the client can retry it."""
+    if keys:
+        await answer_submissions_collection.delete_many({"_id": {"$in": list(keys)}})
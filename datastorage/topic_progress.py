@@ -0,0 +1,163 @@
+import asyncio
+import math
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, UpdateOne
+from core.config import (
+    TOPIC_ACCURACY_HALF_LIFE_DAYS,
+    TOPIC_BUCKET_RETENTION_DAYS,
+    TOPIC_MIN_DECAYED_ANSWERS,
+    TOPIC_PROGRESS_QUERY_LIMIT,
+)
+from datastorage.db_connect import db
+
+# One document per (user, topic): lifetime counters plus time-decayed counters.
+topic_progress_collection = db['topic_progress']
+# One document per (user, topic, day) with that day's counters, for history charts.
+topic_buckets_collection = db['topic_progress_buckets']
+
+# Accuracy thresholds for classifying a topic.
+STRENGTH_ACCURACY = 0.75
+AVERAGE_ACCURACY = 0.5
+
+TOPIC_PROGRESS_PROJECTION = {
+    "_id": 0, "topic": 1, "correct": 1, "total": 1,
+    "decayed_correct": 1, "decayed_total": 1, "accuracy": 1, "updated_at": 1,
+}
+TOPIC_BUCKET_PROJECTION = {"_id": 0, "bucket": 1, "correct": 1, "total": 1, "submissions": 1}
+
+
+async def ensure_topic_progress_indexes():
+    await topic_progress_collection.create_index(
+        [("user_id", ASCENDING), ("topic", ASCENDING)], unique=True, name="user_topic_unique"
+    )
+    await topic_progress_collection.create_index(
+        [("user_id", ASCENDING), ("accuracy", ASCENDING)], name="user_accuracy"
+    )
+    await topic_buckets_collection.create_index(
+        [("user_id", ASCENDING), ("topic", ASCENDING), ("bucket", ASCENDING)], unique=True, name="user_topic_bucket"
+    )
+    await topic_buckets_collection.create_index(
+        "bucket", expireAfterSeconds=TOPIC_BUCKET_RETENTION_DAYS * 24 * 3600, name="bucket_retention"
+    )
+
+
+def _progress_update(user_id, topic, correct, total):
+    """Upsert that adds a submission's counts, decaying the previous ones by the time since the last update."""
+    decay_per_ms = -math.log(2) / (TOPIC_ACCURACY_HALF_LIFE_DAYS * 24 * 3600 * 1000)
+    return UpdateOne(
+        {"user_id": user_id, "topic": topic},
+        [
+            {"$set": {"_decay": {"$exp": {"$multiply": [
+                decay_per_ms,
+                {"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]},
+            ]}}}},
+            {"$set": {
+                "correct": {"$add": [{"$ifNull": ["$correct", 0]}, correct]},
+                "total": {"$add": [{"$ifNull": ["$total", 0]}, total]},
+                "decayed_correct": {"$add": [{"$multiply": [{"$ifNull": ["$decayed_correct", 0]}, "$_decay"]}, correct]},
+                "decayed_total": {"$add": [{"$multiply": [{"$ifNull": ["$decayed_total", 0]}, "$_decay"]}, total]},
+                "updated_at": "$$NOW",
+            }},
+            {"$set": {"accuracy": {"$cond": [
+                {"$gt": ["$decayed_total", 0]},
+                {"$divide": ["$decayed_correct", "$decayed_total"]},
+                0,
+            ]}}},
+            {"$unset": "_decay"},
+        ],
+        upsert=True,
+    )
+
+
+def _bucket_update(user_id, topic, correct, total, bucket):
+    return UpdateOne(
+        {"user_id": user_id, "topic": topic, "bucket": bucket},
+        {"$inc": {"correct": correct, "total": total, "submissions": 1}},
+        upsert=True,
+    )
+
+
+async def record_topic_answers(user_id: str, results: dict, now=None):
+    """Adds per-topic answer counts to the user's progress and daily buckets.
+
+    `results` maps topic -> (correct, total).
+    """
+    await record_topic_answers_bulk({user_id: results}, now)
+
+
+async def record_topic_answers_bulk(results_by_user: dict, now=None):
+    """Adds per-topic answer counts for many users at once.
+
+    `results_by_user` maps user id -> {topic: (correct, total)}. Each collection gets one
+    unordered bulk write, so a batch costs two round-trips however many users and topics it covers.
+    """
+    now = now or datetime.utcnow()
+    bucket = datetime(now.year, now.month, now.day)
+    progress_updates = []
+    bucket_updates = []
+    for user_id, results in results_by_user.items():
+        for topic, (correct, total) in results.items():
+            progress_updates.append(_progress_update(user_id, topic, correct, total))
+            bucket_updates.append(_bucket_update(user_id, topic, correct, total, bucket))
+    if not progress_updates:
+        return
+    await asyncio.gather(
+        topic_progress_collection.bulk_write(progress_updates, ordered=False),
+        topic_buckets_collection.bulk_write(bucket_updates, ordered=False),
+    )
+
+
+async def get_topic_progress(user_id: str, limit: int = TOPIC_PROGRESS_QUERY_LIMIT):
+    """The user's topics, weakest decayed accuracy first."""
+    cursor = topic_progress_collection.find(
+        {"user_id": user_id}, TOPIC_PROGRESS_PROJECTION
+    ).sort("accuracy", ASCENDING).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def get_topic_history(user_id: str, topic: str, days: int = 30):
+    """Daily answer counts for one topic over the last `days` days, oldest first."""
+    since = datetime.utcnow() - timedelta(days=days)
+    cursor = topic_buckets_collection.find(
+        {"user_id": user_id, "topic": topic, "bucket": {"$gte": since}}, TOPIC_BUCKET_PROJECTION
+    ).sort("bucket", ASCENDING)
+    return await cursor.to_list(length=days + 1)
+
+
+def decay_to(entry, now):
+    """The entry with its decayed counters decayed from its last update up to `now`.
+
+    Stored counters are only decayed when new answers arrive, so a topic nobody has
+    practised in months still holds the weight it had then.
+    """
+    updated_at = entry.get("updated_at")
+    if updated_at is None:
+        return entry
+    days = max((now - updated_at).total_seconds(), 0) / (24 * 3600)
+    decay = math.exp(-math.log(2) * days / TOPIC_ACCURACY_HALF_LIFE_DAYS)
+    return {**entry, "decayed_correct": entry["decayed_correct"] * decay, "decayed_total": entry["decayed_total"] * decay}
+
+
+def classify_topics(progress, now=None):
+    """Splits topic progress into strengths, average and weaknesses by decayed accuracy.
+
+    Counters are decayed to `now` first. Topics whose decayed answer count has fallen
+    below TOPIC_MIN_DECAYED_ANSWERS are left out, so old evidence stops steering personalization.
+    """
+    now = now or datetime.utcnow()
+    classification = {"strengths": [], "average": [], "weaknesses": []}
+    for entry in progress:
+        entry = decay_to(entry, now)
+        if entry["decayed_total"] < TOPIC_MIN_DECAYED_ANSWERS:
+            continue
+        accuracy = entry["accuracy"]
+        if accuracy >= STRENGTH_ACCURACY:
+            classification["strengths"].append(entry["topic"])
+        elif accuracy >= AVERAGE_ACCURACY:
+            classification["average"].append(entry["topic"])
+        else:
+            classification["weaknesses"].append({
+                "subject": entry["topic"],
+                "reason": f"Low accuracy in MCQs (equals to {round(accuracy * 100)}%)",
+            })
+    return classification
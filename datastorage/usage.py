@@ -0,0 +1,77 @@
+from datetime import datetime
+from pymongo import ASCENDING, UpdateOne
+from core.config import USAGE_RETENTION_DAYS
+from datastorage.db_connect import db
+
+# One document per (hour, user, endpoint, provider, model) with that hour's LLM usage counters.
+usage_collection = db['llm_usage']
+
+USAGE_KEY_FIELDS = ("hour", "user_id", "endpoint", "provider", "model")
+USAGE_COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "seconds", "cost_usd")
+USAGE_GROUP_FIELDS = ("endpoint", "provider", "model", "user_id")
+USAGE_GRANULARITIES = ("hour", "day", "total")
+
+
+async def ensure_usage_indexes():
+    await usage_collection.create_index(
+        [(field, ASCENDING) for field in USAGE_KEY_FIELDS], unique=True, name="usage_key"
+    )
+    await usage_collection.create_index([("user_id", ASCENDING), ("hour", ASCENDING)], name="user_hour")
+    await usage_collection.create_index(
+        "hour", expireAfterSeconds=USAGE_RETENTION_DAYS * 24 * 3600, name="usage_retention"
+    )
+
+
+async def write_usage_rollups(rollups: dict):
+    """Adds in-memory rollups to their hourly documents in one unordered bulk write.
+
+    `rollups` maps (hour, user_id, endpoint, provider, model) to a dict of USAGE_COUNTERS
+    plus `max_seconds`.
+    """
+    updates = [
+        UpdateOne(
+            dict(zip(USAGE_KEY_FIELDS, key)),
+            {
+                "$inc": {counter: totals[counter] for counter in USAGE_COUNTERS},
+                "$max": {"max_seconds": totals["max_seconds"]},
+            },
+            upsert=True,
+        )
+        for key, totals in rollups.items()
+    ]
+    if updates:
+        await usage_collection.bulk_write(updates, ordered=False)
+
+
+async def query_usage(since: datetime, until: datetime, group_by=("endpoint", "model"), granularity="day", user_id=None):
+    """Sums usage between `since` and `until` per `group_by` fields and per hour, day or in total.
+
+    Each row carries the summed counters plus average latency and the cached share of prompt tokens.
+    """
+    match = {"hour": {"$gte": since, "$lt": until}}
+    if user_id:
+        match["user_id"] = user_id
+    group_id = {field: f"${field}" for field in group_by}
+    if granularity == "hour":
+        group_id["period"] = "$hour"
+    elif granularity == "day":
+        group_id["period"] = {"$dateTrunc": {"date": "$hour", "unit": "day"}}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": group_id,
+            **{counter: {"$sum": f"${counter}"} for counter in USAGE_COUNTERS},
+            "max_seconds": {"$max": "$max_seconds"},
+        }},
+        {"$sort": {"_id.period": ASCENDING, "cost_usd": -1}},
+    ]
+    cursor = await usage_collection.aggregate(pipeline)
+    rows = []
+    async for row in cursor:
+        group = row.pop("_id")
+        row.update(group)
+        row["avg_seconds"] = round(row["seconds"] / row["calls"], 3) if row["calls"] else 0
+        row["cached_ratio"] = round(row["cached_tokens"] / row["prompt_tokens"], 3) if row["prompt_tokens"] else 0
+        row["cost_usd"] = round(row["cost_usd"], 6)
+        rows.append(row)
+    return rows
@@ -1,8 +1,29 @@
-from fastapi import FastAPI, status
-from api.endpoints import router
+import asyncio
+import logging
+from fastapi import FastAPI, Request, Response, status
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from api.endpoints import router, CHAT_SERVICES
+from api.jobs import router as jobs_router
+from api.metrics import router as metrics_router, HTTPMetricsMiddleware
+from core.config import BLOB_SWEEP_INTERVAL_SECONDS
+from core.tracing import setup_tracing, shutdown_tracing
+from datastorage.artifact_cache import ensure_artifact_cache_indexes
+from datastorage.blob_store import sweep_blobs
+from datastorage.db_connect import close_connection
+from datastorage.repository import ensure_indexes
+from datastorage.topic_progress import ensure_topic_progress_indexes
+from datastorage.documents import ensure_document_indexes
+from datastorage.usage import ensure_usage_indexes
+from services.auth import user_id_from_authorization
+from services.document_handle import track_document_memory
+from services.health import ReadinessCheck, check_mongo, check_llm_providers
+from services.llm_gateway import llm
+from services.usage import track_llm_usage, usage_recorder, flush_usage_periodically
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
+setup_tracing("notesight-api")
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -13,10 +34,103 @@ app.add_middleware(
 )
 app.include_router(router)
 
+@app.middleware("http")
+async def report_document_memory(request: Request, call_next):
+    """Reports the peak resident memory seen while the request held uploaded documents in memory."""
+    memory = track_document_memory()
+    response = await call_next(request)
+    if memory.documents and memory.peak_rss is not None:
+        response.headers["X-Document-Peak-RSS-Bytes"] = str(memory.peak_rss)
+        logging.info(f"{request.method} {request.url.path}: {memory.documents} documents, peak RSS {memory.peak_rss} bytes (+{memory.rss_growth})")
+    return response
+
+@app.middleware("http")
+async def account_llm_usage(request: Request, call_next):
+    """Attributes the request's LLM calls to its route and, when it carries a valid token, its user."""
+    user_id = await user_id_from_authorization(request.headers.get("authorization"))
+    usage = track_llm_usage(user_id, request_scope=request.scope)
+    response = await call_next(request)
+    if usage.calls:
+        # Streaming responses send their headers before generation, so they only show up in the log.
+        response.headers["X-LLM-Tokens"] = str(usage.tokens)
+        logging.info(f"{request.method} {usage.endpoint}: {usage.calls} LLM calls, {usage.tokens} tokens, ${usage.cost_usd:.4f}")
+    return response
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+# Added last, so it is the outermost middleware and times everything the others do.
+app.add_middleware(HTTPMetricsMiddleware)
+FastAPIInstrumentor.instrument_app(app, excluded_urls="health,home,metrics")
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_artifact_cache_indexes()
+    await ensure_indexes()
+    await ensure_topic_progress_indexes()
+    await ensure_document_indexes()
+    await ensure_usage_indexes()
+
+async def sweep_blobs_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(sweep_blobs)
+        except Exception as e:
+            logging.error(f"Blob sweep failed: {e}")
+        await asyncio.sleep(BLOB_SWEEP_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_blob_sweeper():
+    app.state.blob_sweeper = asyncio.create_task(sweep_blobs_periodically())
+
+async def warm_up_chat_services():
+    for name, service in CHAT_SERVICES.items():
+        try:
+            await asyncio.to_thread(service.warm_up)
+        except Exception as e:
+            logging.error(f"Failed to warm up the {name} embedding model: {e}")
+
+@app.on_event("startup")
+async def start_embedding_warmup():
+    # Runs in the background; readiness reports "not_ready" until it is done.
+    app.state.embedding_warmup = asyncio.create_task(warm_up_chat_services())
+
+@app.on_event("startup")
+async def start_usage_flusher():
+    app.state.usage_flusher = asyncio.create_task(flush_usage_periodically())
+
+@app.on_event("shutdown")
+async def close_database():
+    app.state.blob_sweeper.cancel()
+    app.state.usage_flusher.cancel()
+    app.state.embedding_warmup.cancel()
+    await usage_recorder.flush()
+    await llm.aclose()
+    await close_connection()
+    shutdown_tracing()
+
 @app.get("/home", status_code=status.HTTP_200_OK)
 def home():
     return {"message": "Welcome to Notesight Intelligence Systems!"}
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 def health():
-    return {"status": "Up and Healthy!"}
\ No newline at end of file
+    return {"status": "Up and Healthy!"}
+
+readiness_check = ReadinessCheck({
+    "mongo": check_mongo,
+    "llm_providers": check_llm_providers,
+    **{f"vector_store:{name}": service.check_vector_store for name, service in CHAT_SERVICES.items()},
+    **{f"embeddings:{name}": service.check_embeddings for name, service in CHAT_SERVICES.items()},
+})
+
+@app.get("/health/live", status_code=status.HTTP_200_OK)
+async def liveness():
+    """The process is up and its event loop is responsive; checks no dependencies."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness(response: Response):
+    """503 until Mongo, the vector stores and embedding models, and at least one LLM provider are usable."""
+    result = await readiness_check.run()
+    if result["status"] != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return result
\ No newline at end of file
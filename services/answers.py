@@ -0,0 +1,66 @@
+from datastorage import repository, topic_progress
+
+
+def submission_key(user_id: str, idempotency_key: str) -> str:
+    """Idempotency keys are scoped per user so different clients can't collide."""
+    return f"{user_id}:{idempotency_key}"
+
+
+async def ingest_answer_submissions(submissions):
+    """Applies a batch of quiz submissions for many users and returns per-user results.
+
+    Each submission is a dict with `user_id`, `idempotency_key` and `answers`, a list of
+    (topic, correct, total). Replayed keys, within the batch or from earlier batches, are
+    counted as duplicates and not applied again. If the writes fail before any report
+    was changed, the batch's keys are released so it can be retried; after that, the keys
+    stay claimed so a retry cannot count the same answers twice.
+    """
+    keyed = {}
+    results = {}
+    for submission in submissions:
+        user_id = submission["user_id"]
+        user_result = results.setdefault(user_id, {"user_id": user_id, "submissions": 0, "duplicates": 0, "correct": 0, "total": 0})
+        key = submission_key(user_id, submission["idempotency_key"])
+        if key in keyed:
+            user_result["duplicates"] += 1
+            continue
+        keyed[key] = submission
+
+    accepted_keys = await repository.claim_submission_keys(list(keyed))
+    answers_by_user = {}
+    keys_by_user = {}
+    for key, submission in keyed.items():
+        user_result = results[submission["user_id"]]
+        if key not in accepted_keys:
+            user_result["duplicates"] += 1
+            continue
+        user_result["submissions"] += 1
+        keys_by_user.setdefault(submission["user_id"], []).append(key)
+        for topic, correct, total in submission["answers"]:
+            user_result["correct"] += correct
+            user_result["total"] += total
+            answers_by_user.setdefault(submission["user_id"], []).append((topic, correct, total))
+
+    results_by_user = {
+        user_id: repository.aggregate_topic_results(answers)
+        for user_id, answers in answers_by_user.items()
+    }
+    try:
+        summaries = await repository.record_topic_results_bulk(results_by_user)
+    except repository.TopicResultsNotWritten:
+        await repository.release_submission_keys(accepted_keys)
+        raise
+    await topic_progress.record_topic_answers_bulk(
+        {user_id: topics for user_id, topics in results_by_user.items() if user_id in summaries}
+    )
+
+    unknown_users = [user_id for user_id in results_by_user if user_id not in summaries]
+    await repository.release_submission_keys(
+        [key for user_id in unknown_users for key in keys_by_user[user_id]]
+    )
+    for user_id in unknown_users:
+        del results[user_id]
+    for user_id, summary in summaries.items():
+        results[user_id].update(summary)
+
+    return {"users": list(results.values()), "unknown_users": unknown_users}
@@ -1,19 +1,35 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import jwt
-from pymongo import MongoClient
 from fastapi import HTTPException
-from core.config import MONGODB_URI
-
-client = MongoClient(MONGODB_URI)
-db = client['notesight']
-users_collection = db['users']
+from core.config import (
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    AUTH_CACHE_SIZE,
+    TOKEN_CLAIMS_CACHE_TTL_SECONDS,
+    USER_EXISTS_CACHE_TTL_SECONDS,
+)
+from core.metrics import CACHE_LOOKUPS
+from datastorage import repository
 
 SECRET_KEY = "demo"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a small thread pool runs hashes in parallel without
+# blocking the event loop. The bound keeps a login burst from starving other work.
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Verified token results, keyed by the raw token, and user ids known to exist. Both are
+# per-process and short-lived so a revoked user or token is only honoured briefly.
+_token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=TOKEN_CLAIMS_CACHE_TTL_SECONDS)
+_user_exists_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=USER_EXISTS_CACHE_TTL_SECONDS)
 
 def hash_password(password: str) -> str:
     """Hashes a password using bcrypt."""
@@ -23,6 +39,16 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies if the provided password matches the stored hash."""
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password_async(password: str) -> str:
+    """Hashes a password on the bcrypt worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verifies a password on the bcrypt worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """Creates a JWT access token with expiration."""
     to_encode = data.copy()
@@ -32,42 +58,59 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 async def decode_access_token(token: str):
     """Decodes a JWT token and refreshes it if expired."""
+    cached = _token_cache.get(token)
+    if cached and (cached["new_token"] or cached["payload"].get("exp", 0) > time.time()):
+        CACHE_LOOKUPS.labels("token_claims", "hit").inc()
+        return cached
+    CACHE_LOOKUPS.labels("token_claims", "miss").inc()
+
     try:
-        return {"payload": jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), "new_token": None}
+        decoded = {"payload": jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), "new_token": None}
 
     except jwt.ExpiredSignatureError:
         expired_payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
         user_id = expired_payload.get("sub")
 
-        user =await get_user_by_id(user_id)
-        if not user:
+        if not await user_exists(user_id):
             raise HTTPException(status_code=404, detail="User not found")
 
-        new_token = create_access_token(data={"sub": user["id"]})
-        return {"payload": expired_payload, "new_token": new_token}
+        new_token = create_access_token(data={"sub": user_id})
+        decoded = {"payload": expired_payload, "new_token": new_token}
 
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def get_user_by_username(username: str):
+    _token_cache[token] = decoded
+    return decoded
+
+async def user_id_from_authorization(authorization: str):
+    """The user id in a "Bearer <token>" header, or None when there is no valid token. Never raises."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        decoded = await decode_access_token(token)
+    except (HTTPException, jwt.InvalidTokenError):
+        return None
+    return decoded["payload"].get("sub")
+
+async def user_exists(user_id: str) -> bool:
+    """Checks that a user id belongs to an existing user, caching positive answers."""
+    if not user_id:
+        return False
+    if user_id in _user_exists_cache:
+        CACHE_LOOKUPS.labels("user_exists", "hit").inc()
+        return True
+    CACHE_LOOKUPS.labels("user_exists", "miss").inc()
+    if await repository.find_user_by_id(user_id, repository.USER_EXISTS_PROJECTION) is None:
+        return False
+    _user_exists_cache[user_id] = True
+    return True
+
+async def get_user_by_username(username: str, projection=None):
     """Fetches a user by username from MongoDB."""
-    user = users_collection.find_one({"username": username})
-    if user:
-        user_data = dict(user)
-        user_data['id'] = str(user_data['_id'])
-        del user_data['_id']
-        return user_data
-    return None
-
-async def get_user_by_id(user_id: str):
+    return await repository.find_user_by_username(username, projection)
+
+async def get_user_by_id(user_id: str, projection=None):
     """Fetches a user by ID from MongoDB."""
-    user = users_collection.find_one({"_id": user_id})
-    if user:
-        user_data = dict(user)
-        user_data['id'] = str(user_data['_id'])
-        del user_data['_id']
-        return user_data
-    return None
-
-def close_db_connection():
-    client.close()
\ No newline at end of file
+    return await repository.find_user_by_id(user_id, projection)
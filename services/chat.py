@@ -1,98 +1,128 @@
 import os
+import threading
 import spacy
 import chromadb
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
+from cachetools import TTLCache
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from langchain_huggingface import HuggingFaceEmbeddings 
-from core.config import GEMINI_API_KEY as GOOGLE_API_KEY, OPENAI_API_KEY,MISTRAL_API_KEY
-from core.prompts import CHAT_PROMPT
+from core.prompts import CHAT_PROMPT, CHAT_REQUEST
+from core.config import CHAT_HISTORY_USERS, CHAT_HISTORY_TTL_SECONDS
+from core.tracing import tracer
+from core.metrics import EMBEDDING_SECONDS, EMBEDDING_BATCH_SIZE
 import os
 import pdfplumber
 from pptx import Presentation
 import pandas as pd
-from mistralai import Mistral
-import base64
-from langchain_core.retrievers import BaseRetriever
+from services.llm_gateway import llm, run_sync
+from services.health import CheckFailed
 
 nlp = spacy.load("en_core_web_sm")
 
+NO_ANSWER = "I couldn't find relevant information in the uploaded document."
+# Earlier turns sent with each question, oldest dropped first.
+HISTORY_MESSAGES = 10
+
+class ChatHistories:
+    """Each user's recent turns, so one user's questions never reach another's prompt.
+
+    Keeps the last HISTORY_MESSAGES messages for at most CHAT_HISTORY_USERS users, and
+    forgets a user's history CHAT_HISTORY_TTL_SECONDS after their last question.
+    """
+
+    def __init__(self, maxsize=CHAT_HISTORY_USERS, ttl=CHAT_HISTORY_TTL_SECONDS):
+        self._lock = threading.Lock()
+        self._histories = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id):
+        if user_id is None:
+            return []
+        with self._lock:
+            return list(self._histories.get(user_id, []))
+
+    def add(self, user_id, question, answer):
+        if user_id is None:
+            return
+        turn = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        with self._lock:
+            self._histories[user_id] = (self._histories.get(user_id, []) + turn)[-HISTORY_MESSAGES:]
+
+
+def answer_from_context(provider: str, model: str, query: str, context: str, histories: ChatHistories, user_id=None):
+    """Answers a question from retrieved chunks through the LLM gateway and records the turn in the user's history.
+
+    The instructions go in `system` and only the question and context in the prompt, so
+    the instructions are a cacheable prefix. Anonymous callers get no history. The gateway
+    applies the rate limits, retries, tracing and usage accounting. Blocks until the model
+    answers, so async routes call it from a worker thread.
+    """
+    response = run_sync(llm.complete(
+        provider, CHAT_REQUEST.format(question=query, context=context), model=model, system=CHAT_PROMPT,
+        history=histories.get(user_id), temperature=0.7, cache_key="chat",
+    ))
+    answer = response["text"] or NO_ANSWER
+    histories.add(user_id, query, answer)
+    return {"answer": answer}
+
 class DocumentChatServiceGemini:
     def __init__(self, collection_name="document-chat-collection-gemini"):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            google_api_key=GOOGLE_API_KEY,
-            temperature=0.7
-        )
         self.embeddings = HuggingFaceEmbeddings(
             model_name="all-MiniLM-L6-v2",
             model_kwargs={"device": "cpu"}
         )
-
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            output_key="answer",
-            return_messages=True
-        )
+        self.histories = ChatHistories()
         self.client = chromadb.Client()
         self.collection_name = collection_name
         self.collection = self.client.get_or_create_collection(
             name=self.collection_name,
             metadata={"hnsw:space": "cosine"}
         )
+        self.warm = False
 
-        self.custom_prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=CHAT_PROMPT
-        )
-    def encode_image(self,image_path):
-        """Encode the image to base64."""
-        try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        except FileNotFoundError:
-            print(f"Error: The file {image_path} was not found.")
-            return None
-        except Exception as e:  
-            print(f"Error: {e}")
-            return None
+    def warm_up(self):
+        """Runs one embedding so the model's first real request does not pay its lazy initialisation."""
+        with EMBEDDING_SECONDS.labels("warm_up").time():
+            self.embeddings.embed_query("warm-up")
+        self.warm = True
+
+    def check_embeddings(self):
+        if not self.warm:
+            raise CheckFailed("embedding model is still warming up")
+        return "warm"
+
+    def check_vector_store(self):
+        self.client.heartbeat()
+        return {"collection": self.collection_name, "vectors": self.collection.count()}
 
     def extract_text_from_file(self,file_path: str) -> str:
         """Extract text from different file types."""
         ext = os.path.splitext(file_path)[-1].lower()
         text = ""
         
-        try:
-            if ext == ".pdf":
-                with pdfplumber.open(file_path) as pdf:
-                    text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-            elif ext == ".txt":
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            elif ext in [".jpg", ".png"]:
-                mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-                base64_image = self.encode_image(file_path)
-                ocr_response = mistral_client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"}
-                )
-                text = "\n".join(page.markdown for page in ocr_response.pages)
-            elif ext == ".pptx":
-                prs = Presentation(file_path)
-                text = "\n".join([shape.text.strip() for slide in prs.slides 
-                                for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()])
-            elif ext in [".xlsx", ".csv"]:
-                df = pd.read_excel(file_path, dtype=str) if ext == ".xlsx" else pd.read_csv(file_path, dtype=str)
-                text = df.to_string(index=False)
-            else:
-                text = "Unsupported file type."
-        except Exception as e:
-            text = f"Error processing file: {str(e)}"
+        with tracer.start_as_current_span("extract.text", attributes={"extract.extension": ext}) as span:
+            try:
+                if ext == ".pdf":
+                    with pdfplumber.open(file_path) as pdf:
+                        text = "\n".join([page.extract_text() or "" for page in pdf.pages])
+                elif ext == ".txt":
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        text = f.read()
+                elif ext in [".jpg", ".png"]:
+                    text = run_sync(llm.extract_image_text(file_path))
+                elif ext == ".pptx":
+                    prs = Presentation(file_path)
+                    text = "\n".join([shape.text.strip() for slide in prs.slides 
+                                    for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()])
+                elif ext in [".xlsx", ".csv"]:
+                    df = pd.read_excel(file_path, dtype=str) if ext == ".xlsx" else pd.read_csv(file_path, dtype=str)
+                    text = df.to_string(index=False)
+                else:
+                    text = "Unsupported file type."
+            except Exception as e:
+                span.record_exception(e)
+                text = f"Error processing file: {str(e)}"
+            span.set_attribute("extract.characters", len(text))
         
         return text.strip()
 
@@ -120,141 +150,106 @@ class DocumentChatServiceGemini:
 
     def _upsert_to_chroma(self, docs):
         """Upserts document chunks to Chroma."""
-        embeddings = [self.embeddings.embed_query(doc.page_content) for doc in docs]
+        EMBEDDING_BATCH_SIZE.observe(len(docs))
+        with tracer.start_as_current_span("embed.documents", attributes={"embed.documents": len(docs)}), EMBEDDING_SECONDS.labels("documents").time():
+            embeddings = [self.embeddings.embed_query(doc.page_content) for doc in docs]
         ids = [f"doc_{i}" for i in range(len(docs))]
         metadatas = [{"text": doc.page_content} for doc in docs]
         documents = [doc.page_content for doc in docs]
 
-        self.client.delete_collection(self.collection_name)
-        self.collection = self.client.create_collection(name=self.collection_name, metadata={"hnsw:space": "cosine"})
-        self.collection.add(
-            embeddings=embeddings,
-            ids=ids,
-            metadatas=metadatas,
-            documents=documents
-        )
+        with tracer.start_as_current_span("vector.upsert", attributes={"vector.documents": len(docs)}):
+            self.client.delete_collection(self.collection_name)
+            self.collection = self.client.create_collection(name=self.collection_name, metadata={"hnsw:space": "cosine"})
+            self.collection.add(
+                embeddings=embeddings,
+                ids=ids,
+                metadatas=metadatas,
+                documents=documents
+            )
         print(f"Upserted {len(embeddings)} vectors to Chroma (Gemini). Collection count: {self.collection.count()}")
 
-    def ask_question(self, query: str):
-        """Answers queries using Chroma vector search."""
-        query_embedding = self.embeddings.embed_query(query)
-        search_results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=10,
-            include=["metadatas", "documents"]
-        )
+    def ask_question(self, query: str, user_id: str = None):
+        """Answers queries using Chroma vector search, continuing the user's conversation."""
+        with tracer.start_as_current_span("embed.query"), EMBEDDING_SECONDS.labels("query").time():
+            query_embedding = self.embeddings.embed_query(query)
+        with tracer.start_as_current_span("vector.search", attributes={"vector.results": 10}):
+            search_results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=10,
+                include=["metadatas", "documents"]
+            )
         print(f"Search results (Gemini): {search_results}")
 
         if not search_results["ids"][0] or not search_results["documents"][0]:
             print("No documents found in Chroma search (Gemini).")
-            return {"answer": "I couldn't find relevant information in the uploaded document."}
+            return {"answer": NO_ANSWER}
 
         valid_docs = [doc for doc in search_results["documents"][0] if doc is not None]
         if not valid_docs:
             print("All documents in search results were None (Gemini).")
-            return {"answer": "I couldn't find relevant information in the uploaded document."}
+            return {"answer": NO_ANSWER}
         context = "\n".join(valid_docs)
         print(f"Context from Chroma (Gemini): {context[:100]}...")
-
-        class ChromaRetriever(BaseRetriever):
-            def __init__(self, collection, embeddings):
-                super().__init__()
-                self._collection = collection
-                self._embeddings = embeddings
-
-            def _get_relevant_documents(self, query: str):
-                query_embedding = self._embeddings.embed_query(query)
-                results = self._collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=10,
-                    include=["metadatas", "documents"]
-                )
-                valid_docs = [doc for doc in results["documents"][0] if doc is not None]
-                return [Document(page_content=doc, metadata={"text": meta["text"]})
-                        for doc, meta in zip(valid_docs, results["metadatas"][0])]
-
-        retriever = ChromaRetriever(self.collection, self.embeddings)
-        conversation_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": self.custom_prompt}
-        )
-
-        response = conversation_chain.invoke({"question": query, "chat_history": self.memory.load_memory_variables({})["chat_history"]})
-        return {"answer": response.get("answer", "I couldn't find relevant information in the uploaded document.")}
+        return answer_from_context("gemini", "gemini-1.5-flash", query, context, self.histories, user_id)
     
 class DocumentChatServiceOpenAI:
     def __init__(self, collection_name="document-chat-collection-openai"):
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=OPENAI_API_KEY,
-            temperature=0.7
-        )
         self.embeddings = HuggingFaceEmbeddings(
             model_name="all-MiniLM-L6-v2",
             model_kwargs={"device": "cpu"}
         )
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            output_key="answer",
-            return_messages=True
-        )
+        self.histories = ChatHistories()
         self.client = chromadb.Client()
         self.collection_name = collection_name
         self.collection = self.client.get_or_create_collection(
             name=self.collection_name,
             metadata={"hnsw:space": "cosine"}
         )
+        self.warm = False
+
+    def warm_up(self):
+        """Runs one embedding so the model's first real request does not pay its lazy initialisation."""
+        with EMBEDDING_SECONDS.labels("warm_up").time():
+            self.embeddings.embed_query("warm-up")
+        self.warm = True
 
-        self.custom_prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=CHAT_PROMPT)
-
-    def encode_image(self,image_path):
-        """Encode the image to base64."""
-        try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        except FileNotFoundError:
-            print(f"Error: The file {image_path} was not found.")
-            return None
-        except Exception as e:  
-            print(f"Error: {e}")
-            return None
+    def check_embeddings(self):
+        if not self.warm:
+            raise CheckFailed("embedding model is still warming up")
+        return "warm"
+
+    def check_vector_store(self):
+        self.client.heartbeat()
+        return {"collection": self.collection_name, "vectors": self.collection.count()}
 
     def extract_text_from_file(self,file_path: str) -> str:
         """Extract text from different file types."""
         ext = os.path.splitext(file_path)[-1].lower()
         text = ""
         
-        try:
-            if ext == ".pdf":
-                with pdfplumber.open(file_path) as pdf:
-                    text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-            elif ext == ".txt":
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            elif ext in [".jpg", ".png"]:
-                mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-                base64_image = self.encode_image(file_path)
-                ocr_response = mistral_client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"}
-                )
-                text = "\n".join(page.markdown for page in ocr_response.pages)
-            elif ext == ".pptx":
-                prs = Presentation(file_path)
-                text = "\n".join([shape.text.strip() for slide in prs.slides 
-                                for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()])
-            elif ext in [".xlsx", ".csv"]:
-                df = pd.read_excel(file_path, dtype=str) if ext == ".xlsx" else pd.read_csv(file_path, dtype=str)
-                text = df.to_string(index=False)
-            else:
-                text = "Unsupported file type."
-        except Exception as e:
-            text = f"Error processing file: {str(e)}"
+        with tracer.start_as_current_span("extract.text", attributes={"extract.extension": ext}) as span:
+            try:
+                if ext == ".pdf":
+                    with pdfplumber.open(file_path) as pdf:
+                        text = "\n".join([page.extract_text() or "" for page in pdf.pages])
+                elif ext == ".txt":
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        text = f.read()
+                elif ext in [".jpg", ".png"]:
+                    text = run_sync(llm.extract_image_text(file_path))
+                elif ext == ".pptx":
+                    prs = Presentation(file_path)
+                    text = "\n".join([shape.text.strip() for slide in prs.slides 
+                                    for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()])
+                elif ext in [".xlsx", ".csv"]:
+                    df = pd.read_excel(file_path, dtype=str) if ext == ".xlsx" else pd.read_csv(file_path, dtype=str)
+                    text = df.to_string(index=False)
+                else:
+                    text = "Unsupported file type."
+            except Exception as e:
+                span.record_exception(e)
+                text = f"Error processing file: {str(e)}"
+            span.set_attribute("extract.characters", len(text))
         
         return text.strip()
 
@@ -282,68 +277,44 @@ class DocumentChatServiceOpenAI:
 
     def _upsert_to_chroma(self, docs):
         """Upserts document chunks to Chroma."""
-        embeddings = [self.embeddings.embed_query(doc.page_content) for doc in docs]
+        EMBEDDING_BATCH_SIZE.observe(len(docs))
+        with tracer.start_as_current_span("embed.documents", attributes={"embed.documents": len(docs)}), EMBEDDING_SECONDS.labels("documents").time():
+            embeddings = [self.embeddings.embed_query(doc.page_content) for doc in docs]
         ids = [f"doc_{i}" for i in range(len(docs))]
         metadatas = [{"text": doc.page_content} for doc in docs]
         documents = [doc.page_content for doc in docs]
 
-        self.client.delete_collection(self.collection_name)
-        self.collection = self.client.create_collection(name=self.collection_name, metadata={"hnsw:space": "cosine"})
-        self.collection.add(
-            embeddings=embeddings,
-            ids=ids,
-            metadatas=metadatas,
-            documents=documents
-        )
+        with tracer.start_as_current_span("vector.upsert", attributes={"vector.documents": len(docs)}):
+            self.client.delete_collection(self.collection_name)
+            self.collection = self.client.create_collection(name=self.collection_name, metadata={"hnsw:space": "cosine"})
+            self.collection.add(
+                embeddings=embeddings,
+                ids=ids,
+                metadatas=metadatas,
+                documents=documents
+            )
         print(f"Upserted {len(embeddings)} vectors to Chroma (OpenAI). Collection count: {self.collection.count()}")
 
-    def ask_question(self, query: str):
-        """Answers queries using Chroma vector search."""
-        query_embedding = self.embeddings.embed_query(query)
-        search_results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=10,
-            include=["metadatas", "documents"]
-        )
+    def ask_question(self, query: str, user_id: str = None):
+        """Answers queries using Chroma vector search, continuing the user's conversation."""
+        with tracer.start_as_current_span("embed.query"), EMBEDDING_SECONDS.labels("query").time():
+            query_embedding = self.embeddings.embed_query(query)
+        with tracer.start_as_current_span("vector.search", attributes={"vector.results": 10}):
+            search_results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=10,
+                include=["metadatas", "documents"]
+            )
         print(f"Search results (OpenAI): {search_results}")
 
         if not search_results["ids"][0] or not search_results["documents"][0]:
             print("No documents found in Chroma search (OpenAI).")
-            return {"answer": "I couldn't find relevant information in the uploaded document."}
+            return {"answer": NO_ANSWER}
 
         valid_docs = [doc for doc in search_results["documents"][0] if doc is not None]
         if not valid_docs:
             print("All documents in search results were None (OpenAI).")
-            return {"answer": "I couldn't find relevant information in the uploaded document."}
+            return {"answer": NO_ANSWER}
         context = "\n".join(valid_docs)
         print(f"Context from Chroma (OpenAI): {context[:100]}...")
-
-        from langchain_core.retrievers import BaseRetriever
-        class ChromaRetriever(BaseRetriever):
-            def __init__(self, collection, embeddings):
-                super().__init__()
-                self._collection = collection
-                self._embeddings = embeddings
-
-            def _get_relevant_documents(self, query: str):
-                query_embedding = self._embeddings.embed_query(query)
-                results = self._collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=10,
-                    include=["metadatas", "documents"]
-                )
-                valid_docs = [doc for doc in results["documents"][0] if doc is not None]
-                return [Document(page_content=doc, metadata={"text": meta["text"]})
-                        for doc, meta in zip(valid_docs, results["metadatas"][0])]
-
-        retriever = ChromaRetriever(self.collection, self.embeddings)
-        conversation_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": self.custom_prompt}
-        )
-
-        response = conversation_chain.invoke({"question": query, "chat_history": self.memory.load_memory_variables({})["chat_history"]})
-        return {"answer": response.get("answer", "I couldn't find relevant information in the uploaded document.")}
+        return answer_from_context("openai", "gpt-4o-mini", query, context, self.histories, user_id)
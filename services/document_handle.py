@@ -0,0 +1,145 @@
+import asyncio
+import base64
+import contextvars
+import mimetypes
+import mmap
+import os
+import threading
+from google.genai import types
+from core.config import INLINE_DOCUMENT_MAX_BYTES
+
+
+def resident_bytes():
+    """The process's current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class DocumentMemory:
+    """The peak resident memory seen while one request held document content in memory.
+
+    RSS is sampled when the request starts and right after each document is encoded,
+    while the encoded copy is still alive. It is process-wide, so concurrent requests
+    show up in each other's peaks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.start_rss = resident_bytes()
+        self.peak_rss = self.start_rss
+
+    def add(self):
+        rss = resident_bytes()
+        with self._lock:
+            self.documents += 1
+            if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                self.peak_rss = rss
+
+    @property
+    def rss_growth(self):
+        """How far the peak rose above the RSS at the start of the request, in bytes."""
+        if self.peak_rss is None or self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+
+_request_memory = contextvars.ContextVar("document_memory", default=None)
+
+
+def track_document_memory() -> DocumentMemory:
+    """Starts tracking document memory for the current request.
+
+    The tracker lives in a context variable, so handles opened in threadpool workers
+    spawned by the request report into it too.
+    """
+    memory = DocumentMemory()
+    _request_memory.set(memory)
+    return memory
+
+
+class DocumentHandle:
+    """An uploaded file as the provider SDKs need it, without reading it into memory first.
+
+    The file is memory-mapped, so encoders work straight off the page cache. Files larger
+    than INLINE_DOCUMENT_MAX_BYTES go through the provider's file-upload API, which streams
+    them from disk, instead of being inlined in the request.
+
+    Inline Gemini parts are the exception: the SDK only accepts `bytes`, so small PDFs are
+    read once, straight into the bytes object it keeps, rather than mapped and then copied.
+    """
+
+    def __init__(self, path: str, mime_type: str = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"❌ File not found: {path}")
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.mime_type = mime_type or mimetypes.guess_type(path)[0]
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def buffer(self):
+        """A read-only view of the file's bytes backed by the page cache."""
+        if self.size == 0:
+            return memoryview(b"")
+        if self._map is None:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def stream(self):
+        """A file object for SDKs that upload from a stream; the caller closes it."""
+        return open(self.path, "rb")
+
+    def base64(self) -> str:
+        view = self.buffer()
+        try:
+            encoded = base64.b64encode(view).decode("ascii")
+        finally:
+            view.release()
+        self._record()
+        return encoded
+
+    def is_inline(self) -> bool:
+        return self.size <= INLINE_DOCUMENT_MAX_BYTES
+
+    async def gemini_part(self, client):
+        """A Gemini content part: inline bytes for small PDFs, an uploaded file otherwise."""
+        if self.mime_type == "application/pdf" and self.is_inline():
+            with self.stream() as file:
+                data = file.read()
+            self._record()
+            return types.Part.from_bytes(data=data, mime_type=self.mime_type)
+
+        config = {"mime_type": self.mime_type} if self.mime_type else None
+        uploaded = await client.aio.files.upload(file=self.path, config=config)
+        while uploaded.state and uploaded.state.name == "PROCESSING":
+            await asyncio.sleep(1)
+            uploaded = await client.aio.files.get(name=uploaded.name)
+        return uploaded
+
+    def _record(self):
+        memory = _request_memory.get()
+        if memory is not None:
+            memory.add()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+
+def encode_base64(file_path: str) -> str:
+    with DocumentHandle(file_path) as document:
+        return document.base64()
@@ -0,0 +1,91 @@
+"""Local stand-ins for the LLM providers, with injectable latency and failures.
+
+They implement the same adapter interface as the real providers in llm_gateway, so
+routing, hedging and retries can be exercised without API keys or network calls.
+Set LLM_FAKE_PROVIDERS to run the whole app against them, e.g.
+
+    LLM_FAKE_PROVIDERS="gemini:0.4:0.1:8,openai:0.6,mistral:0.8::0.05"
+
+Each entry is name:latency[:spike_rate[:spike_seconds[:failure_rate]]].
+"""
+import asyncio
+import json
+import os
+import random
+
+FAKE_RESPONSE = json.dumps([
+    {
+        "topic": "Fake topic",
+        "question": "Which provider answered?",
+        "options": ["A", "B", "C", "D"],
+        "correct_answer": "A",
+        "explanation": "Generated locally by a fake provider.",
+    }
+])
+
+
+class FakeProviderError(Exception):
+    """An injected failure that the gateway treats as a transient 503."""
+
+    status_code = 503
+
+
+class FakeProvider:
+    def __init__(self, name, latency=0.2, spike_rate=0.0, spike_seconds=5.0, failure_rate=0.0,
+                 text=FAKE_RESPONSE, chunk_size=16):
+        self.name = name
+        self.latency = latency
+        self.spike_rate = spike_rate
+        self.spike_seconds = spike_seconds
+        self.failure_rate = failure_rate
+        self.text = text
+        self.chunk_size = chunk_size
+
+    def create_client(self):
+        return None
+
+    async def close_client(self, client):
+        pass
+
+    async def _respond(self):
+        """Sleeps for the configured latency, sometimes a spike, then maybe fails."""
+        seconds = self.latency
+        if random.random() < self.spike_rate:
+            seconds += self.spike_seconds
+        await asyncio.sleep(seconds)
+        if random.random() < self.failure_rate:
+            raise FakeProviderError(f"{self.name} injected failure")
+
+    def _usage(self, prompt):
+        return {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(self.text) // 4}
+
+    async def complete(self, client, model, prompt, options, documents):
+        await self._respond()
+        return self.text, self._usage(prompt)
+
+    async def stream(self, client, model, prompt, options, documents):
+        await self._respond()
+        for start in range(0, len(self.text), self.chunk_size):
+            yield self.text[start:start + self.chunk_size], {}
+        yield None, self._usage(prompt)
+
+    async def prepare(self, gateway, client, file_paths):
+        return [
+            {"type": "text", "text": f"[{len(item)} bytes]" if isinstance(item, bytes) else os.path.basename(item)}
+            for item in file_paths
+        ]
+
+    async def ocr(self, client, file_path):
+        await self._respond()
+        return f"Text of {os.path.basename(file_path)}"
+
+
+def fake_providers(spec: str):
+    """Builds FakeProviders from an LLM_FAKE_PROVIDERS string; see the module docstring."""
+    providers = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, *values = entry.split(":")
+        settings = [float(value) if value else None for value in values]
+        keys = ("latency", "spike_rate", "spike_seconds", "failure_rate")
+        providers.append(FakeProvider(name, **{key: value for key, value in zip(keys, settings) if value is not None}))
+    return providers
@@ -0,0 +1,79 @@
+"""Liveness and readiness checks for the orchestrator's probes.
+
+Readiness runs every dependency check concurrently, each bounded by
+HEALTH_CHECK_TIMEOUT_SECONDS. It caches the result for HEALTH_CACHE_SECONDS,
+so frequent probes from several sources cost one round of checks.
+"""
+import asyncio
+import time
+from core.config import HEALTH_CACHE_SECONDS, HEALTH_CHECK_TIMEOUT_SECONDS, MONGO_MAX_POOL_SIZE
+from core.metrics import HEALTH_CHECK_OK
+from datastorage.db_connect import client, pool_metrics
+from services.llm_gateway import llm
+
+
+class CheckFailed(Exception):
+    """Raised by a readiness check whose dependency is not usable."""
+
+
+async def check_mongo():
+    if pool_metrics.checked_out >= MONGO_MAX_POOL_SIZE:
+        raise CheckFailed(f"connection pool exhausted ({pool_metrics.checked_out}/{MONGO_MAX_POOL_SIZE} in use)")
+    await client.admin.command("ping")
+    return pool_metrics.stats()
+
+
+def check_llm_providers():
+    """Ready while at least one provider's circuit breaker is closed, since calls can fail over to it."""
+    breakers = {name: "open" if breaker.is_open else "closed" for name, breaker in llm.breakers.items()}
+    if breakers and "closed" not in breakers.values():
+        raise CheckFailed(f"every provider circuit is open: {breakers}")
+    return breakers
+
+
+class ReadinessCheck:
+    """Runs the named checks and caches the combined result.
+
+    Each check is a coroutine function or a blocking callable, which runs in a worker
+    thread. It returns details to report, or raises when its dependency is not usable.
+    """
+
+    def __init__(self, checks, cache_seconds=HEALTH_CACHE_SECONDS, timeout=HEALTH_CHECK_TIMEOUT_SECONDS):
+        self.checks = checks
+        self.cache_seconds = cache_seconds
+        self.timeout = timeout
+        self._result = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _run_check(self, name, check):
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeout):
+                if asyncio.iscoroutinefunction(check):
+                    detail = await check()
+                else:
+                    detail = await asyncio.to_thread(check)
+            result = {"status": "ok", "detail": detail}
+        except TimeoutError:
+            result = {"status": "fail", "error": f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": "fail", "error": str(e)}
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        HEALTH_CHECK_OK.labels(name).set(1 if result["status"] == "ok" else 0)
+        return result
+
+    async def run(self):
+        """{"status": "ready" | "not_ready", "checks": {...}}, at most HEALTH_CACHE_SECONDS old."""
+        if self._result is not None and time.monotonic() - self._checked_at < self.cache_seconds:
+            return self._result
+        async with self._lock:
+            # Probes that queued behind a running check reuse its result.
+            if self._result is not None and time.monotonic() - self._checked_at < self.cache_seconds:
+                return self._result
+            results = await asyncio.gather(*(self._run_check(name, check) for name, check in self.checks.items()))
+            checks = dict(zip(self.checks, results))
+            ready = all(result["status"] == "ok" for result in checks.values())
+            self._result = {"status": "ready" if ready else "not_ready", "checks": checks}
+            self._checked_at = time.monotonic()
+            return self._result
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from core.config import LLM_ROUTING
+from services.jobs import job_task, run_worker
+from services.summary import stream_summary
+from services.mcqs import MCQ_GENERATORS, generate_mcqs_parallel
+from services.flashcards import FLASHCARD_GENERATORS
+from services.report import get_or_process_report
+from services.uploads import load_uploads, upload_paths, remove_uploads, remove_upload_paths
+from datastorage.documents import get_cached_topics, store_topics
+from datastorage import repository
+
+
+@job_task("notes")
+async def generate_notes_job(payload, progress):
+    """Generates the full set of notes from the worker's own checkout of the document."""
+    uploads = await load_uploads(document_id=payload["document_id"])
+    chunks = []
+
+    def files_done(done, total):
+        progress(int(100 * done / total), f"{len(chunks)} chunks generated")
+
+    try:
+        async for chunk in stream_summary(upload_paths(uploads), payload["model"], payload.get("routing") or LLM_ROUTING, files_done):
+            chunks.append(chunk)
+    finally:
+        remove_uploads(uploads)
+    return {"notes": "".join(chunks)}
+
+
+@job_task("flashcards")
+async def generate_flashcards_job(payload, progress):
+    uploads = await load_uploads(document_id=payload["document_id"])
+    try:
+        flashcard_generator = FLASHCARD_GENERATORS[payload["model"]](routing=payload.get("routing"))
+        progress(10, "Generating flashcards")
+        flashcards = await asyncio.to_thread(flashcard_generator.generate_flashcards, file_paths=upload_paths(uploads))
+        if not isinstance(flashcards, list):
+            raise ValueError("Failed to generate flashcards")
+        return {"flashcards": flashcards}
+    finally:
+        remove_uploads(uploads)
+
+
+@job_task("mcq_topics")
+async def extract_topics_job(payload, progress):
+    """Extracts topics and stores them on the document, which the result names for /jobs/mcqs/generate/."""
+    document_id = payload["document_id"]
+    cached_topics = await get_cached_topics(document_id, payload["model"])
+    if cached_topics:
+        return {"topics": cached_topics, "document_id": document_id}
+    uploads = await load_uploads(document_id=document_id)
+    file_paths = upload_paths(uploads)
+    try:
+        mcq_generator = MCQ_GENERATORS[payload["model"]]()
+        structured_topics = {}
+        for index, file_path in enumerate(file_paths):
+            structured_topics.update(await asyncio.to_thread(mcq_generator.upload_and_parse_file, file_path))
+            progress(int(100 * (index + 1) / len(file_paths)), f"Extracted topics from {index + 1}/{len(file_paths)} files")
+        if not structured_topics:
+            raise ValueError("Failed to extract topics from files.")
+        await store_topics(document_id, payload["model"], structured_topics)
+        return {"topics": structured_topics, "document_id": document_id}
+    finally:
+        remove_uploads(uploads)
+
+
+@job_task("mcqs")
+async def generate_mcqs_job(payload, progress):
+    mcq_generator = MCQ_GENERATORS[payload["model"]](routing=payload.get("routing"))
+    uploads = await load_uploads(document_id=payload["document_id"])
+    try:
+        mcqs, batches = await asyncio.to_thread(
+            generate_mcqs_parallel,
+            mcq_generator,
+            payload["topics"],
+            upload_paths(uploads),
+            payload.get("batch_size", 5),
+            payload.get("max_workers", 4),
+            progress=lambda done, total: progress(int(100 * done / total), f"{done}/{total} batches done"),
+        )
+    finally:
+        remove_uploads(uploads)
+    if not mcqs:
+        raise ValueError("Failed to generate MCQs")
+    return {"mcqs": mcqs, "batches": batches}
+
+
+@job_task("report_profile")
+async def generate_report_profile_job(payload, progress):
+    """Builds the report from the saved upload, which the gateway reads only on a cache miss."""
+    student_report, _ = await get_or_process_report(
+        payload["file_path"], payload["sha256"], on_complete=lambda: remove_upload_paths([payload["file_path"]])
+    )
+
+    progress(80, "Saving report")
+    student_report["user_id"] = payload["user_id"]
+    doc_id = await repository.insert_report(student_report)
+    await repository.set_latest_report(payload["user_id"], doc_id)
+    student_report["_id"] = doc_id
+    return student_report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    run_worker()
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import redis.asyncio as redis
+from opentelemetry import trace
+from prometheus_client import start_http_server
+from core.config import (
+    JOB_BACKEND, JOB_WORKERS, JOB_RESULT_TTL_SECONDS, JOB_HEARTBEAT_SECONDS, JOB_MAX_ATTEMPTS, REDIS_URL, WORKER_METRICS_PORT,
+)
+from core.metrics import JOB_QUEUE_DEPTH, JOB_WAIT_SECONDS, JOB_RUN_SECONDS, JOBS_COMPLETED
+from core.tracing import tracer, setup_tracing, shutdown_tracing, trace_context, span_links
+from services.rate_limiter import set_llm_priority
+from services.usage import track_llm_usage, usage_recorder, flush_usage_periodically
+
+JOB_TASKS = {}
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+def job_task(kind):
+    """Registers a function as the handler for a job kind.
+
+    Handlers are coroutines that receive the job payload and a `progress(percent, message)`
+    callback, which is safe to call from worker threads, and return a JSON-serialisable result.
+    """
+    def register(func):
+        JOB_TASKS[kind] = func
+        return func
+    return register
+
+
+def new_job(kind, payload):
+    return {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        # The submitting user; only they can read the job back.
+        "user_id": payload.get("user_id"),
+        "status": "queued",
+        "progress": 0,
+        "message": "",
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "attempts": 0,
+        "trace_context": trace_context(),
+    }
+
+
+def public_job(job):
+    """The job as returned to clients, without its internal payload and trace context."""
+    return {key: value for key, value in job.items() if key not in ("payload", "trace_context")}
+
+
+def is_job_owner(job, user_id):
+    """Whether the user may read the job: only the user who submitted it can."""
+    return job.get("user_id") is not None and job["user_id"] == user_id
+
+
+async def run_job(backend, job):
+    """Runs one job through its registered handler, recording status, timings and outcome.
+
+    Its LLM calls queue behind interactive requests for rate-limit capacity and are
+    accounted to the submitting user under the "job:<kind>" endpoint. The job is traced
+    as its own root span, linked to the request that submitted it.
+    """
+    with tracer.start_as_current_span(
+        f"job.{job['kind']}",
+        context=trace.set_span_in_context(trace.INVALID_SPAN),
+        links=span_links(job.get("trace_context")),
+        attributes={"job.id": job["id"], "job.kind": job["kind"]},
+    ):
+        await _run_job(backend, job)
+
+
+async def _run_job(backend, job):
+    kind = job["kind"]
+    set_llm_priority("batch")
+    track_llm_usage(job["payload"].get("user_id"), endpoint=f"job:{kind}")
+    started_at = time.time()
+    JOB_WAIT_SECONDS.labels(kind=kind).observe(started_at - job["created_at"])
+    await backend.update(job["id"], status="running", started_at=started_at)
+    loop = asyncio.get_running_loop()
+    progress_updates = set()
+
+    def progress(percent, message=""):
+        # Handlers report progress from worker threads as well as from the loop.
+        future = asyncio.run_coroutine_threadsafe(
+            backend.update(job["id"], progress=percent, message=message), loop
+        )
+        progress_updates.add(future)
+        future.add_done_callback(progress_updates.discard)
+
+    async def progress_settled():
+        # The final update is written last, so a late progress update cannot land after it.
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in list(progress_updates)), return_exceptions=True)
+
+    status = "failed"
+    try:
+        task = JOB_TASKS.get(kind)
+        if task is None:
+            raise ValueError(f"Unknown job kind: {kind}")
+        result = await task(job["payload"], progress)
+        status = "succeeded"
+        await progress_settled()
+        await backend.update(job["id"], status=status, progress=100, result=result, finished_at=time.time())
+    except Exception as e:
+        logging.error(f"Job {job['id']} ({kind}) failed: {e}")
+        span = trace.get_current_span()
+        span.record_exception(e)
+        span.set_status(trace.StatusCode.ERROR, str(e))
+        await progress_settled()
+        await backend.update(job["id"], status=status, error=str(e), finished_at=time.time())
+    finally:
+        JOB_RUN_SECONDS.labels(kind=kind).observe(time.time() - started_at)
+        JOBS_COMPLETED.labels(kind=kind, status=status).inc()
+
+
+class LocalJobBackend:
+    """Runs jobs as tasks on the API's event loop. Meant for tests and single-worker deployments."""
+    name = "local"
+
+    def __init__(self, workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL_SECONDS):
+        self.jobs = {}
+        self.tasks = set()
+        self.pending = 0
+        self.result_ttl = result_ttl
+        self.slots = asyncio.Semaphore(workers)
+
+    async def submit(self, kind, payload):
+        job = new_job(kind, payload)
+        self._prune()
+        self.jobs[job["id"]] = job
+        self.pending += 1
+        JOB_QUEUE_DEPTH.labels(backend=self.name).set(self.pending)
+        task = asyncio.create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job["id"]
+
+    async def _run(self, job):
+        async with self.slots:
+            self.pending -= 1
+            JOB_QUEUE_DEPTH.labels(backend=self.name).set(self.pending)
+            await run_job(self, job)
+
+    def _prune(self):
+        """Forgets finished jobs older than the result TTL."""
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in FINISHED_STATUSES and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def update(self, job_id, **fields):
+        """Applies the fields, unless the job has already finished."""
+        job = self.jobs.get(job_id)
+        if job and job["status"] not in FINISHED_STATUSES:
+            job.update(fields)
+
+    async def queue_depth(self):
+        return self.pending
+
+
+# Sets the given hash fields and refreshes the TTL in one step, unless the job is gone
+# or has already finished. ARGV: the TTL, the finished statuses as a JSON list, then
+# field/value pairs.
+UPDATE_JOB_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then
+    return 0
+end
+status = cjson.decode(status)
+for _, finished in ipairs(cjson.decode(ARGV[2])) do
+    if status == finished then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Moves the jobs a worker had taken back onto the queue once its heartbeat has expired,
+# and forgets the worker. KEYS: the heartbeat, the worker's processing list, the queue
+# and the set of workers. ARGV: the worker id.
+REQUEUE_STALE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local requeued = 0
+while redis.call('LMOVE', KEYS[2], KEYS[3], 'RIGHT', 'RIGHT') do
+    requeued = requeued + 1
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return requeued
+"""
+
+
+class RedisJobBackend:
+    """Keeps jobs in Redis so API processes submit and separate worker processes run them.
+
+    Each job is a hash with one JSON-encoded value per field, so an update writes only
+    the fields it changes. Uploaded files referenced by job payloads must be on storage
+    shared with the workers.
+
+    A worker moves each job it takes into its own processing list and keeps a heartbeat
+    key alive while it runs. When a worker dies, its heartbeat expires and
+    `requeue_stale` puts its jobs back on the queue; a job lost JOB_MAX_ATTEMPTS times
+    is failed instead of retried again.
+    """
+    name = "redis"
+    QUEUE_KEY = "notesight:jobs:queue"
+    WORKERS_KEY = "notesight:jobs:workers"
+
+    def __init__(self, url=REDIS_URL, result_ttl=JOB_RESULT_TTL_SECONDS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.result_ttl = result_ttl
+        self.heartbeat_seconds = heartbeat_seconds
+        self._update_job = self.client.register_script(UPDATE_JOB_SCRIPT)
+        self._requeue_stale = self.client.register_script(REQUEUE_STALE_SCRIPT)
+
+    def _key(self, job_id):
+        return f"notesight:job-hash:{job_id}"
+
+    def _processing_key(self, worker_id):
+        return f"notesight:jobs:processing:{worker_id}"
+
+    def _heartbeat_key(self, worker_id):
+        return f"notesight:jobs:heartbeat:{worker_id}"
+
+    async def submit(self, kind, payload):
+        job = new_job(kind, payload)
+        key = self._key(job["id"])
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={field: json.dumps(value) for field, value in job.items()})
+            pipe.expire(key, self.result_ttl)
+            pipe.lpush(self.QUEUE_KEY, job["id"])
+            await pipe.execute()
+        JOB_QUEUE_DEPTH.labels(backend=self.name).set(await self.queue_depth())
+        return job["id"]
+
+    async def get(self, job_id):
+        raw_job = await self.client.hgetall(self._key(job_id))
+        return {field: json.loads(value) for field, value in raw_job.items()} if raw_job else None
+
+    async def update(self, job_id, **fields):
+        """Writes only the given fields, atomically, and never once the job has finished."""
+        values = [item for field, value in fields.items() for item in (field, json.dumps(value))]
+        await self._update_job(keys=[self._key(job_id)], args=[self.result_ttl, json.dumps(FINISHED_STATUSES), *values])
+
+    async def queue_depth(self):
+        return await self.client.llen(self.QUEUE_KEY)
+
+    async def _beat(self, worker_id):
+        # The heartbeat outlives three missed beats before the worker counts as dead.
+        await self.client.set(self._heartbeat_key(worker_id), 1, ex=3 * self.heartbeat_seconds)
+
+    async def _keep_alive(self, worker_id):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self._beat(worker_id)
+            except redis.RedisError as e:
+                logging.warning(f"Job worker {worker_id} heartbeat failed: {e}")
+
+    async def requeue_stale(self):
+        """Puts the jobs held by workers whose heartbeat has expired back on the queue."""
+        requeued = 0
+        for worker_id in await self.client.smembers(self.WORKERS_KEY):
+            requeued += await self._requeue_stale(
+                keys=[self._heartbeat_key(worker_id), self._processing_key(worker_id), self.QUEUE_KEY, self.WORKERS_KEY],
+                args=[worker_id],
+            )
+        if requeued:
+            logging.warning(f"Requeued {requeued} jobs from workers that stopped responding")
+            JOB_QUEUE_DEPTH.labels(backend=self.name).set(await self.queue_depth())
+        return requeued
+
+    async def requeue_stale_periodically(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.requeue_stale()
+            except redis.RedisError as e:
+                logging.warning(f"Requeueing stale jobs failed: {e}")
+
+    async def _take(self, job_id):
+        """Returns the job to run, or None when it has finished or been lost too often."""
+        job = await self.get(job_id)
+        if not job or job["status"] in FINISHED_STATUSES:
+            return None
+        attempts = job.get("attempts", 0) + 1
+        if attempts > JOB_MAX_ATTEMPTS:
+            logging.error(f"Job {job_id} ({job['kind']}) was lost by {attempts - 1} workers; failing it")
+            await self.update(job_id, status="failed", error="The job was interrupted too many times", finished_at=time.time())
+            return None
+        await self.update(job_id, attempts=attempts)
+        job["attempts"] = attempts
+        return job
+
+    async def work(self, stop_event=None):
+        """Pulls jobs off the shared queue and runs them until stop_event is set.
+
+        Each job stays in this worker's processing list until it has finished, so a job
+        the worker dies holding is requeued rather than lost.
+        """
+        worker_id = uuid.uuid4().hex
+        processing_key = self._processing_key(worker_id)
+        await self._beat(worker_id)
+        await self.client.sadd(self.WORKERS_KEY, worker_id)
+        heartbeat = asyncio.create_task(self._keep_alive(worker_id))
+        try:
+            while not (stop_event and stop_event.is_set()):
+                job_id = await self.client.blmove(self.QUEUE_KEY, processing_key, 5, "RIGHT", "LEFT")
+                if not job_id:
+                    continue
+                JOB_QUEUE_DEPTH.labels(backend=self.name).set(await self.queue_depth())
+                job = await self._take(job_id)
+                if job:
+                    await run_job(self, job)
+                await self.client.lrem(processing_key, 1, job_id)
+        finally:
+            heartbeat.cancel()
+            # A job still in the processing list is requeued once the heartbeat expires.
+            if not await self.client.llen(processing_key):
+                await self.client.delete(self._heartbeat_key(worker_id))
+                await self.client.srem(self.WORKERS_KEY, worker_id)
+
+
+_backend = None
+
+
+def get_job_backend():
+    """Returns the process-wide job backend selected by JOB_BACKEND."""
+    global _backend
+    if _backend is None:
+        _backend = RedisJobBackend() if JOB_BACKEND == "redis" else LocalJobBackend()
+    return _backend
+
+
+async def _serve(workers):
+    backend = RedisJobBackend()
+    logging.info(f"Job worker started with {workers} consumers")
+    try:
+        await asyncio.gather(
+            flush_usage_periodically(), backend.requeue_stale_periodically(), *(backend.work() for _ in range(workers))
+        )
+    finally:
+        await usage_recorder.flush()
+        shutdown_tracing()
+
+
+def run_worker(workers=JOB_WORKERS):
+    """Runs Redis queue consumers; started by `python -m services.job_tasks` so the handlers are registered."""
+    setup_tracing("notesight-worker")
+    if WORKER_METRICS_PORT:
+        # Workers serve no HTTP otherwise, so their job and LLM metrics get a port of their own.
+        start_http_server(WORKER_METRICS_PORT)
+    asyncio.run(_serve(workers))
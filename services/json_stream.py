@@ -0,0 +1,92 @@
+import json
+import logging
+
+
+class JSONArrayStreamParser:
+    """Incrementally parses a streamed JSON array and returns each object as soon as it is complete.
+
+    Text before the first `[` (e.g. a ```json fence or an {"items": wrapper) is skipped,
+    as is anything after the array closes.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+
+    def feed(self, text):
+        """Feeds a chunk of model output and returns the objects completed by it."""
+        if self.finished or not text:
+            return []
+
+        self.buffer += text
+        items = []
+
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+
+            if not self.started:
+                if char == "[":
+                    self.started = True
+                    self.depth = 1
+                self.position += 1
+                continue
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 1 and char == "{":
+                    self.object_start = self.position
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and char == "}" and self.object_start is not None:
+                    raw_item = self.buffer[self.object_start:self.position + 1]
+                    self.object_start = None
+                    try:
+                        items.append(json.loads(raw_item))
+                    except json.JSONDecodeError:
+                        logging.error(f"Skipping malformed streamed item: {raw_item[:200]}")
+                elif self.depth == 0:
+                    self.finished = True
+                    self.position += 1
+                    break
+
+            self.position += 1
+
+        self._compact()
+        return items
+
+    def _compact(self):
+        """Drops consumed text so the buffer only holds the item currently being parsed."""
+        keep_from = self.object_start if self.object_start is not None else self.position
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.position -= keep_from
+            if self.object_start is not None:
+                self.object_start = 0
+
+
+def stream_json_items(text_chunks, formatter=None):
+    """Turns streamed model text into NDJSON lines, one per completed array item."""
+    parser = JSONArrayStreamParser()
+    for chunk in text_chunks:
+        for item in parser.feed(chunk):
+            if not isinstance(item, dict):
+                continue
+            try:
+                yield json.dumps(formatter(item) if formatter else item) + "\n"
+            except ValueError as e:
+                logging.error(f"Skipping invalid streamed item: {e}")
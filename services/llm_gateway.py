@@ -0,0 +1,933 @@
+"""One entry point for every OpenAI, Gemini and Mistral call.
+
+Services name a provider and model and get back text; the gateway owns the clients
+(one pooled client per provider per event loop), the timeout and retry policy, a
+circuit breaker per provider, the client-side rate limits (services/rate_limiter.py),
+the latency and token metrics, tracing spans, and per-user usage accounting
+(services/usage.py).
+
+    documents = await llm.with_documents("gemini", file_paths)
+    result = await llm.complete("gemini", prompt, documents=documents, list_schema=MCQItem)
+    async for text in llm.stream("openai", prompt): ...
+
+Requests are laid out stable-first (system instructions, then documents, then the
+per-request prompt) so provider prompt caches can reuse the prefix across calls.
+
+Synchronous code (generators running in worker threads) uses `run_sync` and
+`iterate_sync`, which run the same coroutines on a shared background loop. They
+block the calling thread, so async code awaits the gateway directly or runs the
+synchronous code with `run_in_threadpool`/`asyncio.to_thread`; calling them on an
+event loop raises RuntimeError.
+"""
+import asyncio
+import io
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+import openai
+from google import genai
+from google.genai import types
+from mistralai import Mistral
+from opentelemetry import trace
+from core.config import (
+    OPENAI_API_KEY,
+    GEMINI_API_KEY,
+    MISTRAL_API_KEY,
+    LLM_TIMEOUT_SECONDS,
+    LLM_CONNECT_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    LLM_POOL_SIZE,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_SECONDS,
+    LLM_FALLBACK_ORDER,
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+    LLM_HEDGE_MIN_DELAY_SECONDS,
+    LLM_HEDGE_WINDOW,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_FAKE_PROVIDERS,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    LLM_PROMPT_CACHE_TTL_SECONDS,
+    INLINE_DOCUMENT_MAX_BYTES,
+)
+from core.tracing import tracer
+from core.metrics import (
+    LLM_REQUEST_SECONDS,
+    LLM_TOKENS,
+    LLM_RETRIES,
+    LLM_CIRCUIT_OPEN,
+    LLM_ROUTED_REQUESTS,
+    LLM_ROUTED_SECONDS,
+    LLM_PROMPT_TOKENS,
+    LLM_FIRST_CHUNK_SECONDS,
+)
+from services.document_handle import DocumentHandle, encode_base64
+from services.fake_llm import fake_providers
+from services.rate_limiter import create_rate_limiter, estimate_tokens
+from services.usage import record_llm_usage
+from services.structured import gemini_config, openai_response_format, MISTRAL_RESPONSE_FORMAT
+
+# The `model` form field names a provider by its product name.
+MODEL_PROVIDERS = {"chatgpt": "openai", "gemini": "gemini", "mistral": "mistral"}
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "gemini": "gemini-2.0-flash",
+    "mistral": "mistral-small-latest",
+}
+OCR_MODEL = "mistral-ocr-latest"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+ROUTING_MODES = ("pinned", "failover", "hedge")
+
+
+class LLMError(Exception):
+    """Raised when a provider call fails for good."""
+
+    def __init__(self, provider, message):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+    def __init__(self, provider):
+        super().__init__(provider, "circuit open after repeated failures")
+
+
+class RateLimitedError(LLMError):
+    """Raised when a call waited LLM_QUEUE_TIMEOUT_SECONDS without getting rate-limit capacity."""
+
+    def __init__(self, provider):
+        super().__init__(provider, f"no rate-limit capacity within {LLM_QUEUE_TIMEOUT_SECONDS:g}s")
+
+
+def provider_for_model(model: str) -> str:
+    """Maps a `model` form value ("chatgpt", "gemini", "mistral") to its provider."""
+    return MODEL_PROVIDERS.get(model, model)
+
+
+def _status_code(error):
+    for attribute in ("status_code", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error) -> bool:
+    """Timeouts, connection failures, throttling and 5xx responses are worth another try."""
+    if isinstance(error, (TimeoutError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status in RETRYABLE_STATUS_CODES or status >= 500)
+
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff, so retrying callers don't hit the provider in step."""
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Stops calling a provider after consecutive transient failures.
+
+    After LLM_BREAKER_RESET_SECONDS one trial call is let through; its outcome closes
+    the breaker or re-opens it for another period. A trial that ends without an outcome,
+    e.g. cancelled as the losing side of a hedge, is released so the next call can probe.
+    """
+
+    def __init__(self, provider, failure_threshold=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = None
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Admits a call: returns a truthy admission to pass to release(), or None while open."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial is not None or time.monotonic() - self._opened_at < self.reset_seconds:
+                return None
+            self._trial = object()
+            return self._trial
+
+    def release(self, admission):
+        """Ends an admitted call; frees the half-open trial if it still holds it, i.e. no outcome was recorded."""
+        with self._lock:
+            if admission is self._trial:
+                self._trial = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+        LLM_CIRCUIT_OPEN.labels(provider=self.provider).set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = None
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            self._opened_at = time.monotonic()
+        logging.warning(f"Circuit breaker open for {self.provider} after {self._failures} failures")
+        LLM_CIRCUIT_OPEN.labels(provider=self.provider).set(1)
+
+
+class DocumentSet:
+    """Files for a request, prepared for each provider the first time it needs them.
+
+    Pinned calls only ever prepare them for one provider; failover and hedging upload
+    them to a backup provider only when that provider is actually called.
+    With `cache_prefix`, providers with explicit context caching (Gemini) also store the
+    system instructions and documents once, for sets that several calls reuse.
+    """
+
+    def __init__(self, gateway, file_paths, cache_prefix=False):
+        self.gateway = gateway
+        self.file_paths = file_paths
+        self.cache_prefix = cache_prefix
+        self._parts = {}
+        self._cached = {}
+        self._locks = {}
+
+    async def parts_for(self, provider):
+        async with self._locks.setdefault(provider, asyncio.Lock()):
+            if provider not in self._parts:
+                self._parts[provider] = await self.gateway._prepare(provider, self.file_paths)
+            return self._parts[provider]
+
+    async def cached_prefix(self, provider, model, system):
+        """The provider's cached-content name for system + documents, or None to send them inline."""
+        if not self.cache_prefix or not hasattr(self.gateway.providers[provider], "create_cache"):
+            return None
+        key = (provider, model, system)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            if key not in self._cached:
+                parts = await self.parts_for(provider)
+                self._cached[key] = await self.gateway._create_cache(provider, model, system, parts)
+            return self._cached[key]
+
+
+class LatencyWindow:
+    """Recent successful latencies of one provider operation, for choosing the hedge delay."""
+
+    def __init__(self, size=LLM_HEDGE_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        """The window's p95, or LLM_HEDGE_DEFAULT_DELAY_SECONDS until there are enough samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        return max(LLM_HEDGE_MIN_DELAY_SECONDS, samples[int(0.95 * (len(samples) - 1))])
+
+
+def _read_text(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    def create_client(self):
+        return openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)
+            ),
+        )
+
+    def _request(self, model, prompt, options, documents):
+        content = prompt
+        if documents:
+            content = documents + [{"type": "text", "text": prompt}]
+        messages = [{"role": "system", "content": options["system"]}] if options.get("system") else []
+        messages += options.get("history") or []
+        messages.append({"role": "user", "content": content})
+        request = {"model": model, "messages": messages}
+        if options.get("list_schema"):
+            request["response_format"] = openai_response_format(options["list_schema"])
+        elif options.get("json_mode"):
+            request["response_format"] = {"type": "json_object"}
+        if options.get("max_tokens"):
+            request["max_tokens"] = options["max_tokens"]
+        if options.get("temperature") is not None:
+            request["temperature"] = options["temperature"]
+        if options.get("cache_key"):
+            # Routes requests sharing a prompt prefix to the same cache shard.
+            request["prompt_cache_key"] = options["cache_key"]
+        return request
+
+    async def close_client(self, client):
+        await client.close()
+
+    @staticmethod
+    def _usage(usage):
+        if not usage:
+            return {}
+        details = usage.prompt_tokens_details
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": (details.cached_tokens or 0) if details else 0,
+        }
+
+    async def complete(self, client, model, prompt, options, documents):
+        response = await client.chat.completions.create(**self._request(model, prompt, options, documents))
+        return (response.choices[0].message.content or "").strip(), self._usage(response.usage)
+
+    async def stream(self, client, model, prompt, options, documents):
+        response = await client.chat.completions.create(
+            **self._request(model, prompt, options, documents),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in response:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            yield text, self._usage(chunk.usage)
+
+    async def prepare(self, gateway, client, file_paths):
+        parts = []
+        for file_path in file_paths:
+            ext = os.path.splitext(file_path)[1].lower()
+            if ext == ".pdf":
+                with DocumentHandle(file_path) as document, document.stream() as stream:
+                    uploaded = await client.files.create(file=stream, purpose="user_data")
+                parts.append({"type": "file", "file": {"file_id": uploaded.id}})
+            elif ext == ".txt":
+                parts.append({"type": "text", "text": await asyncio.to_thread(_read_text, file_path)})
+            elif ext in IMAGE_EXTENSIONS:
+                parts.append({"type": "text", "text": await gateway.extract_image_text(file_path)})
+        return parts
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def create_client(self):
+        return genai.Client(
+            api_key=GEMINI_API_KEY,
+            http_options=types.HttpOptions(
+                timeout=int(LLM_TIMEOUT_SECONDS * 1000),
+                async_client_args={
+                    "limits": httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)
+                },
+            ),
+        )
+
+    async def close_client(self, client):
+        await client.aio.aclose()
+
+    def _request(self, model, prompt, options, documents):
+        contents = [message["content"] for message in options.get("history") or []]
+        if documents:
+            contents += documents
+        contents.append(prompt)
+        if options.get("list_schema"):
+            config = gemini_config(options["list_schema"])
+        else:
+            config = types.GenerateContentConfig(
+                response_mime_type="application/json" if options.get("json_mode") else None
+            )
+        if options.get("cached_content"):
+            # The cache holds the system instruction and documents.
+            config.cached_content = options["cached_content"]
+        elif options.get("system"):
+            config.system_instruction = options["system"]
+        if options.get("max_tokens"):
+            config.max_output_tokens = options["max_tokens"]
+        if options.get("temperature") is not None:
+            config.temperature = options["temperature"]
+        return {"model": model, "contents": contents, "config": config}
+
+    @staticmethod
+    def _usage(usage):
+        if not usage or usage.prompt_token_count is None:
+            return {}
+        return {
+            "prompt_tokens": usage.prompt_token_count,
+            "completion_tokens": usage.candidates_token_count or 0,
+            "cached_tokens": usage.cached_content_token_count or 0,
+        }
+
+    async def complete(self, client, model, prompt, options, documents):
+        response = await client.aio.models.generate_content(**self._request(model, prompt, options, documents))
+        return response.text or "", self._usage(response.usage_metadata)
+
+    async def stream(self, client, model, prompt, options, documents):
+        async for chunk in await client.aio.models.generate_content_stream(
+            **self._request(model, prompt, options, documents)
+        ):
+            yield chunk.text, self._usage(chunk.usage_metadata)
+
+    async def prepare(self, gateway, client, file_paths):
+        parts = []
+        for item in file_paths:
+            if isinstance(item, bytes):
+                parts.append(await self._bytes_part(client, item))
+                continue
+            with DocumentHandle(item) as document:
+                parts.append(await document.gemini_part(client))
+        return parts
+
+    async def create_cache(self, client, model, system, documents):
+        cache = await client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system,
+                contents=documents,
+                ttl=f"{int(LLM_PROMPT_CACHE_TTL_SECONDS)}s",
+            ),
+        )
+        return cache.name
+
+    async def _bytes_part(self, client, pdf_data):
+        """A PDF already in memory: inline when small, through the file API otherwise."""
+        if len(pdf_data) <= INLINE_DOCUMENT_MAX_BYTES:
+            return types.Part.from_bytes(data=pdf_data, mime_type="application/pdf")
+        return await client.aio.files.upload(file=io.BytesIO(pdf_data), config={"mime_type": "application/pdf"})
+
+
+class MistralProvider:
+    name = "mistral"
+
+    def create_client(self):
+        return Mistral(
+            api_key=MISTRAL_API_KEY,
+            timeout_ms=int(LLM_TIMEOUT_SECONDS * 1000),
+            async_client=httpx.AsyncClient(
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+                follow_redirects=True,
+            ),
+        )
+
+    def _request(self, model, prompt, options, documents):
+        content = prompt
+        if documents:
+            content = documents + [{"type": "text", "text": prompt}]
+        messages = [{"role": "system", "content": options["system"]}] if options.get("system") else []
+        messages += options.get("history") or []
+        messages.append({"role": "user", "content": content})
+        request = {"model": model, "messages": messages}
+        if options.get("list_schema") or options.get("json_mode"):
+            request["response_format"] = MISTRAL_RESPONSE_FORMAT
+        if options.get("max_tokens"):
+            request["max_tokens"] = options["max_tokens"]
+        if options.get("temperature") is not None:
+            request["temperature"] = options["temperature"]
+        return request
+
+    async def close_client(self, client):
+        await client.sdk_configuration.async_client.aclose()
+
+    @staticmethod
+    def _usage(usage):
+        return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens} if usage else {}
+
+    async def complete(self, client, model, prompt, options, documents):
+        response = await client.chat.complete_async(**self._request(model, prompt, options, documents))
+        return response.choices[0].message.content or "", self._usage(response.usage)
+
+    async def stream(self, client, model, prompt, options, documents):
+        async for event in await client.chat.stream_async(**self._request(model, prompt, options, documents)):
+            yield event.data.choices[0].delta.content, self._usage(event.data.usage)
+
+    async def prepare(self, gateway, client, file_paths):
+        parts = []
+        for file_path in file_paths:
+            ext = os.path.splitext(file_path)[1].lower()
+            if ext == ".pdf":
+                with DocumentHandle(file_path) as document, document.stream() as stream:
+                    uploaded = await client.files.upload_async(
+                        file={"file_name": os.path.basename(file_path), "content": stream}, purpose="ocr"
+                    )
+                signed_url = await client.files.get_signed_url_async(file_id=uploaded.id)
+                parts.append({"type": "document_url", "document_url": signed_url.url})
+            elif ext == ".txt":
+                parts.append({"type": "text", "text": await asyncio.to_thread(_read_text, file_path)})
+            elif ext in IMAGE_EXTENSIONS:
+                parts.append({"type": "text", "text": await gateway.extract_image_text(file_path)})
+        return parts
+
+    async def ocr(self, client, file_path):
+        encoded = await asyncio.to_thread(encode_base64, file_path)
+        response = await client.ocr.process_async(
+            model=OCR_MODEL,
+            document={"type": "image_url", "image_url": f"data:image/jpeg;base64,{encoded}"},
+        )
+        return "\n".join(page.markdown for page in response.pages)
+
+
+class LLMGateway:
+    def __init__(self, providers=None, limiter=None):
+        providers = providers or [OpenAIProvider(), GeminiProvider(), MistralProvider()]
+        self.providers = {provider.name: provider for provider in providers}
+        self.breakers = {name: CircuitBreaker(name) for name in self.providers}
+        self.limiter = limiter or create_rate_limiter()
+        self._latencies = {}
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _provider(self, provider):
+        provider = provider_for_model(provider)
+        if provider not in self.providers:
+            raise LLMError(provider, "unknown provider")
+        return self.providers[provider]
+
+    def client(self, provider):
+        """The pooled client for a provider on the running event loop, created on first use."""
+        clients = self._clients.setdefault(asyncio.get_running_loop(), {})
+        if provider not in clients:
+            clients[provider] = self.providers[provider].create_client()
+        return clients[provider]
+
+    async def aclose(self):
+        """Closes the clients created on the running loop."""
+        clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for provider, client in clients.items():
+            try:
+                await self.providers[provider].close_client(client)
+            except Exception as e:
+                logging.warning(f"Failed to close {provider} client: {e}")
+
+    @staticmethod
+    def _record_usage(provider, model, usage, cache_key=None):
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.labels(provider=provider, model=model, kind=kind).inc(usage[kind])
+        if usage.get("prompt_tokens"):
+            cached = min(usage.get("cached_tokens", 0), usage["prompt_tokens"])
+            endpoint = cache_key or "other"
+            LLM_PROMPT_TOKENS.labels(endpoint, provider, "true").inc(cached)
+            LLM_PROMPT_TOKENS.labels(endpoint, provider, "false").inc(usage["prompt_tokens"] - cached)
+
+    @staticmethod
+    def _trace_usage(span, usage):
+        span.set_attributes({f"llm.{kind}": usage.get(kind, 0) for kind in ("prompt_tokens", "completion_tokens", "cached_tokens")})
+
+    @staticmethod
+    def _used_tokens(usage):
+        return usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+
+    async def _document_parts(self, provider, model, documents, options):
+        """The prepared document parts and options for a call, using a cached prefix when there is one."""
+        if not documents:
+            return None, options
+        cached = await documents.cached_prefix(provider, model, options.get("system"))
+        if cached:
+            return None, {**options, "cached_content": cached}
+        return await documents.parts_for(provider), options
+
+    async def _acquire(self, provider, model, tokens):
+        """Queues for rate-limit capacity; the wait does not count towards the call's timeout."""
+        with tracer.start_as_current_span("llm.queue", attributes={"llm.provider": provider, "llm.model": model}):
+            try:
+                async with asyncio.timeout(LLM_QUEUE_TIMEOUT_SECONDS):
+                    return await self.limiter.acquire(provider, model, tokens)
+            except TimeoutError:
+                raise RateLimitedError(provider) from None
+
+    async def _call(self, provider, model, operation, attempt, retries=LLM_MAX_RETRIES, tokens=0):
+        """Runs `attempt()` under the rate-limit, timeout, retry and circuit-breaker policy.
+
+        `tokens` is the estimate reserved from the token bucket for each attempt.
+        """
+        breaker = self.breakers[provider]
+        for retry in range(retries + 1):
+            admission = breaker.allow()
+            if not admission:
+                LLM_REQUEST_SECONDS.labels(provider, model, operation, "rejected").observe(0)
+                raise CircuitOpenError(provider)
+            try:
+                # Inside the try, so a trial that times out or is cancelled while queued is released too.
+                lease = await self._acquire(provider, model, tokens)
+                started = time.perf_counter()
+                try:
+                    async with asyncio.timeout(LLM_TIMEOUT_SECONDS):
+                        result = await attempt()
+                except Exception as e:
+                    retryable = is_retryable(e)
+                    outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+                    LLM_REQUEST_SECONDS.labels(provider, model, operation, outcome).observe(time.perf_counter() - started)
+                    if not retryable:
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    if retry == retries:
+                        raise LLMError(provider, f"{operation} failed after {retry + 1} attempts: {e}") from e
+                    LLM_RETRIES.labels(provider=provider, operation=operation).inc()
+                    trace.get_current_span().add_event("retry", {"llm.attempt": retry + 1, "error": str(e)})
+                    logging.warning(f"{provider} {operation} failed ({e}); retrying")
+                    await asyncio.sleep(retry_delay(retry))
+                    continue
+                finally:
+                    self.limiter.release(lease)
+                breaker.record_success()
+                LLM_REQUEST_SECONDS.labels(provider, model, operation, "ok").observe(time.perf_counter() - started)
+                return result
+            finally:
+                breaker.release(admission)
+
+    def _candidates(self, provider, routing):
+        if routing not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode: {routing}")
+        if routing == "pinned":
+            return [provider]
+        return [provider] + [name for name in LLM_FALLBACK_ORDER if name != provider and name in self.providers]
+
+    def _latency(self, provider, operation):
+        key = (provider, operation)
+        if key not in self._latencies:
+            self._latencies[key] = LatencyWindow()
+        return self._latencies[key]
+
+    async def _race(self, candidates, start, hedge_delay=None):
+        """Runs start(provider) for the first candidate, moving down the list on failure.
+
+        With a hedge_delay, the next candidate is also started if the first has not finished
+        by then. The first success wins and the calls still running are cancelled.
+        Returns (provider, result).
+        """
+        remaining = list(candidates)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            name = remaining.pop(0)
+            pending[asyncio.ensure_future(start(name))] = name
+
+        launch()
+        try:
+            while pending:
+                timeout = hedge_delay if hedge_delay is not None and not hedged and remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    logging.info(f"Hedging {candidates[0]} after {timeout:.2f}s with {remaining[0]}")
+                    launch()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        return name, task.result()
+                    errors.append(task.exception())
+                    logging.warning(f"{name} failed, trying the next provider: {task.exception()}")
+                if remaining:
+                    launch()
+            raise errors[-1]
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    @staticmethod
+    def _record_route(routing, requested, winner, operation, seconds):
+        LLM_ROUTED_REQUESTS.labels(routing, requested, winner, operation).inc()
+        LLM_ROUTED_SECONDS.labels(routing, winner, operation).observe(seconds)
+        logging.info(f"{operation} ({routing}): requested {requested}, served by {winner} in {seconds:.2f}s")
+
+    async def complete(self, provider, prompt, model=None, documents=None, routing="pinned", **options):
+        """Generates a full response.
+
+        Options: system, history (prior chat messages), list_schema (an item model the
+        output must be a JSON array of), json_mode, max_tokens, temperature, cache_key.
+        Put static instructions in `system` and only the per-request text in `prompt`, so
+        the prefix is cacheable; `cache_key` names the prompt family for the cached-token
+        metrics and OpenAI's cache routing.
+        `model` applies to the requested provider; backups use their default model.
+        Routing "failover" moves to the next provider in LLM_FALLBACK_ORDER when a call
+        fails; "hedge" also starts it once the requested provider is slower than its p95.
+        Returns {"text", "provider", "model", "prompt_tokens", "completion_tokens", "cached_tokens", "seconds"}.
+        """
+        requested = self._provider(provider).name
+        candidates = self._candidates(requested, routing)
+        if routing == "pinned":
+            return await self._complete_one(requested, prompt, model, documents, options, LLM_MAX_RETRIES)
+
+        started = time.perf_counter()
+        winner, result = await self._race(
+            candidates,
+            lambda name: self._complete_one(
+                name, prompt, model if name == requested else None, documents, options,
+                LLM_MAX_RETRIES if name == candidates[-1] else 0,
+            ),
+            self._latency(requested, "complete").hedge_delay() if routing == "hedge" else None,
+        )
+        self._record_route(routing, requested, winner, "complete", time.perf_counter() - started)
+        return result
+
+    async def _complete_one(self, provider, prompt, model, documents, options, retries):
+        adapter = self.providers[provider]
+        model = model or DEFAULT_MODELS.get(provider, provider)
+        client = self.client(provider)
+        started = time.perf_counter()
+        with tracer.start_as_current_span("llm.complete", attributes={"llm.provider": provider, "llm.model": model}) as span:
+            parts, options = await self._document_parts(provider, model, documents, options)
+            tokens = estimate_tokens(prompt, options)
+            text, usage = await self._call(
+                provider, model, "complete",
+                lambda: adapter.complete(client, model, prompt, options, parts),
+                retries, tokens,
+            )
+            self._trace_usage(span, usage)
+        seconds = time.perf_counter() - started
+        self._latency(provider, "complete").record(seconds)
+        self._record_usage(provider, model, usage, options.get("cache_key"))
+        record_llm_usage(provider, model, usage, seconds)
+        await self.limiter.settle(provider, model, tokens, self._used_tokens(usage))
+        return {
+            "text": text,
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "seconds": round(seconds, 3),
+        }
+
+    async def stream(self, provider, prompt, model=None, documents=None, routing="pinned", **options):
+        """Yields response text as it is generated; takes the same options as complete.
+
+        A failure before the first chunk is retried, or with failover and hedging handed to
+        another provider, which then serves the whole answer. Once text has been yielded,
+        errors propagate, since the caller has already relayed part of the answer.
+        Each chunk must arrive within LLM_TIMEOUT_SECONDS of the previous one.
+        """
+        requested = self._provider(provider).name
+        candidates = self._candidates(requested, routing)
+        if routing == "pinned":
+            async for text in self._stream_one(requested, prompt, model, documents, options, LLM_MAX_RETRIES):
+                yield text
+            return
+
+        async def first_chunk(name):
+            chunks = self._stream_one(
+                name, prompt, model if name == requested else None, documents, options,
+                LLM_MAX_RETRIES if name == candidates[-1] else 0,
+            )
+            try:
+                return chunks, await anext(chunks)
+            except StopAsyncIteration:
+                return chunks, None
+            except BaseException:
+                await chunks.aclose()
+                raise
+
+        started = time.perf_counter()
+        winner, (chunks, first) = await self._race(
+            candidates, first_chunk,
+            self._latency(requested, "stream").hedge_delay() if routing == "hedge" else None,
+        )
+        self._record_route(routing, requested, winner, "stream", time.perf_counter() - started)
+        try:
+            if first is not None:
+                yield first
+                async for text in chunks:
+                    yield text
+        finally:
+            await chunks.aclose()
+
+    async def _stream_one(self, provider, prompt, model, documents, options, retries):
+        adapter = self.providers[provider]
+        model = model or DEFAULT_MODELS.get(provider, provider)
+        client = self.client(provider)
+        breaker = self.breakers[provider]
+        # The span stays open across yields, so it is only made current around our own awaits.
+        span = tracer.start_span("llm.stream", attributes={"llm.provider": provider, "llm.model": model})
+        try:
+            with trace.use_span(span, end_on_exit=False):
+                parts, options = await self._document_parts(provider, model, documents, options)
+            tokens = estimate_tokens(prompt, options)
+            for retry in range(retries + 1):
+                admission = breaker.allow()
+                if not admission:
+                    LLM_REQUEST_SECONDS.labels(provider, model, "stream", "rejected").observe(0)
+                    raise CircuitOpenError(provider)
+                try:
+                    with trace.use_span(span, end_on_exit=False):
+                        lease = await self._acquire(provider, model, tokens)
+                    started = time.perf_counter()
+                    yielded = False
+                    usage = {}
+                    chunks = adapter.stream(client, model, prompt, options, parts)
+                    try:
+                        while True:
+                            try:
+                                text, chunk_usage = await asyncio.wait_for(anext(chunks), LLM_TIMEOUT_SECONDS)
+                            except StopAsyncIteration:
+                                break
+                            usage = chunk_usage or usage
+                            if text:
+                                if not yielded:
+                                    first_chunk_seconds = time.perf_counter() - started
+                                    self._latency(provider, "stream").record(first_chunk_seconds)
+                                    LLM_FIRST_CHUNK_SECONDS.labels(provider, model).observe(first_chunk_seconds)
+                                    span.add_event("first_chunk")
+                                yielded = True
+                                yield text
+                    except Exception as e:
+                        retryable = is_retryable(e)
+                        outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+                        LLM_REQUEST_SECONDS.labels(provider, model, "stream", outcome).observe(time.perf_counter() - started)
+                        if retryable:
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        if yielded or not retryable:
+                            raise
+                        if retry == retries:
+                            raise LLMError(provider, f"stream failed after {retry + 1} attempts: {e}") from e
+                        LLM_RETRIES.labels(provider=provider, operation="stream").inc()
+                        span.add_event("retry", {"llm.attempt": retry + 1, "error": str(e)})
+                        logging.warning(f"{provider} stream failed ({e}); retrying")
+                        await asyncio.sleep(retry_delay(retry))
+                        continue
+                    finally:
+                        await chunks.aclose()
+                        self.limiter.release(lease)
+                    breaker.record_success()
+                    LLM_REQUEST_SECONDS.labels(provider, model, "stream", "ok").observe(time.perf_counter() - started)
+                    self._record_usage(provider, model, usage, options.get("cache_key"))
+                    self._trace_usage(span, usage)
+                    record_llm_usage(provider, model, usage, time.perf_counter() - started)
+                    await self.limiter.settle(provider, model, tokens, self._used_tokens(usage))
+                    return
+                finally:
+                    breaker.release(admission)
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(trace.StatusCode.ERROR, str(e))
+            raise
+        finally:
+            span.end()
+
+    async def with_documents(self, provider, file_paths, cache_prefix=False):
+        """Uploads or inlines files once for a provider and returns a reusable DocumentSet.
+
+        PDFs go in natively. For OpenAI and Mistral, TXT files are sent as text and images
+        as their OCR text; Gemini takes other files through its file API. Gemini also
+        accepts PDF bytes in place of a path. Other providers prepare the same set on demand.
+        Pass `cache_prefix` when several calls will share the set; see DocumentSet.
+        """
+        documents = DocumentSet(self, file_paths, cache_prefix)
+        await documents.parts_for(self._provider(provider).name)
+        return documents
+
+    async def _prepare(self, provider, file_paths):
+        adapter = self.providers[provider]
+        client = self.client(provider)
+        with tracer.start_as_current_span("llm.documents", attributes={"llm.provider": provider, "llm.files": len(file_paths)}):
+            parts = await self._call(
+                provider, "files", "documents",
+                lambda: adapter.prepare(self, client, file_paths),
+            )
+        if not parts:
+            raise FileNotFoundError("❌ No valid files were uploaded. Check file paths.")
+        return parts
+
+    async def _create_cache(self, provider, model, system, parts):
+        """Stores system + documents as provider-side cached content; None when the provider refuses.
+
+        Gemini rejects prefixes below its minimum cacheable size, and those calls simply
+        send the documents inline.
+        """
+        adapter = self.providers[provider]
+        client = self.client(provider)
+        try:
+            with tracer.start_as_current_span("llm.cache", attributes={"llm.provider": provider, "llm.model": model}):
+                return await self._call(
+                    provider, model, "cache",
+                    lambda: adapter.create_cache(client, model, system, parts),
+                    retries=0,
+                )
+        except Exception as e:
+            logging.info(f"Not caching the {provider} prompt prefix: {e}")
+            return None
+
+    async def extract_image_text(self, file_path):
+        """OCR for an image file, through Mistral."""
+        mistral = self.providers["mistral"]
+        client = self.client("mistral")
+        with tracer.start_as_current_span("llm.ocr", attributes={"llm.provider": "mistral", "llm.model": OCR_MODEL}):
+            return await self._call("mistral", OCR_MODEL, "ocr", lambda: mistral.ocr(client, file_path))
+
+
+def _create_gateway():
+    if LLM_FAKE_PROVIDERS:
+        logging.warning(f"Using fake LLM providers: {LLM_FAKE_PROVIDERS}")
+        return LLMGateway(fake_providers(LLM_FAKE_PROVIDERS))
+    return LLMGateway()
+
+
+llm = _create_gateway()
+
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+            _sync_loop = loop
+    return _sync_loop
+
+
+def _check_off_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError("Blocking gateway call on an event loop; await it or run the caller in a worker thread")
+
+
+def run_sync(coroutine):
+    """Runs a gateway coroutine from synchronous code and returns its result."""
+    try:
+        _check_off_loop()
+    except RuntimeError:
+        coroutine.close()
+        raise
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop()).result()
+
+
+def iterate_sync(async_iterator):
+    """Iterates a gateway stream from synchronous code, one chunk at a time."""
+    _check_off_loop()
+    loop = _background_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(anext(async_iterator), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(async_iterator.aclose(), loop).result()
@@ -1,329 +1,203 @@
-import os
-from google import genai
-from google.genai import types
-from core.config import GEMINI_API_KEY,MISTRAL_API_KEY,OPENAI_API_KEY
-from core.prompts import MCQ_PROMPT,MCQ_EXTRACT_TOPIC
-import json
-from openai import OpenAI
-from mistralai import Mistral
+import logging
 import re
-
-class MCQGeneratorGemini:
-    def __init__(self):
-        self.client = genai.Client(api_key=GEMINI_API_KEY)
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.prompts import MCQ_PROMPT, MCQ_EXTRACT_TOPIC, MCQ_REQUEST, MCQ_TOPICS_REQUEST, TOPIC_REQUEST
+from services.json_stream import stream_json_items
+from core.config import LLM_ROUTING, MCQ_PARALLEL_MAX_WORKERS
+from services.llm_gateway import llm, run_sync, iterate_sync
+from services.structured import MCQItem, parse_structured_list
+
+
+def parse_topics(response_text):
+    """Parses the numbered chapter / bulleted subtopic outline MCQ_EXTRACT_TOPIC asks for."""
+    structured_topics = {}
+    current_chapter = None
+    for item in (line.strip() for line in response_text.split("\n")):
+        if not item:
+            continue
+        if re.match(r"^\d+\.\s*Chapter", item):
+            current_chapter = item.split(":", 1)[1].strip()
+            structured_topics[current_chapter] = []
+        elif current_chapter:
+            structured_topics[current_chapter].append(item.lstrip("- ").strip())
+    return structured_topics
+
+
+class MCQGenerator:
+    """Extracts topics and generates MCQs with one provider, through the LLM gateway.
+
+    `routing` is the gateway routing mode: "pinned", "failover" or "hedge".
+    Prompts are sent as static `instructions` followed by the documents and a short
+    per-request message, so the instructions and documents form a cacheable prefix.
+    The methods block until the model answers; async routes run them in a worker thread.
+    """
+
+    provider = None
+
+    def __init__(self, routing=None):
+        self.routing = routing or LLM_ROUTING
 
     def upload_and_parse_file(self, file_path):
         """Uploads a file and extracts structured key topics."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"❌ File not found: {file_path}")
-
         try:
-            ext = os.path.splitext(file_path)[-1].lower()
-            if ext == ".pdf":
-                with open(file_path, "rb") as file:
-                    pdf_part = types.Part.from_bytes(data=file.read(), mime_type="application/pdf")
-            else:
-                pdf_part = self.client.files.upload(file=file_path)
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=[pdf_part, MCQ_EXTRACT_TOPIC]
-            )
-            raw_topics = [topic.strip() for topic in response.text.split("\n") if topic.strip()]
-            structured_topics = {}
-            current_chapter = None
-
-            for item in raw_topics:
-                if re.match(r"^\d+\.\s*Chapter", item):
-                    chapter_title = item.split(":", 1)[1].strip()
-                    current_chapter = chapter_title
-                    structured_topics[current_chapter] = []
-                elif current_chapter:
-                    subtopic = item.lstrip("- ").strip()
-                    structured_topics[current_chapter].append(subtopic)
-
-            return structured_topics
-
+            documents = self.prepare_documents([file_path])
+            response = run_sync(llm.complete(
+                self.provider, TOPIC_REQUEST, system=MCQ_EXTRACT_TOPIC, documents=documents,
+                routing=self.routing, cache_key="mcq_topics",
+            ))
+            return parse_topics(response["text"])
+        except FileNotFoundError:
+            raise
         except Exception as e:
-            print(f"❌ Error processing file: {e}")
+            logging.error(f"Error processing file {file_path}: {e}")
             return {}
 
     def generate_mcqs(self, selected_topics, file_paths):
         """Generates MCQs for the selected topics using uploaded files."""
-
         if not selected_topics:
             raise ValueError("❌ No topics selected for MCQ generation.")
 
-        prompt = (
-            f"{MCQ_PROMPT}"
-            f"Generate multiple-choice questions for the following topics:\n"
-            f"{', '.join(selected_topics)}\n"
-        )
-
         try:
-            pdf_parts = []
-            for file_path in file_paths:
-                with open(file_path, "rb") as file:
-                    pdf_parts.append(types.Part.from_bytes(data=file.read(), mime_type="application/pdf"))
-
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=[pdf_parts,prompt]
-            )
-            return response.text
+            return self.generate_mcqs_from_documents(selected_topics, self.prepare_documents(file_paths))
         except Exception as e:
-            print(f"❌ Error generating MCQs: {e}")
+            logging.error(f"Error generating MCQs: {e}")
             return ""
-    
-    def generate_personalized_mcqs(self, prompt, file_paths):
-        """Generates MCQs for the selected topics using uploaded files."""
 
+    def prepare_documents(self, file_paths, cache_prefix=False):
+        """Uploads the files once so several MCQ batches can share them.
+
+        `cache_prefix` also caches the instructions and documents provider-side, for when
+        several batches will run against them.
+        """
+        return run_sync(llm.with_documents(self.provider, file_paths, cache_prefix))
+
+    def generate_mcqs_from_documents(self, selected_topics, documents):
+        """Generates MCQs for the selected topics against already prepared documents."""
+        return self.generate_from_documents(MCQ_PROMPT, documents, build_mcq_request(selected_topics))
+
+    def generate_from_documents(self, instructions, documents, request=MCQ_REQUEST):
+        """Generates a JSON array of MCQs, constrained by the MCQ schema."""
+        response = run_sync(llm.complete(
+            self.provider, request, system=instructions, documents=documents, list_schema=MCQItem,
+            routing=self.routing, cache_key="mcqs",
+        ))
+        return response["text"]
+
+    def stream_from_documents(self, instructions, documents, request=MCQ_REQUEST):
+        """Streams the model's text output against prepared documents."""
+        yield from iterate_sync(llm.stream(
+            self.provider, request, system=instructions, documents=documents, list_schema=MCQItem,
+            routing=self.routing, cache_key="mcqs",
+        ))
+
+    def generate_personalized_mcqs(self, instructions, file_paths):
+        """Generates MCQs for custom instructions using uploaded files."""
         try:
-            pdf_parts = []
-            for file_path in file_paths:
-                with open(file_path, "rb") as file:
-                    pdf_parts.append(types.Part.from_bytes(data=file.read(), mime_type="application/pdf"))
-
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=[pdf_parts,prompt]
-            )
-            return response.text
+            return self.generate_from_documents(instructions, self.prepare_documents(file_paths))
         except Exception as e:
-            print(f"❌ Error generating MCQs: {e}")
+            logging.error(f"Error generating MCQs: {e}")
             return ""
 
-class MCQGeneratorChatGPT:
-    def __init__(self):
-        self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        self.thread_id = None
-        self.assistant_id = None
-        self.uploaded_files = {}
-
-    def initialize_assistant_and_thread(self):
-        """Initialize assistant and thread if not already created."""
-        if self.assistant_id is None:
-            assistant = self.openai_client.beta.assistants.create(
-                instructions=MCQ_EXTRACT_TOPIC,
-                model="gpt-4o-mini",
-                tools=[{"type": "file_search"}],
-            )
-            self.assistant_id = assistant.id
-        
-        if self.thread_id is None:
-            thread = self.openai_client.beta.threads.create()
-            self.thread_id = thread.id
-
-    def upload_file(self, file_path):
-        """Uploads a file and returns its file ID, avoiding duplicate uploads."""
-        if file_path in self.uploaded_files:
-            return self.uploaded_files[file_path]
-
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"❌ File not found: {file_path}")
 
-        try:
-            with open(file_path, "rb") as file:
-                uploaded_file = self.openai_client.files.create(file=file, purpose="assistants")
-                file_id = uploaded_file.id
-                self.uploaded_files[file_path] = file_id
-                return file_id
-        except Exception as e:
-            print(f"❌ Error uploading file: {e}")
-            return None
+class MCQGeneratorGemini(MCQGenerator):
+    provider = "gemini"
 
-    def upload_and_parse_file(self, file_path):
-        """Uploads a file and extracts key topics."""
-        self.initialize_assistant_and_thread()
-        file_id = self.upload_file(file_path)
-        if not file_id:
-            return []
 
-        try:
-            self.openai_client.beta.threads.messages.create(
-                thread_id=self.thread_id,
-                role="user",
-                content=MCQ_EXTRACT_TOPIC,
-                attachments=[{"file_id": file_id, "tools": [{"type": "file_search"}]}],
-            )
-
-            run = self.openai_client.beta.threads.runs.create(thread_id=self.thread_id, assistant_id=self.assistant_id)
-
-            while True:
-                status = self.openai_client.beta.threads.runs.retrieve(thread_id=self.thread_id, run_id=run.id)
-                if status.status in ["completed", "failed"]:
-                    break
-
-            messages = self.openai_client.beta.threads.messages.list(thread_id=self.thread_id)
-            response_text = next((msg.content[0].text.value for msg in messages.data if msg.role == "assistant"), "")
-            print(response_text)
-            raw_topics = [topic.strip() for topic in response_text.split("\n") if topic.strip()]
-            structured_topics = {}
-            current_chapter = None
-            for item in raw_topics:
-                if re.match(r"^\d+\.\s*Chapter", item):
-                    chapter_title = item.split(":", 1)[1].strip()
-                    current_chapter = chapter_title
-                    structured_topics[current_chapter] = []
-                elif current_chapter:
-                    subtopic = item.lstrip("- ").strip()
-                    structured_topics[current_chapter].append(subtopic)
-
-            return structured_topics
+class MCQGeneratorChatGPT(MCQGenerator):
+    provider = "openai"
 
-        except Exception as e:
-            print(f"❌ Error extracting topics: {e}")
-            return []
 
-    def generate_mcqs(self, selected_topics, file_paths):
-        """Generates MCQs based on selected topics and uploaded files."""
-        self.initialize_assistant_and_thread()
+class MCQGeneratorMistral(MCQGenerator):
+    provider = "mistral"
 
-        if not selected_topics:
-            raise ValueError("❌ No topics selected for MCQ generation.")
-        if not file_paths:
-            raise ValueError("❌ No files provided for reference.")
 
-        try:
-            attachments = [{"file_id": self.upload_file(path), "tools": [{"type": "file_search"}]} for path in file_paths]
+def build_mcq_request(selected_topics):
+    """The per-request message naming the topics to generate MCQs for, sent after MCQ_PROMPT."""
+    return MCQ_TOPICS_REQUEST.format(topics=", ".join(selected_topics))
 
-            prompt = (
-                f"{MCQ_PROMPT}\n"
-                f"Generate multiple-choice questions for the following topics:\n"
-                f"{', '.join(selected_topics)}\n"
-            )
 
-            self.openai_client.beta.threads.messages.create(
-                thread_id=self.thread_id,
-                role="user",
-                content=prompt,
-                attachments=attachments,
-            )
+def stream_mcqs(mcq_generator, instructions, file_paths, request=MCQ_REQUEST):
+    """Streams NDJSON lines, one formatted MCQ per line, as the model produces them."""
+    documents = mcq_generator.prepare_documents(file_paths)
+    yield from stream_json_items(mcq_generator.stream_from_documents(instructions, documents, request), format_mcq)
 
-            run = self.openai_client.beta.threads.runs.create(thread_id=self.thread_id, assistant_id=self.assistant_id)
 
-            while True:
-                status = self.openai_client.beta.threads.runs.retrieve(thread_id=self.thread_id, run_id=run.id)
-                if status.status in ["completed", "failed"]:
-                    break
+def parse_mcqs(response_text):
+    """Parses and validates a model response into a list of MCQItem."""
+    return parse_structured_list(response_text, MCQItem)
 
-            messages = self.openai_client.beta.threads.messages.list(thread_id=self.thread_id)
-            mcqs_json = next((msg.content[0].text.value for msg in messages.data if msg.role == "assistant"), "")
-            print(mcqs_json.strip())
-            return mcqs_json.strip()
 
-        except Exception as e:
-            print(f"❌ Error generating MCQs: {e}")
-            return "❌ Error during MCQ generation."
-        
-    def generate_personalized_mcqs(self, prompt, file_paths):
-        """Generates MCQs for the selected topics using uploaded files."""
-        self.initialize_assistant_and_thread()
-        try:
-            attachments = [{"file_id": self.upload_file(path), "tools": [{"type": "file_search"}]} for path in file_paths]
-
-
-            self.openai_client.beta.threads.messages.create(
-                thread_id=self.thread_id,
-                role="user",
-                content=prompt,
-                attachments=attachments,
-            )
-
-            run = self.openai_client.beta.threads.runs.create(thread_id=self.thread_id, assistant_id=self.assistant_id)
-
-            while True:
-                status = self.openai_client.beta.threads.runs.retrieve(thread_id=self.thread_id, run_id=run.id)
-                if status.status in ["completed", "failed"]:
-                    break
-
-            messages = self.openai_client.beta.threads.messages.list(thread_id=self.thread_id)
-            mcqs_json = next((msg.content[0].text.value for msg in messages.data if msg.role == "assistant"), "")
-            print(mcqs_json.strip())
-            return mcqs_json.strip()
-
-        except Exception as e:
-            print(f"❌ Error generating MCQs: {e}")
-            return "❌ Error during MCQ generation."
-        
+def format_mcq(mcq):
+    """Maps a generated MCQ (validated or raw dict) onto the API response shape."""
+    if not isinstance(mcq, MCQItem):
+        mcq = MCQItem.model_validate(mcq)
+    return mcq.model_dump(include={"topic", "question", "options", "correct_answer"})
 
-class MCQGeneratorMistral:
-    def __init__(self):
-        self.mistral_client = Mistral(api_key=MISTRAL_API_KEY)
 
-    def upload_and_parse_file(self, file_path):
-        """Uploads a file and extracts key topics."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"❌ File not found: {file_path}")
+def batch_topics(selected_topics, batch_size):
+    """Splits the selected topics into batches of at most batch_size topics."""
+    batch_size = max(1, batch_size)
+    return [selected_topics[i:i + batch_size] for i in range(0, len(selected_topics), batch_size)]
 
-        try:
-            with open(file_path, "rb") as file:
-                uploaded_pdf = self.mistral_client.files.upload(
-                    file={"file_name": os.path.basename(file_path), "content": file}, purpose="ocr"
-                )
-                signed_url = self.mistral_client.files.get_signed_url(file_id=uploaded_pdf.id).url
-
-            messages = [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": MCQ_EXTRACT_TOPIC}]
-                    + [{"type": "document_url", "document_url": signed_url}],
-                }
-            ]
-
-            chat_response = self.mistral_client.chat.complete(model="mistral-small-latest", messages=messages)
-            response = chat_response.choices[0].message.content
-            structured_topics = {}
-            current_chapter = None
-            response_text=[topic.strip() for topic in response.split("\n") if topic.strip()]
-            print(response_text)
-            for item in response_text:
-                if re.match(r"^\d+\.\s*Chapter", item):
-                    chapter_title = item.split(":", 1)[1].strip()
-                    current_chapter = chapter_title
-                    structured_topics[current_chapter] = []
-                elif current_chapter:
-                    subtopic = item.lstrip("- ").strip()
-                    structured_topics[current_chapter].append(subtopic)
-
-            return structured_topics
-        
-        except Exception as e:
-            print(f"❌ Error processing file: {e}")
-            return []
 
-    def generate_mcqs(self, selected_topics, file_paths):
-        """Generates MCQs for the selected topics using uploaded files."""
+def generate_mcqs_parallel(mcq_generator, selected_topics, file_paths, batch_size=5, max_workers=4, progress=None):
+    """Generates MCQs for topic batches concurrently against one prepared set of documents.
 
-        if not selected_topics:
-            raise ValueError("❌ No topics selected for MCQ generation.")
+    Returns the merged, de-duplicated MCQs and a timing entry for every batch.
+    `progress(done, total)` is called as each batch finishes. At most
+    MCQ_PARALLEL_MAX_WORKERS batches run at once, whatever `max_workers` asks for.
+    """
+    if not selected_topics:
+        raise ValueError("❌ No topics selected for MCQ generation.")
 
-        prompt = (
-            f"{MCQ_PROMPT}"
-            f"Generate multiple-choice questions for the following topics:\n"
-            f"{', '.join(selected_topics)}\n"
-        )
+    batches = batch_topics(selected_topics, batch_size)
+    documents = mcq_generator.prepare_documents(file_paths, cache_prefix=len(batches) > 1)
 
+    def run_batch(topics):
+        start_time = time.time()
         try:
-            pdf_parts = []
-            for file_path in file_paths:
-                with open(file_path, "rb") as file:
-                    uploaded_pdf = self.mistral_client.files.upload(
-                        file={"file_name": os.path.basename(file_path), "content": file}, purpose="ocr"
-                    )
-                    signed_url = self.mistral_client.files.get_signed_url(file_id=uploaded_pdf.id).url
-
-            messages = [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}]
-                    + [{"type": "document_url", "document_url": signed_url}],
-                }
-            ]
-
-            chat_response = self.mistral_client.chat.complete(model="mistral-small-latest", messages=messages)
-            response = chat_response.choices[0].message.content
-            return response
-        
+            mcqs = parse_mcqs(mcq_generator.generate_mcqs_from_documents(topics, documents))
+            error = None
         except Exception as e:
-            print(f"❌ Error generating MCQs: {e}")
-            return ""
+            logging.error(f"Error generating MCQs for batch {topics}: {e}")
+            mcqs, error = [], str(e)
+        timing = {
+            "topics": topics,
+            "count": len(mcqs),
+            "seconds": round(time.time() - start_time, 2),
+            "error": error,
+        }
+        return mcqs, timing
+
+    completed = []
+
+    def run_batch_and_report(topics):
+        result = run_batch(topics)
+        completed.append(topics)
+        if progress:
+            progress(len(completed), len(batches))
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, MCQ_PARALLEL_MAX_WORKERS, len(batches)))) as executor:
+        results = list(executor.map(run_batch_and_report, batches))
+
+    merged = []
+    seen_questions = set()
+    for mcqs, _ in results:
+        for mcq in mcqs:
+            formatted = format_mcq(mcq)
+            key = " ".join(str(formatted["question"]).lower().split())
+            if key in seen_questions:
+                continue
+            seen_questions.add(key)
+            merged.append(formatted)
+
+    return merged, [timing for _, timing in results]
+
+
+MCQ_GENERATORS = {
+    "gemini": MCQGeneratorGemini,
+    "mistral": MCQGeneratorMistral,
+    "chatgpt": MCQGeneratorChatGPT,
+}
@@ -0,0 +1,305 @@
+"""Client-side rate limits for the LLM providers, so we throttle before they do.
+
+Every provider has a requests-per-minute and a tokens-per-minute bucket, optionally
+overridden per model, and a cap on calls in flight. Callers queue for capacity in
+priority order: interactive requests (the default) go ahead of batch work such as
+background jobs, which call `set_llm_priority("batch")`.
+
+    LLM_REQUESTS_PER_MINUTE="openai=500,openai/gpt-4o=100,gemini=1000"
+
+Buckets live in this process, or with LLM_LIMITER_BACKEND=redis in Redis, so that
+API and worker processes share one budget. Queueing and the concurrency cap are
+always per process.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+import weakref
+import redis.asyncio as redis
+from core.config import (
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_CONCURRENCY,
+    LLM_ESTIMATED_COMPLETION_TOKENS,
+    LLM_LIMITER_BACKEND,
+    REDIS_URL,
+)
+from core.metrics import LLM_QUEUE_WAIT_SECONDS, LLM_QUEUE_DEPTH, LLM_IN_FLIGHT
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+_priority = contextvars.ContextVar("llm_priority", default="interactive")
+
+
+def set_llm_priority(priority: str):
+    """Sets the queue priority of LLM calls made from the current context onwards."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    _priority.set(priority)
+
+
+def parse_limits(spec: str) -> dict:
+    """Parses "provider=limit" and "provider/model=limit" entries into {(provider, model): limit}."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, value = entry.split("=")
+        provider, _, model = name.strip().partition("/")
+        limits[(provider, model or None)] = float(value)
+    return limits
+
+
+def estimate_tokens(prompt, options) -> int:
+    """A rough upper bound on a call's tokens, reserved up front and settled with the real usage."""
+    characters = len(prompt) + len(options.get("system") or "")
+    characters += sum(len(str(message.get("content", ""))) for message in options.get("history") or [])
+    return characters // 4 + (options.get("max_tokens") or LLM_ESTIMATED_COMPLETION_TOKENS)
+
+
+def _take(state, now, requests_per_minute, tokens_per_minute, cost):
+    """Refills a [requests, tokens, at] bucket and takes one request and `cost` tokens from it.
+
+    Returns the new state and 0 when the call can go ahead, or the seconds until it can.
+    A limit of 0 means that dimension is unlimited.
+    """
+    requests, tokens, at = state or (requests_per_minute, tokens_per_minute, now)
+    elapsed = max(0.0, now - at)
+    wait = 0.0
+    if requests_per_minute:
+        requests = min(requests_per_minute, requests + elapsed * requests_per_minute / 60)
+        if requests < 1:
+            wait = (1 - requests) * 60 / requests_per_minute
+    if tokens_per_minute:
+        cost = min(cost, tokens_per_minute)
+        tokens = min(tokens_per_minute, tokens + elapsed * tokens_per_minute / 60)
+        if tokens < cost:
+            wait = max(wait, (cost - tokens) * 60 / tokens_per_minute)
+    if not wait:
+        requests -= 1
+        tokens -= cost
+    return [requests, tokens, now], wait
+
+
+class LocalBuckets:
+    """Token buckets held in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    async def reserve(self, key, requests_per_minute, tokens_per_minute, tokens):
+        with self._lock:
+            self._buckets[key], wait = _take(
+                self._buckets.get(key), time.monotonic(), requests_per_minute, tokens_per_minute, tokens
+            )
+        return wait
+
+    async def adjust(self, key, tokens):
+        """Credits (or, when negative, debits) tokens once a call's real usage is known."""
+        with self._lock:
+            if key in self._buckets:
+                self._buckets[key][1] += tokens
+
+
+# The same arithmetic as _take, run atomically in Redis against the server clock.
+RESERVE_SCRIPT = """
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'at')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local wait = 0
+if rpm > 0 then
+    requests = math.min(rpm, requests + elapsed * rpm / 60)
+    if requests < 1 then wait = (1 - requests) * 60 / rpm end
+end
+if tpm > 0 then
+    cost = math.min(cost, tpm)
+    tokens = math.min(tpm, tokens + elapsed * tpm / 60)
+    if tokens < cost then wait = math.max(wait, (cost - tokens) * 60 / tpm) end
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'at', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets in Redis, shared by every API and worker process."""
+
+    def __init__(self, url=REDIS_URL):
+        self.url = url
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        # Redis connections belong to the loop that opened them, and the gateway runs on several.
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            client = redis.Redis.from_url(self.url, decode_responses=True)
+            self._clients[loop] = (client, client.register_script(RESERVE_SCRIPT))
+        return self._clients[loop]
+
+    @staticmethod
+    def _key(key):
+        return "notesight:llm:limit:" + "/".join(part for part in key if part)
+
+    async def reserve(self, key, requests_per_minute, tokens_per_minute, tokens):
+        _, script = self._client()
+        return float(await script(keys=[self._key(key)], args=[requests_per_minute, tokens_per_minute, tokens]))
+
+    async def adjust(self, key, tokens):
+        client, _ = self._client()
+        if await client.exists(self._key(key)):
+            await client.hincrbyfloat(self._key(key), "tokens", tokens)
+
+
+class _Waiter:
+    """One queued call. Wakes up on its own event loop when capacity may have freed."""
+
+    def __init__(self, rank, sequence):
+        self.rank = rank
+        self.sequence = sequence
+        self.loop = asyncio.get_running_loop()
+        self._future = None
+        self._woken = False
+
+    def __lt__(self, other):
+        return (self.rank, self.sequence) < (other.rank, other.sequence)
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self._set)
+        except RuntimeError:
+            pass  # the loop has closed
+
+    def _set(self):
+        self._woken = True
+        if self._future is not None and not self._future.done():
+            self._future.set_result(None)
+
+    async def sleep(self, timeout=None):
+        """Waits until woken or for `timeout` seconds; a wake-up that came early is not lost."""
+        if not self._woken:
+            self._future = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self._future, timeout)
+            except TimeoutError:
+                pass
+            finally:
+                self._future = None
+        self._woken = False
+
+
+class _ProviderQueue:
+    def __init__(self):
+        self.waiters = []
+        self.in_flight = 0
+
+
+class Lease:
+    """Capacity granted to one call; return it with RateLimiter.release."""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None,
+                 max_concurrency=LLM_MAX_CONCURRENCY, buckets=None):
+        self.requests_per_minute = requests_per_minute if requests_per_minute is not None else {}
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else {}
+        self.max_concurrency = max_concurrency
+        self.buckets = buckets or LocalBuckets()
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._sequence = itertools.count()
+
+    def _bucket(self, provider, model):
+        """(provider, model) when the model has its own limits, else the provider-wide bucket."""
+        if (provider, model) in self.requests_per_minute or (provider, model) in self.tokens_per_minute:
+            return provider, model
+        return provider, None
+
+    def _queue(self, provider):
+        with self._lock:
+            return self._queues.setdefault(provider, _ProviderQueue())
+
+    def _wake_head(self, queue):
+        with self._lock:
+            head = queue.waiters[0] if queue.waiters else None
+        if head is not None:
+            head.wake()
+
+    async def acquire(self, provider, model, tokens=0) -> Lease:
+        """Waits, in priority order, for a concurrency slot and bucket capacity for one call."""
+        priority = _priority.get()
+        bucket = self._bucket(provider, model)
+        requests_per_minute = self.requests_per_minute.get(bucket, 0)
+        tokens_per_minute = self.tokens_per_minute.get(bucket, 0)
+        queue = self._queue(provider)
+        waiter = _Waiter(PRIORITIES[priority], next(self._sequence))
+        with self._lock:
+            heapq.heappush(queue.waiters, waiter)
+        LLM_QUEUE_DEPTH.labels(provider, priority).inc()
+        started = time.perf_counter()
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    ready = queue.waiters[0] is waiter and queue.in_flight < self.max_concurrency
+                if not ready:
+                    await waiter.sleep()
+                    continue
+                wait = await self.buckets.reserve(bucket, requests_per_minute, tokens_per_minute, tokens)
+                if wait:
+                    await waiter.sleep(wait)
+                    continue
+                with self._lock:
+                    queue.waiters.remove(waiter)
+                    heapq.heapify(queue.waiters)
+                    queue.in_flight += 1
+                    LLM_IN_FLIGHT.labels(provider).set(queue.in_flight)
+                granted = True
+                break
+        finally:
+            if not granted:
+                with self._lock:
+                    queue.waiters.remove(waiter)
+                    heapq.heapify(queue.waiters)
+            LLM_QUEUE_DEPTH.labels(provider, priority).dec()
+            self._wake_head(queue)
+        LLM_QUEUE_WAIT_SECONDS.labels(provider, priority).observe(time.perf_counter() - started)
+        return Lease(provider)
+
+    def release(self, lease: Lease):
+        """Frees the lease's concurrency slot and lets the next queued call go."""
+        queue = self._queue(lease.provider)
+        with self._lock:
+            queue.in_flight -= 1
+            LLM_IN_FLIGHT.labels(lease.provider).set(queue.in_flight)
+        self._wake_head(queue)
+
+    async def settle(self, provider, model, estimated_tokens, used_tokens):
+        """Corrects the token bucket by the difference between a call's estimate and its real usage."""
+        bucket = self._bucket(provider, model)
+        if used_tokens and self.tokens_per_minute.get(bucket):
+            await self.buckets.adjust(bucket, estimated_tokens - used_tokens)
+
+
+def create_rate_limiter():
+    """The limiter configured by LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE and LLM_LIMITER_BACKEND."""
+    return RateLimiter(
+        parse_limits(LLM_REQUESTS_PER_MINUTE),
+        parse_limits(LLM_TOKENS_PER_MINUTE),
+        buckets=RedisBuckets() if LLM_LIMITER_BACKEND == "redis" else LocalBuckets(),
+    )
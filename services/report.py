@@ -1,39 +1,68 @@
-import json
-import re
-from fastapi import HTTPException
-from google import genai
-from google.genai import types
-from core.config import GEMINI_API_KEY
-from core.prompts import REPORT_PROMPT
-
-genai_client = genai.Client(api_key=GEMINI_API_KEY)
-
-def extract_json(response_text):
-    """Extract JSON content from Gemini API response."""
-    try:
-        json_match = re.search(r"```json\n(.*?)\n```", response_text, re.DOTALL)
-        json_data = json_match.group(1).strip() if json_match else response_text.strip()
-        return json.loads(json_data)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON response from AI model")
-
-def process_pdf(pdf_data):
-    """Processes PDF, generates report via Gemini AI, and structures it."""
-    pdf_part = types.Part.from_bytes(data=pdf_data, mime_type="application/pdf")
-
-    response = genai_client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[pdf_part, REPORT_PROMPT],
+import asyncio
+import functools
+import logging
+from core.config import REPORT_BATCH_CONCURRENCY
+from core.prompts import REPORT_PROMPT, REPORT_REQUEST
+from services.structured import StudentReport, StructuredOutputError, parse_structured_object
+from services.llm_gateway import llm
+from services.rate_limiter import set_llm_priority
+from datastorage.artifact_cache import artifact_cache_key, hash_bytes, get_or_generate
+from services.uploads import remove_uploads
+
+REPORT_MODEL = "gemini-2.0-flash"
+
+
+async def process_pdf(pdf):
+    """Processes PDF, generates report via Gemini AI, and validates it against StudentReport.
+
+    `pdf` is the file's bytes or the path of a saved upload, which the gateway reads only now.
+    PDFs over INLINE_DOCUMENT_MAX_BYTES go through the Gemini file API instead of the request body.
+
+    Raises StructuredOutputError when the document is not a report card or the response
+    does not match the schema.
+    """
+    documents = await llm.with_documents("gemini", [pdf])
+    response = await llm.complete(
+        "gemini", REPORT_REQUEST, model=REPORT_MODEL, system=REPORT_PROMPT, documents=documents,
+        json_mode=True, cache_key="report",
     )
-    report = extract_json(response.text)
-    student_data = {
-        "student_info": report["student_info"],
-        "subject_performance": report["subject_performance"],
-        "strengths": report["strengths"],
-        "average": report.get("average", []),
-        "weaknesses": report["weaknesses"],
-        "overall_performance_summary": report["overall_performance_summary"],
-    }
-    if not student_data:
-        return response.text
-    return student_data
+    return parse_structured_object(response["text"], StudentReport).model_dump()
+
+
+async def get_or_process_report(pdf, document_hash=None, on_complete=None):
+    """Returns the structured report for a PDF, reusing the cached result for identical files.
+
+    `pdf` is bytes or a saved upload's path. Pass `document_hash` when the SHA-256 is already
+    known, e.g. from the upload stream; it is required for a path. `on_complete` runs once the
+    file is no longer needed, as in get_or_generate.
+    Returns (report, cache_status) where cache_status is "hit", "stale" or "miss".
+    """
+    key = artifact_cache_key(document_hash or hash_bytes(pdf), REPORT_MODEL, REPORT_PROMPT)
+    return await get_or_generate(key, functools.partial(process_pdf, pdf), "report", on_complete=on_complete)
+
+
+async def process_report_batch(uploads, concurrency=REPORT_BATCH_CONCURRENCY):
+    """Processes many report cards with at most `concurrency` Gemini calls in flight.
+
+    `uploads` are saved upload records; a file is only read inside its slot, and is removed
+    once its report no longer needs it. Returns one result per file, in order, with either the
+    report or the error that stopped it. The Gemini calls run at batch priority.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def process_one(upload):
+        set_llm_priority("batch")
+        name = upload["filename"]
+        async with slots:
+            try:
+                report, cache_status = await get_or_process_report(
+                    upload["path"], upload["sha256"], on_complete=lambda: remove_uploads([upload])
+                )
+                return {"filename": name, "status": "ok", "cache": cache_status, "data": report}
+            except StructuredOutputError as e:
+                return {"filename": name, "status": "error", "error": str(e)}
+            except Exception as e:
+                logging.error(f"Failed to process report card {name}: {e}")
+                return {"filename": name, "status": "error", "error": "Failed to process report card"}
+
+    return await asyncio.gather(*(process_one(upload) for upload in uploads))
@@ -0,0 +1,172 @@
+import json
+import logging
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field, AliasChoices, ValidationError
+from google.genai import types
+from core.tracing import tracer
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a model response cannot be turned into the requested structure."""
+
+
+class MCQItem(BaseModel):
+    """One generated multiple-choice question.
+
+    Accepts both the schema keys and the capitalised keys the prompts ask for,
+    so providers without schema enforcement validate the same way.
+    """
+    topic: str = Field(validation_alias=AliasChoices("topic", "Topic"))
+    question: str = Field(validation_alias=AliasChoices("question", "Question"))
+    options: List[str] = Field(validation_alias=AliasChoices("options", "Options"))
+    correct_answer: str = Field(validation_alias=AliasChoices("correct_answer", "Correct Answer", "Answer"))
+    explanation: str = Field(default="", validation_alias=AliasChoices("explanation", "Explanation"))
+
+
+class Flashcard(BaseModel):
+    """One generated flashcard."""
+    concept: str
+    definition: str
+
+
+class StudentInfo(BaseModel):
+    name: str
+    roll_number: Optional[str] = None
+    grade: Optional[str] = None
+    school: Optional[str] = None
+
+
+class SubjectMarks(BaseModel):
+    total_marks: float
+    obtained_marks: float
+    percentage: float
+
+
+class Weakness(BaseModel):
+    subject: str
+    reason: str
+
+
+class StudentReport(BaseModel):
+    """Structured analysis of a report card, in the shape REPORT_PROMPT asks for."""
+    student_info: StudentInfo
+    subject_performance: Dict[str, SubjectMarks]
+    strengths: List[str]
+    average: List[str] = []
+    weaknesses: List[Weakness]
+    overall_performance_summary: str
+
+
+def parse_structured_object(response_text, model):
+    """Parses and validates a model response holding a single JSON object.
+
+    A response of the form {"error": "..."} (the prompts' way of refusing invalid input)
+    raises StructuredOutputError with that message.
+    """
+    with tracer.start_as_current_span("parse.json", attributes={"parse.model": model.__name__}):
+        try:
+            data = json.loads(_strip_code_fence(response_text or ""))
+        except json.JSONDecodeError as e:
+            raise StructuredOutputError(f"Model response is not valid JSON: {e}")
+        if isinstance(data, dict) and data.get("error"):
+            raise StructuredOutputError(str(data["error"]))
+        try:
+            return model.model_validate(data)
+        except ValidationError as e:
+            raise StructuredOutputError(f"Model response is not a valid {model.__name__}: {e}")
+
+
+def item_json_schema(item_model):
+    """Returns a strict JSON schema for one item: every property required, no extras."""
+    schema = item_model.model_json_schema(mode="serialization")
+    properties = {
+        name: {key: value for key, value in prop.items() if key not in ("title", "default")}
+        for name, prop in schema["properties"].items()
+    }
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def list_json_schema(item_model):
+    """Returns the JSON schema for an array of items."""
+    return {"type": "array", "items": item_json_schema(item_model)}
+
+
+def gemini_config(item_model):
+    """Gemini generation config that constrains the output to a JSON array of items."""
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_json_schema=list_json_schema(item_model),
+    )
+
+
+def openai_response_format(item_model):
+    """OpenAI `json_schema` response format; the root must be an object, so items are wrapped."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{item_model.__name__.lower()}_list",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"items": list_json_schema(item_model)},
+                "required": ["items"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+MISTRAL_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+def _strip_code_fence(text):
+    """Removes a surrounding Markdown code fence left by models running without JSON mode."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def unwrap_items(data):
+    """Returns the list of items from a bare array or an object wrapping one."""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if isinstance(data.get("items"), list):
+            return data["items"]
+        return next((value for value in data.values() if isinstance(value, list)), [])
+    return []
+
+
+def parse_structured_list(response_text, item_model):
+    """Parses and validates a model response into a list of item_model instances.
+
+    Items that fail validation are dropped; a response with no valid items raises
+    StructuredOutputError.
+    """
+    with tracer.start_as_current_span("parse.json", attributes={"parse.model": item_model.__name__}) as span:
+        try:
+            data = json.loads(_strip_code_fence(response_text or ""))
+        except json.JSONDecodeError as e:
+            raise StructuredOutputError(f"Model response is not valid JSON: {e}")
+
+        items = []
+        raw_items = unwrap_items(data)
+        for raw_item in raw_items:
+            try:
+                items.append(item_model.model_validate(raw_item))
+            except ValidationError as e:
+                logging.error(f"Dropping invalid {item_model.__name__}: {e}")
+        span.set_attribute("parse.items", len(items))
+        span.set_attribute("parse.dropped", len(raw_items) - len(items))
+
+        if not items:
+            raise StructuredOutputError(f"Model response contained no valid {item_model.__name__} items")
+        return items
@@ -1,16 +1,16 @@
 from fastapi import FastAPI, UploadFile, File, Form, APIRouter
 from fastapi.responses import StreamingResponse
+import asyncio
 import os
 import logging
 import pdfplumber
 from pptx import Presentation
 import pandas as pd
-from openai import AsyncOpenAI
-from mistralai import Mistral
-from core.config import OPENAI_API_KEY, MISTRAL_API_KEY, GEMINI_API_KEY
+from core.config import LLM_ROUTING
 from core.prompts import SUMMARY_PROMPT
-from google import genai
-import base64
+from core.tracing import tracer
+from services.llm_gateway import llm, run_sync
+from services.uploads import remove_upload_paths
 
 router = APIRouter()
 UPLOAD_DIR = "uploads"
@@ -18,88 +18,62 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-mistral_client = Mistral(api_key=MISTRAL_API_KEY)
 format_text = """---
 ## **Continue processing the next chunk of text:**  
 {text}  """
 async def extract_text(pdf_path: str, start_page: int, end_page: int) -> str:
     """Extract text from PDF pages."""
-    with pdfplumber.open(pdf_path) as pdf:
-        text = "\n".join(pdf.pages[i].extract_text() or "" for i in range(start_page, min(end_page, len(pdf.pages))))
+    with tracer.start_as_current_span("extract.pdf", attributes={"extract.start_page": start_page, "extract.end_page": end_page}) as span:
+        with pdfplumber.open(pdf_path) as pdf:
+            text = "\n".join(pdf.pages[i].extract_text() or "" for i in range(start_page, min(end_page, len(pdf.pages))))
+        span.set_attribute("extract.characters", len(text))
     return text
 
-async def generate_notes_stream_chatgpt(cleaned_text: str, previous_summary: str = ""):
+def summary_history(previous_summary: str):
+    """The previous chunk's notes, sent after the static SUMMARY_PROMPT so the prompt stays a cacheable prefix."""
+    return [{"role": "assistant", "content": previous_summary}] if previous_summary else []
+
+async def generate_notes_stream_chatgpt(cleaned_text: str, previous_summary: str = "", routing: str = "pinned"):
     """Generate structured notes using OpenAI with streaming."""
     if not cleaned_text:
         yield ""
 
     try:
-        messages = [{"role": "user", "content": SUMMARY_PROMPT+(format_text.format(text=cleaned_text))}]
-
-        if previous_summary:
-            messages.insert(0, {"role": "assistant", "content": previous_summary})
-
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.7,
-            stream=True
-        )
-
-        async for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        async for text in llm.stream(
+            "openai", format_text.format(text=cleaned_text), model="gpt-4o-mini",
+            system=SUMMARY_PROMPT, history=summary_history(previous_summary),
+            max_tokens=1000, temperature=0.7, routing=routing, cache_key="notes",
+        ):
+            yield text
 
     except Exception as e:
         logging.error(f"ChatGPT Streaming Error: {e}")
         yield f"Error: {str(e)}"
 
-async def generate_notes_stream_mistral(cleaned_text: str,previous_summary: str = ""):
+async def generate_notes_stream_mistral(cleaned_text: str,previous_summary: str = "", routing: str = "pinned"):
     """Generate structured notes using Mistral AI with streaming."""
     try:
-        messages = [{"role": "user", "content": SUMMARY_PROMPT+(format_text.format(text=cleaned_text))}]
-
-        if previous_summary:
-            messages.insert(0, {"role": "assistant", "content": previous_summary})
-        response = await mistral_client.chat.stream_async(
-            model="mistral-medium",
-            messages=messages
-        )
-
-        async for chunk in response:
-            if chunk.data.choices[0].delta.content:
-                yield chunk.data.choices[0].delta.content
+        async for text in llm.stream(
+            "mistral", format_text.format(text=cleaned_text), model="mistral-medium",
+            system=SUMMARY_PROMPT, history=summary_history(previous_summary), routing=routing, cache_key="notes",
+        ):
+            yield text
 
     except Exception as e:
         logging.error(f"Mistral Streaming Error: {e}")
         yield f"Error: {str(e)}"
 
-async def generate_gemini_notes_stream(cleaned_text: str, previous_summary: str = ""):
+async def generate_gemini_notes_stream(cleaned_text: str, previous_summary: str = "", routing: str = "pinned"):
     """Generate structured notes using Gemini AI with streaming."""
-    client = genai.Client(api_key=GEMINI_API_KEY, http_options={'api_version': 'v1alpha'})
-    model = "gemini-2.0-flash-exp"
-    config = {"response_modalities": ["TEXT"]}
     if not cleaned_text:
         yield ""
 
     try:
-        messages = SUMMARY_PROMPT+(format_text.format(text=cleaned_text))
-
-        if previous_summary:
-            messages = previous_summary + "\n\n" + messages
-        async with client.aio.live.connect(model=model, config=config) as session:
-            message = messages
-
-            await session.send(input=message, end_of_turn=True)
-
-            full_summary = ""
-
-            async for response in session.receive():
-                if response.text is not None:
-                    full_summary += response.text
-                    yield response.text
+        async for text in llm.stream(
+            "gemini", format_text.format(text=cleaned_text), model="gemini-2.0-flash",
+            system=SUMMARY_PROMPT, history=summary_history(previous_summary), routing=routing, cache_key="notes",
+        ):
+            yield text
 
     except Exception as e:
         logging.error(f"Gemini Streaming Error: {e}")
@@ -111,23 +85,17 @@ async def process_chunk(pdf_path: str, start_page: int, end_page: int):
     cleaned_text = raw_text.replace("-\n", "").replace("\n", " ").strip()
     return cleaned_text if cleaned_text else None
 
-def encode_image(image_path):
-    """Encode the image to base64."""
-    try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        print(f"Error: The file {image_path} was not found.")
-        return None
-    except Exception as e:  
-        print(f"Error: {e}")
-        return None
-
 def extract_text_from_file(file_path: str) -> str:
     """Extract text from different file types."""
     ext = os.path.splitext(file_path)[-1].lower()
+    with tracer.start_as_current_span("extract.text", attributes={"extract.extension": ext}) as span:
+        text = _extract_text(file_path, ext)
+        span.set_attribute("extract.characters", len(text))
+    return text
+
+def _extract_text(file_path: str, ext: str) -> str:
     text = ""
-    
+
     if ext == ".pdf":
         with pdfplumber.open(file_path) as pdf:
             text = "\n".join([page.extract_text() or "" for page in pdf.pages])
@@ -135,13 +103,7 @@ def extract_text_from_file(file_path: str) -> str:
         with open(file_path, "r", encoding="utf-8") as f:
             text = f.read()
     elif ext in [".jpg", ".png"]:
-        mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-        base64_image = encode_image(file_path)
-        ocr_response =mistral_client.ocr.process(
-            model="mistral-ocr-latest",
-            document={"type": "image_url", "image_url":f"data:image/jpeg;base64,{base64_image}"}
-        )
-        text = "\n".join(page.markdown for page in ocr_response.pages)
+        text = run_sync(llm.extract_image_text(file_path))
     elif ext == ".pptx":
         prs = Presentation(file_path)
         text = "\n".join([shape.text.strip() for slide in prs.slides for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()])
@@ -157,10 +119,15 @@ def chunk_text(text: str, chunk_size: int = 10000):
     for i in range(0, len(words), chunk_size):
         yield " ".join(words[i:i + chunk_size])
 
-async def stream_summary(file_paths: list[str], model: str):
-    """Stream summarized notes for multiple files using OpenAI, Mistral, or Gemini."""
+async def stream_summary(file_paths: list[str], model: str, routing: str = LLM_ROUTING, progress=None):
+    """Stream summarized notes for multiple files using OpenAI, Mistral, or Gemini.
+
+    With `routing` "failover" or "hedge", a chunk whose provider fails or stalls is
+    answered by the next provider instead of streaming an error. `progress(done, total)`
+    is called after each chunk, with `done` counting files, fractions included.
+    """
     previous_summary = ""
-    for file_path in file_paths:
+    for index, file_path in enumerate(file_paths):
         ext = os.path.splitext(file_path)[-1].lower()
         if ext == ".pdf":
             try:
@@ -172,47 +139,48 @@ async def stream_summary(file_paths: list[str], model: str):
 
                     if cleaned_text:
                         if model == "chatgpt":
-                            async for chunk in generate_notes_stream_chatgpt(cleaned_text, previous_summary):
+                            async for chunk in generate_notes_stream_chatgpt(cleaned_text, previous_summary, routing):
                                 yield chunk
                             previous_summary = chunk
 
                         elif model == "mistral":
-                            async for chunk in generate_notes_stream_mistral(cleaned_text):
+                            async for chunk in generate_notes_stream_mistral(cleaned_text, routing=routing):
                                 yield chunk
                             previous_summary = chunk
 
                         elif model == "gemini":
-                            async for chunk in generate_gemini_notes_stream(cleaned_text,previous_summary):
+                            async for chunk in generate_gemini_notes_stream(cleaned_text,previous_summary, routing):
                                 yield chunk
                             previous_summary = chunk
+                    if progress:
+                        progress(index + min(start + 5, total_pages) / total_pages, len(file_paths))
             except Exception as e:
                 logging.error(f"Streaming error: {e}")
                 yield f"Error: {str(e)}"
             finally:
-                for file_path in file_paths:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                remove_upload_paths(file_paths)
         else:
             try:
-                cleaned_text = extract_text_from_file(file_path)
+                cleaned_text = await asyncio.to_thread(extract_text_from_file, file_path)
                 if cleaned_text:
-                    for chunk in chunk_text(cleaned_text):
+                    chunks = list(chunk_text(cleaned_text))
+                    for chunk_index, chunk in enumerate(chunks):
                         if model == "chatgpt":
-                            async for response in generate_notes_stream_chatgpt(chunk, previous_summary):
+                            async for response in generate_notes_stream_chatgpt(chunk, previous_summary, routing):
                                 yield response
                             previous_summary = response
                         elif model == "mistral":
-                            async for response in generate_notes_stream_mistral(chunk, previous_summary):
+                            async for response in generate_notes_stream_mistral(chunk, previous_summary, routing):
                                 yield response
                             previous_summary = response
                         elif model == "gemini":
-                            async for response in generate_gemini_notes_stream(chunk, previous_summary):
+                            async for response in generate_gemini_notes_stream(chunk, previous_summary, routing):
                                 yield response
                             previous_summary = response
+                        if progress:
+                            progress(index + (chunk_index + 1) / len(chunks), len(file_paths))
             except Exception as e:
                 logging.error(f"Streaming error: {e}")
                 yield f"Error: {str(e)}"
             finally:
-                for file_path in file_paths:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
\ No newline at end of file
+                remove_upload_paths(file_paths)
\ No newline at end of file
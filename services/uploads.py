@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import List, Optional
+from fastapi import HTTPException, UploadFile
+from core.config import UPLOAD_MAX_BYTES, UPLOAD_CHUNK_BYTES
+from core.tracing import tracer
+from datastorage.artifact_cache import hash_bytes
+from datastorage.documents import checkout_document
+
+UPLOAD_DIR = "uploads"
+
+
+def _too_large(filename, max_bytes):
+    return HTTPException(
+        status_code=413,
+        detail=f"File '{filename}' exceeds the {max_bytes / (1024 * 1024):.0f} MB upload limit",
+    )
+
+
+async def save_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """Streams an upload to a uniquely named file in chunks, hashing it on the way.
+
+    Returns {"path", "filename", "size", "sha256"}. Raises 413 and removes the partial
+    file when the upload is larger than max_bytes.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    filename = os.path.basename(file.filename or "upload")
+    suffix = os.path.splitext(filename)[1]
+    descriptor, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=suffix)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(descriptor, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(filename, max_bytes)
+                digest.update(chunk)
+                await asyncio.to_thread(buffer.write, chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {"path": path, "filename": filename, "size": size, "sha256": digest.hexdigest()}
+
+
+async def save_uploads(files: List[UploadFile], max_bytes: int = UPLOAD_MAX_BYTES):
+    """Saves several uploads; if one fails, the ones already written are removed."""
+    uploads = []
+    with tracer.start_as_current_span("upload.save", attributes={"upload.files": len(files)}) as span:
+        try:
+            for file in files:
+                uploads.append(await save_upload(file, max_bytes))
+        except BaseException:
+            remove_uploads(uploads)
+            raise
+        span.set_attribute("upload.bytes", sum(upload["size"] for upload in uploads))
+    return uploads
+
+
+async def load_uploads(files: Optional[List[UploadFile]] = None, document_id: Optional[str] = None):
+    """Upload records for a request that sends either files or the id of an earlier upload.
+
+    A document's files are linked into UPLOAD_DIR, so callers remove them afterwards
+    exactly as they would fresh uploads.
+    """
+    if document_id:
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with tracer.start_as_current_span("upload.checkout", attributes={"upload.document_id": document_id}):
+            uploads = await checkout_document(document_id, UPLOAD_DIR)
+        if uploads is None:
+            raise HTTPException(status_code=404, detail="Document not found or expired")
+        return uploads
+    if not files:
+        raise HTTPException(status_code=400, detail="Send files or a document_id")
+    return await save_uploads(files)
+
+
+async def read_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """Reads an upload into memory in chunks, refusing it as soon as it passes max_bytes.
+
+    Returns (data, sha256). Meant for small inputs the model needs inline, like report cards.
+    """
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    with tracer.start_as_current_span("upload.read") as span:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(file.filename, max_bytes)
+            digest.update(chunk)
+            chunks.append(chunk)
+        span.set_attribute("upload.bytes", size)
+    return b"".join(chunks), digest.hexdigest()
+
+
+def uploads_hash(uploads) -> str:
+    """Content key for a set of uploads; equals artifact_cache.hash_files over the same files."""
+    return hash_bytes("".join(sorted(upload["sha256"] for upload in uploads)).encode("utf-8"))
+
+
+def upload_paths(uploads):
+    return [upload["path"] for upload in uploads]
+
+
+def is_upload_path(path: str) -> bool:
+    """Whether a path lies inside UPLOAD_DIR once links and `..` are resolved."""
+    upload_dir = os.path.realpath(UPLOAD_DIR)
+    return os.path.commonpath([upload_dir, os.path.realpath(path)]) == upload_dir
+
+
+def remove_upload_paths(file_paths):
+    """Deletes request files; anything outside UPLOAD_DIR is refused, whoever named it."""
+    for file_path in file_paths:
+        if not is_upload_path(file_path):
+            logging.error(f"Refusing to remove {file_path}: not in {UPLOAD_DIR}")
+            continue
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def remove_uploads(uploads):
+    remove_upload_paths(upload_paths(uploads))
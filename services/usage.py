@@ -0,0 +1,140 @@
+"""Token, latency and cost accounting for LLM calls.
+
+The gateway reports every successful provider call here. Each call is attributed to
+the user and endpoint of the request or job it ran for, which middleware and the job
+runner set with `track_llm_usage`. Calls are summed in memory per hour, user,
+endpoint, provider and model. The sums are written to MongoDB in one bulk write every
+USAGE_FLUSH_INTERVAL_SECONDS, so accounting costs no round-trips on the request path.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from datetime import datetime
+from core.config import USAGE_FLUSH_INTERVAL_SECONDS
+from datastorage.usage import USAGE_COUNTERS, write_usage_rollups
+
+# USD per million tokens: (input, cached input, output). Models not listed are costed at 0.
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+    "gemini-1.5-flash": (0.075, 0.01875, 0.30),
+    "mistral-small-latest": (0.10, 0.10, 0.30),
+    "mistral-medium": (0.40, 0.40, 2.00),
+}
+
+
+def call_cost(model, prompt_tokens, completion_tokens, cached_tokens=0) -> float:
+    input_price, cached_price, output_price = MODEL_PRICES.get(model, (0, 0, 0))
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+
+
+class UsageScope:
+    """Who LLM calls are made for, plus the running totals of one request or job."""
+
+    def __init__(self, user_id=None, endpoint=None, request_scope=None):
+        self.user_id = user_id
+        self._endpoint = endpoint
+        self._request_scope = request_scope
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens = 0
+        self.cost_usd = 0.0
+
+    @property
+    def endpoint(self):
+        # The route is only known once the router has matched it, after the middleware ran.
+        if self._endpoint:
+            return self._endpoint
+        if self._request_scope is not None:
+            route = self._request_scope.get("route")
+            return route.path if route is not None else self._request_scope.get("path")
+        return None
+
+    def add(self, tokens, cost_usd):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.cost_usd += cost_usd
+
+
+_usage_scope = contextvars.ContextVar("llm_usage_scope", default=None)
+
+
+def track_llm_usage(user_id=None, endpoint=None, request_scope=None) -> UsageScope:
+    """Attributes LLM calls made from the current context onwards; pass an ASGI scope to use its route."""
+    scope = UsageScope(user_id, endpoint, request_scope)
+    _usage_scope.set(scope)
+    return scope
+
+
+class UsageRecorder:
+    """Hourly usage rollups waiting to be written to MongoDB."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rollups = {}
+
+    def record(self, provider, model, usage, seconds, user_id=None, endpoint=None):
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cached_tokens = usage.get("cached_tokens", 0)
+        cost_usd = call_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        key = (hour, user_id or "anonymous", endpoint or "other", provider, model)
+        with self._lock:
+            totals = self._rollups.setdefault(key, {**dict.fromkeys(USAGE_COUNTERS, 0), "max_seconds": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["seconds"] += seconds
+            totals["cost_usd"] += cost_usd
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+        return prompt_tokens + completion_tokens, cost_usd
+
+    def _merge(self, rollups):
+        with self._lock:
+            for key, totals in rollups.items():
+                pending = self._rollups.setdefault(key, {**dict.fromkeys(USAGE_COUNTERS, 0), "max_seconds": 0})
+                for counter in USAGE_COUNTERS:
+                    pending[counter] += totals[counter]
+                pending["max_seconds"] = max(pending["max_seconds"], totals["max_seconds"])
+
+    async def flush(self):
+        """Writes the pending rollups; on failure they are kept for the next flush."""
+        with self._lock:
+            rollups, self._rollups = self._rollups, {}
+        if not rollups:
+            return
+        try:
+            await write_usage_rollups(rollups)
+        except Exception as e:
+            logging.error(f"Failed to write {len(rollups)} LLM usage rollups: {e}")
+            self._merge(rollups)
+
+
+usage_recorder = UsageRecorder()
+
+
+def record_llm_usage(provider, model, usage, seconds):
+    """Accounts one provider call to the current request or job."""
+    scope = _usage_scope.get()
+    tokens, cost_usd = usage_recorder.record(
+        provider, model, usage, seconds,
+        scope.user_id if scope else None,
+        scope.endpoint if scope else None,
+    )
+    if scope:
+        scope.add(tokens, cost_usd)
+
+
+async def flush_usage_periodically(interval=USAGE_FLUSH_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        await usage_recorder.flush()
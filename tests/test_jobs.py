@@ -0,0 +1,81 @@
+import asyncio
+from services.jobs import LocalJobBackend, job_task, is_job_owner, public_job
+
+release_progress_job = None
+
+
+@job_task("test_progress")
+async def progress_job(payload, progress):
+    progress(50, "Halfway")
+    await release_progress_job.wait()
+    return {"echo": payload["text"]}
+
+
+@job_task("test_failure")
+async def failing_job(payload, progress):
+    raise ValueError("No topics found")
+
+
+async def settle(backend):
+    await asyncio.gather(*backend.tasks)
+
+
+def test_job_belongs_to_the_user_who_submitted_it():
+    async def submit():
+        backend = LocalJobBackend()
+        job_id = await backend.submit("test_failure", {"user_id": "student-1"})
+        await settle(backend)
+        return await backend.get(job_id)
+
+    job = asyncio.run(submit())
+    assert is_job_owner(job, "student-1")
+    assert not is_job_owner(job, "student-2")
+    assert public_job(job)["user_id"] == "student-1"
+    assert "payload" not in public_job(job)
+
+
+def test_job_without_a_user_has_no_owner():
+    async def submit():
+        backend = LocalJobBackend()
+        job_id = await backend.submit("test_failure", {})
+        await settle(backend)
+        return await backend.get(job_id)
+
+    assert not is_job_owner(asyncio.run(submit()), None)
+
+
+def test_job_reports_progress_then_its_result():
+    async def run():
+        global release_progress_job
+        release_progress_job = asyncio.Event()
+        backend = LocalJobBackend()
+        job_id = await backend.submit("test_progress", {"user_id": "student-1", "text": "notes"})
+        for _ in range(100):
+            job = await backend.get(job_id)
+            if job["progress"] == 50:
+                break
+            await asyncio.sleep(0.01)
+        release_progress_job.set()
+        await settle(backend)
+        return job, await backend.get(job_id)
+
+    running, finished = asyncio.run(run())
+    assert running["status"] == "running"
+    assert running["message"] == "Halfway"
+    assert finished["status"] == "succeeded"
+    assert finished["progress"] == 100
+    assert finished["result"] == {"echo": "notes"}
+
+
+def test_failed_job_keeps_its_error_and_ignores_later_updates():
+    async def run():
+        backend = LocalJobBackend()
+        job_id = await backend.submit("test_failure", {"user_id": "student-1"})
+        await settle(backend)
+        await backend.update(job_id, status="running", progress=10)
+        return await backend.get(job_id)
+
+    job = asyncio.run(run())
+    assert job["status"] == "failed"
+    assert job["error"] == "No topics found"
+    assert job["progress"] == 0
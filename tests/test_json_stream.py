@@ -0,0 +1,69 @@
+import json
+from services.json_stream import JSONArrayStreamParser, stream_json_items
+
+
+def feed_all(chunks):
+    parser = JSONArrayStreamParser()
+    return [item for chunk in chunks for item in parser.feed(chunk)]
+
+
+def test_item_split_across_chunks_is_returned_once_complete():
+    parser = JSONArrayStreamParser()
+    assert parser.feed('[{"concept": "Photo') == []
+    assert parser.feed('synthesis", "definition": "Light') == []
+    assert parser.feed(' to sugar"}, {"concept"') == [{"concept": "Photosynthesis", "definition": "Light to sugar"}]
+    assert parser.feed(': "Osmosis", "definition": "Water"}]') == [{"concept": "Osmosis", "definition": "Water"}]
+
+
+def test_text_split_one_character_at_a_time():
+    text = '[{"a": 1, "b": [1, 2]}, {"c": {"d": "e"}}]'
+    assert feed_all(text) == [{"a": 1, "b": [1, 2]}, {"c": {"d": "e"}}]
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    items = [
+        {"question": 'Which symbol closes a list: "]" or "}"?', "answer": "]"},
+        {"question": "A backslash \\ then a quote \\\" and [brackets]", "answer": "{ }"},
+    ]
+    text = json.dumps(items)
+    assert feed_all([text[:20], text[20:41], text[41:]]) == items
+
+
+def test_escape_split_between_chunks():
+    assert feed_all(['[{"q": "say \\', '"hi\\""}]']) == [{"q": 'say "hi"'}]
+
+
+def test_code_fence_and_wrapper_are_skipped():
+    chunks = ['```json\n{"items": ', '[{"topic": "Algebra"}', ', {"topic": "Geometry"}]}\n```']
+    assert feed_all(chunks) == [{"topic": "Algebra"}, {"topic": "Geometry"}]
+
+
+def test_text_after_the_array_is_ignored():
+    parser = JSONArrayStreamParser()
+    assert parser.feed('[{"a": 1}] and [{"b": 2}]') == [{"a": 1}]
+    assert parser.finished
+    assert parser.feed('{"c": 3}') == []
+
+
+def test_truncated_input_returns_only_complete_items():
+    assert feed_all(['[{"a": 1}, {"b": 2}, {"c": "cut o']) == [{"a": 1}, {"b": 2}]
+
+
+def test_malformed_item_is_skipped():
+    assert feed_all(['[{"a": 1,}, {"b": 2}]']) == [{"b": 2}]
+
+
+def test_buffer_only_keeps_the_item_in_progress():
+    parser = JSONArrayStreamParser()
+    parser.feed('[{"a": 1}, {"b": 2}, {"c": ')
+    assert parser.buffer == '{"c": '
+
+
+def test_stream_json_items_formats_objects_and_skips_the_rest():
+    def formatter(item):
+        if "bad" in item:
+            raise ValueError("missing fields")
+        return {"value": item["a"]}
+
+    lines = list(stream_json_items(['[{"a": 1}, 2, {"bad": true}', ', {"a": 3}]'], formatter))
+    assert lines == ['{"value": 1}\n', '{"value": 3}\n']
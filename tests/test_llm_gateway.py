@@ -0,0 +1,147 @@
+import asyncio
+from prometheus_client import REGISTRY
+from services.fake_llm import FakeProvider
+from services.llm_gateway import CircuitBreaker, LLMGateway
+from services.rate_limiter import RateLimiter
+
+
+def half_open(breaker):
+    """Opens the breaker with its reset period already over, so the next call is the trial."""
+    breaker.reset_seconds = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.is_open
+
+
+class TrackedProvider(FakeProvider):
+    """A fake provider that records the calls cancelled before they answered."""
+
+    def __init__(self, name, latency):
+        super().__init__(name, latency)
+        self.cancelled = 0
+
+    async def complete(self, client, model, prompt, options, documents):
+        try:
+            return await super().complete(client, model, prompt, options, documents)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def routed(routing, requested, winner):
+    labels = {"routing": routing, "requested": requested, "winner": winner, "operation": "complete"}
+    return REGISTRY.get_sample_value("notesight_llm_routed_requests_total", labels) or 0
+
+
+def race(gateway, candidates, hedge_delay=None):
+    return asyncio.run(gateway._race(
+        candidates,
+        lambda name: gateway._complete_one(name, "Summarise the chapter.", None, None, {}, 0),
+        hedge_delay,
+    ))
+
+
+def test_released_trial_lets_the_next_call_probe():
+    breaker = CircuitBreaker("gemini", failure_threshold=1)
+    half_open(breaker)
+    trial = breaker.allow()
+    assert trial
+    assert breaker.allow() is None
+    breaker.release(trial)
+    assert breaker.allow()
+
+
+def test_release_after_an_outcome_keeps_the_next_trial():
+    breaker = CircuitBreaker("gemini", failure_threshold=1)
+    half_open(breaker)
+    trial = breaker.allow()
+    breaker.record_failure()
+    next_trial = breaker.allow()
+    breaker.release(trial)
+    assert breaker.allow() is None
+    breaker.release(next_trial)
+    assert breaker.allow()
+
+
+def test_cancelled_trial_call_does_not_wedge_the_breaker():
+    gateway = LLMGateway([FakeProvider("gemini", latency=5)])
+    breaker = gateway.breakers["gemini"]
+    half_open(breaker)
+
+    async def cancel_trial():
+        call = asyncio.ensure_future(gateway.complete("gemini", "Summarise the chapter."))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+    asyncio.run(cancel_trial())
+    assert breaker.is_open
+    assert breaker.allow()
+
+
+def test_closed_trial_stream_does_not_wedge_the_breaker():
+    gateway = LLMGateway([FakeProvider("gemini", latency=0.01)])
+    breaker = gateway.breakers["gemini"]
+    half_open(breaker)
+
+    async def read_first_chunk():
+        stream = gateway.stream("gemini", "Summarise the chapter.")
+        await anext(stream)
+        await stream.aclose()
+
+    asyncio.run(read_first_chunk())
+    assert breaker.allow()
+
+
+def test_trial_cancelled_while_queued_does_not_wedge_the_breaker():
+    limiter = RateLimiter(max_concurrency=1)
+    gateway = LLMGateway([FakeProvider("gemini", latency=0.01)], limiter=limiter)
+    breaker = gateway.breakers["gemini"]
+    half_open(breaker)
+
+    async def cancel_queued_trial():
+        held = await limiter.acquire("gemini", "gemini")
+        call = asyncio.ensure_future(gateway.complete("gemini", "Summarise the chapter."))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        limiter.release(held)
+
+    asyncio.run(cancel_queued_trial())
+    assert breaker.allow()
+
+
+def test_hedge_returns_the_faster_provider_and_cancels_the_slower():
+    gemini, openai = TrackedProvider("gemini", 2), TrackedProvider("openai", 0.01)
+    gateway = LLMGateway([gemini, openai])
+    winner, result = race(gateway, ["gemini", "openai"], hedge_delay=0.05)
+    assert winner == "openai"
+    assert result["provider"] == "openai"
+    assert gemini.cancelled == 1
+    assert openai.cancelled == 0
+
+
+def test_hedged_complete_records_the_winner():
+    gateway = LLMGateway([TrackedProvider("gemini", 2), TrackedProvider("openai", 0.01)])
+    for _ in range(50):
+        gateway._latency("gemini", "complete").record(0.01)
+    before = routed("hedge", "gemini", "openai")
+    result = asyncio.run(gateway.complete("gemini", "Summarise the chapter.", routing="hedge"))
+    assert result["provider"] == "openai"
+    assert routed("hedge", "gemini", "openai") == before + 1
+
+
+def test_failover_moves_past_a_failing_provider():
+    failing = FakeProvider("gemini", latency=0.01, failure_rate=1)
+    gateway = LLMGateway([failing, FakeProvider("openai", latency=0.01)])
+    winner, _ = race(gateway, ["gemini", "openai"])
+    assert winner == "openai"
+
+
+def test_half_open_trial_losing_a_hedge_keeps_the_provider_in_rotation():
+    gateway = LLMGateway([TrackedProvider("gemini", 2), TrackedProvider("openai", 0.01)])
+    breaker = gateway.breakers["gemini"]
+    half_open(breaker)
+    winner, _ = race(gateway, ["gemini", "openai"], hedge_delay=0.05)
+    assert winner == "openai"
+    assert breaker.allow()
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import uuid
+from types import SimpleNamespace
+import mongomock
+import pytest
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+from datastorage import repository
+from datastorage.db_connect import PoolMetricsListener
+
+COLLECTIONS = ("users", "reports", "answer_submissions")
+# mongomock lacks $lookup with `let` and update pipelines, so those paths need a real server.
+MONGODB_TEST_URI = os.getenv("MONGODB_TEST_URI")
+
+
+class AsyncCollection:
+    """A mongomock collection behind the awaitable API of pymongo's async client."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = mongomock.MongoClient()["notesight"]
+    for name in COLLECTIONS:
+        monkeypatch.setattr(repository, f"{name}_collection", AsyncCollection(db[name]))
+    return db
+
+
+@pytest.fixture
+def mongod(monkeypatch):
+    """Runs a test coroutine against a throwaway database on the mongod at MONGODB_TEST_URI."""
+    if not MONGODB_TEST_URI:
+        pytest.skip("set MONGODB_TEST_URI to run against a local mongod")
+
+    def run(test):
+        async def main():
+            client = AsyncMongoClient(MONGODB_TEST_URI)
+            db = client[f"notesight_test_{uuid.uuid4().hex}"]
+            for name in COLLECTIONS:
+                monkeypatch.setattr(repository, f"{name}_collection", db[name])
+            try:
+                await test(db)
+            finally:
+                await client.drop_database(db.name)
+                await client.close()
+        asyncio.run(main())
+    return run
+
+
+def test_created_user_is_found_by_id_and_username(mock_db):
+    async def run():
+        user_id = await repository.create_user("ana", "hashed")
+        return (
+            user_id,
+            await repository.find_user_by_id(user_id, repository.USER_PROFILE_PROJECTION),
+            await repository.username_exists("ana"),
+            await repository.username_exists("bea"),
+        )
+
+    user_id, user, ana_exists, bea_exists = asyncio.run(run())
+    assert user == {"id": user_id, "username": "ana"}
+    assert ana_exists and not bea_exists
+
+
+def test_malformed_user_id_finds_nothing(mock_db):
+    assert asyncio.run(repository.find_user_by_id("not-an-object-id")) is None
+    assert asyncio.run(repository.set_latest_report("not-an-object-id", "report")) is False
+
+
+def test_set_latest_report_links_the_report(mock_db):
+    async def run():
+        user_id = await repository.create_user("ana", "hashed")
+        report_id = await repository.insert_report({"user_id": user_id, "strengths": ["algebra"]})
+        linked = await repository.set_latest_report(user_id, report_id)
+        user = await repository.find_user_by_id(user_id, repository.USER_REPORT_LINK_PROJECTION)
+        return linked, report_id, user, await repository.find_report(report_id)
+
+    linked, report_id, user, report = asyncio.run(run())
+    assert linked
+    assert user["latest_report_id"] == report_id
+    assert report["strengths"] == ["algebra"]
+
+
+def test_submission_keys_are_claimed_once_and_released(mock_db):
+    async def run():
+        first = await repository.claim_submission_keys(["ana:1", "ana:2"])
+        replayed = await repository.claim_submission_keys(["ana:2", "ana:3"])
+        await repository.release_submission_keys(["ana:3"])
+        retried = await repository.claim_submission_keys(["ana:3"])
+        return first, replayed, retried
+
+    first, replayed, retried = asyncio.run(run())
+    assert first == {"ana:1", "ana:2"}
+    assert replayed == {"ana:3"}
+    assert retried == {"ana:3"}
+
+
+def test_pool_listener_tracks_connections_and_checkouts():
+    listener = PoolMetricsListener()
+    listener.connection_created(SimpleNamespace())
+    listener.connection_created(SimpleNamespace())
+    listener.connection_checked_out(SimpleNamespace(duration=0.002))
+    listener.connection_checked_in(SimpleNamespace())
+    listener.connection_checked_in(SimpleNamespace())
+    listener.connection_closed(SimpleNamespace())
+    stats = listener.stats()
+    assert stats["connections"] == 1
+    assert stats["checked_out"] == 0
+
+
+def test_user_is_fetched_with_their_latest_report(mongod):
+    async def test(db):
+        user_id = await repository.create_user("ana", "hashed")
+        report_id = await repository.insert_report({"user_id": user_id, "strengths": ["algebra"], "weaknesses": []})
+        await repository.set_latest_report(user_id, report_id)
+        user = await repository.find_user_with_report(
+            user_id, repository.USER_PROFILE_PROJECTION, repository.REPORT_SUMMARY_PROJECTION
+        )
+        assert user["username"] == "ana"
+        assert user["latest_report"]["_id"] == report_id
+        assert user["latest_report"]["strengths"] == ["algebra"]
+
+        no_report_id = await repository.create_user("bea", "hashed")
+        assert (await repository.find_user_with_report(no_report_id))["latest_report"] is None
+
+    mongod(test)
+
+
+def test_topic_results_accumulate_and_reclassify(mongod):
+    async def test(db):
+        user_id = await repository.create_user("ana", "hashed")
+        report = await repository.record_user_topic_results(user_id, None, {"algebra": (1, 4)})
+        assert report["weaknesses"][0]["subject"] == "algebra"
+
+        report = await repository.record_topic_results(user_id, report["_id"], {"algebra": (7, 8)})
+        assert report["strengths"] == ["algebra"]
+        assert report["weaknesses"] == []
+        stored = await db.reports.find_one({"_id": ObjectId(report["_id"])})
+        assert stored["topic_stats"]["algebra"] == {"correct": 8, "total": 12}
+
+    mongod(test)
+
+
+def test_first_report_race_moves_counts_to_the_winner(mongod):
+    async def test(db):
+        user_id = await repository.create_user("ana", "hashed")
+        reports = await asyncio.gather(*(
+            repository.record_user_topic_results(user_id, None, {"algebra": (1, 2)}) for _ in range(5)
+        ))
+        user = await repository.find_user_by_id(user_id, repository.USER_REPORT_LINK_PROJECTION)
+        assert {report["_id"] for report in reports} == {user["latest_report_id"]}
+        assert await db.reports.count_documents({}) == 1
+        stored = await db.reports.find_one({"_id": ObjectId(user["latest_report_id"])})
+        assert stored["topic_stats"]["algebra"] == {"correct": 5, "total": 10}
+
+    mongod(test)
+
+
+def test_bulk_results_follow_a_report_linked_concurrently(mongod, monkeypatch):
+    async def test(db):
+        user_id = await repository.create_user("ana", "hashed")
+        unknown_id = str(ObjectId())
+        rival = await repository.record_topic_results(user_id, None, {"algebra": (1, 1)})
+
+        class LinkedFirst:
+            """Links the rival report just before the bulk write tries to link its own."""
+
+            def __getattr__(self, name):
+                return getattr(db.users, name)
+
+            async def bulk_write(self, requests, **kwargs):
+                await db.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"latest_report_id": rival["_id"]}})
+                return await db.users.bulk_write(requests, **kwargs)
+
+        monkeypatch.setattr(repository, "users_collection", LinkedFirst())
+        summaries = await repository.record_topic_results_bulk({user_id: {"algebra": (0, 3)}, unknown_id: {"algebra": (1, 1)}})
+
+        assert list(summaries) == [user_id]
+        assert summaries[user_id]["weaknesses"][0]["subject"] == "algebra"
+        assert await db.reports.count_documents({}) == 1
+        stored = await db.reports.find_one({"_id": ObjectId(rival["_id"])})
+        assert stored["topic_stats"]["algebra"] == {"correct": 1, "total": 4}
+
+    mongod(test)
@@ -0,0 +1,51 @@
+import json
+import pytest
+from services.structured import Flashcard, MCQItem, StudentReport, StructuredOutputError, parse_structured_list, parse_structured_object
+
+MCQ = {
+    "Topic": "Algebra",
+    "Question": "What is 2 + 2?",
+    "Options": ["3", "4", "5", "6"],
+    "Correct Answer": "4",
+    "Explanation": "Two plus two is four.",
+}
+
+
+def test_valid_array_is_parsed_into_items():
+    items = parse_structured_list(json.dumps([MCQ, {**MCQ, "Question": "What is 3 + 3?"}]), MCQItem)
+    assert [item.question for item in items] == ["What is 2 + 2?", "What is 3 + 3?"]
+    assert items[0].correct_answer == "4"
+
+
+def test_array_wrapped_in_an_object_is_unwrapped():
+    response = json.dumps({"items": [{"concept": "Osmosis", "definition": "Water crossing a membrane"}]})
+    assert parse_structured_list(response, Flashcard) == [
+        Flashcard(concept="Osmosis", definition="Water crossing a membrane")
+    ]
+
+
+def test_fenced_json_is_parsed():
+    response = "```json\n" + json.dumps([MCQ]) + "\n```"
+    assert parse_structured_list(response, MCQItem)[0].topic == "Algebra"
+
+
+def test_invalid_items_are_dropped():
+    response = json.dumps([MCQ, {"Question": "No options or answer"}, "not an object"])
+    items = parse_structured_list(response, MCQItem)
+    assert len(items) == 1
+
+
+def test_no_valid_items_raises():
+    with pytest.raises(StructuredOutputError, match="no valid MCQItem"):
+        parse_structured_list(json.dumps([{"Question": "No options or answer"}]), MCQItem)
+
+
+@pytest.mark.parametrize("response", ["", None, "Here are your questions: [", "```json\n[{]\n```"])
+def test_invalid_json_raises(response):
+    with pytest.raises(StructuredOutputError, match="not valid JSON"):
+        parse_structured_list(response, MCQItem)
+
+
+def test_object_refusal_raises_its_message():
+    with pytest.raises(StructuredOutputError, match="Not a marksheet"):
+        parse_structured_object(json.dumps({"error": "Not a marksheet"}), StudentReport)
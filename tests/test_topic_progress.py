@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+import pytest
+from core.config import TOPIC_ACCURACY_HALF_LIFE_DAYS
+from datastorage.topic_progress import classify_topics, decay_to
+
+NOW = datetime(2026, 10, 1)
+
+
+def progress_entry(topic, decayed_correct, decayed_total, days_ago):
+    return {
+        "topic": topic,
+        "decayed_correct": decayed_correct,
+        "decayed_total": decayed_total,
+        "accuracy": decayed_correct / decayed_total,
+        "updated_at": NOW - timedelta(days=days_ago),
+    }
+
+
+def test_decay_to_halves_counters_after_one_half_life():
+    entry = decay_to(progress_entry("algebra", 8, 10, TOPIC_ACCURACY_HALF_LIFE_DAYS), NOW)
+    assert entry["decayed_correct"] == pytest.approx(4)
+    assert entry["decayed_total"] == pytest.approx(5)
+
+
+def test_stale_topics_are_left_out():
+    progress = [
+        progress_entry("algebra", 2, 10, TOPIC_ACCURACY_HALF_LIFE_DAYS * 10),
+        progress_entry("geometry", 2, 10, 0),
+    ]
+    classification = classify_topics(progress, now=NOW)
+    assert [weakness["subject"] for weakness in classification["weaknesses"]] == ["geometry"]
+
+
+def test_recent_topics_are_classified_by_accuracy():
+    progress = [
+        progress_entry("algebra", 9, 10, 1),
+        progress_entry("geometry", 6, 10, 1),
+        progress_entry("calculus", 2, 10, 1),
+    ]
+    classification = classify_topics(progress, now=NOW)
+    assert classification["strengths"] == ["algebra"]
+    assert classification["average"] == ["geometry"]
+    assert classification["weaknesses"][0]["subject"] == "calculus"